@@ -9,6 +9,13 @@ import os
 
 from analysis import compute_regression
 from analysis import trim_5_percentiles
+from datasets import load_dataset
+from ga_exports import ingest_exports, read_page_views
+from pages import known_orgs, parse_pages
+from windows import day_offsets, label_windows
+from dimensions import allocations, build_dimensions, ccg_codes, load_rct_ccgs, take
+from membership import bigquery_snapshots, ccg_at, membership_from_snapshots
+from alerts import refresh_alerts, window_counts
 
 import pandas as pd
 import numpy as np
@@ -33,28 +40,18 @@ get_ipython().run_line_magic('autosave', '0')
 # In[3]:
 
 
-# Import page views data from csv
-df1 = pd.read_csv(os.path.join('..','data','page_views_ccg.csv'),usecols={"Page","Date","Pageviews","Unique Pageviews"} )
-dfp = pd.read_csv(os.path.join('..','data','page_views_practice.csv'),usecols={"Page","Date","Pageviews","Unique Pageviews"} ) 
-all_stats = pd.concat([df1,dfp])
+# Import page views data from the Google Analytics exports (page_views_*.csv),
+# via the page views store
+ingest_exports(os.path.join('..','data'))
+all_stats = read_page_views(columns=["Page","Date","Pageviews","Unique Pageviews"])
 all_stats.head()
 
 
 # In[4]:
 
 
-# extract if ccg/practice code from path
-all_stats["org_id"] = np.where(
-    all_stats.Page.str.contains("ccg"),
-    all_stats.Page.str.replace('/ccg/', '').str[:3],
-    all_stats.Page.str.replace('/practice/', '').str[:6])
-all_stats["org_type"] = np.where(
-    all_stats.Page.str.contains("ccg"),
-    "ccg",
-    'practice')
-
-#convert dates to date format
-all_stats["Date"] = pd.to_datetime(all_stats["Date"], format='%Y%m%d')
+# extract org type, ccg/practice code and tags from path
+all_stats = all_stats.join(parse_pages(all_stats.Page))
 
 all_stats.head(2)
 
@@ -62,19 +59,8 @@ all_stats.head(2)
 # In[5]:
 
 
-### CCGs that have been allocated to the RCT 
-rct_ccgs = pd.read_csv(os.path.join('..','data','randomisation_group.csv'))
-
-# Joint Team information (which CCGs work together in Joint Teams)
-team = pd.read_csv(os.path.join('..','data','joint_teams.csv'))
-
-# Map CCGs to Joint Teams
-rct_ccgs = rct_ccgs.merge(team, on="joint_team", how="left")
-
-# Fill blank ccg_ids from joint_id column, so even CCGs not in Joint Teams 
-# have a value for joint_id
-rct_ccgs["pct_id"] = rct_ccgs["ccg_id"].combine_first(rct_ccgs["joint_id"])
-rct_ccgs = rct_ccgs[["joint_id", "allocation", "pct_id"]]
+### CCGs that have been allocated to the RCT, mapped to Joint Teams
+rct_ccgs = load_rct_ccgs()
 
 # Add numerical intervention field
 rct_ccgs['intervention'] = rct_ccgs.allocation.map({'con': 0, 'I': 1})
@@ -100,17 +86,27 @@ practice_to_ccg.to_csv(os.path.join('..','data','practice_to_ccg.csv'))
 # In[7]:
 
 
-# extract practice statistics for practices that are members of CCGs who are in the RCT
-rct_practices = rct_ccgs[["pct_id"]].merge(practice_to_ccg, left_on="pct_id", right_on ="ccg_id", how="left")
-# add a new "ccg_id" column just for practices
-all_stats_with_ccg = all_stats.merge(
-    rct_practices[["ccg_id", "code"]],
-    left_on="org_id",
-    right_on="code",
-    how="left").drop("code", axis=1)
-all_stats_with_ccg.loc[all_stats_with_ccg.org_id.str.len() == 3, "ccg_id"] = all_stats_with_ccg.org_id
-# Add joint team id and allocation onto the new stats
-stats_with_allocations = rct_ccgs.merge(all_stats_with_ccg, left_on="pct_id",right_on="ccg_id",how="left")
+# practices' CCG membership over time, from snapshots of the practice table
+membership = membership_from_snapshots(bigquery_snapshots(GBQ_PROJECT_ID))
+
+# drop page views of unknown ccgs and practices
+all_stats = all_stats.loc[known_orgs(all_stats, membership.ccgs, membership.practices)]
+
+# integer-coded lookups from practices to CCGs, joint teams and allocations
+dims = build_dimensions(rct_ccgs, practice_to_ccg)
+
+# Add joint team id and allocation onto the stats, from each page's CCG
+# (or for practice pages the CCG the practice was in on the day),
+# keeping only CCGs in the RCT
+page_ccgs = ccg_codes(dims, all_stats.org_id)
+page_ccgs = np.where(
+    page_ccgs >= 0, page_ccgs,
+    ccg_at(membership, all_stats.org_id, all_stats.Date, dims.ccgs))
+page_joints = take(dims.ccg_joint, page_ccgs)
+in_rct = page_joints >= 0
+stats_with_allocations = all_stats.join(
+    allocations(dims, page_ccgs, index=all_stats.index)).loc[in_rct]
+page_joints = page_joints[in_rct]
 
 
 # In[8]:
@@ -143,8 +139,7 @@ joint_team_populations.head()
 
 
 # import dates of interventions
-visit_dates = pd.read_csv(os.path.join('..','data','allocated_ccgs_visit_timetable.csv'))
-visit_dates["date"] = pd.to_datetime(visit_dates.date)
+visit_dates = load_dataset('allocated_ccgs_visit_timetable.csv')
 
 # merge with rct_ccgs/joint teams
 allocations_with_dates = rct_ccgs.merge(visit_dates, on="joint_id", how="left").drop("pct_id", axis=1).drop_duplicates()
@@ -163,11 +158,13 @@ allocations_with_dates_and_sizes.head()
 # In[11]:
 
 
-# join joint-group / ccg allocations, visit dates and list size info to page views data
-all_data = allocations_with_dates_and_sizes.drop("size_rank", axis=1)       .merge(
-           stats_with_allocations.drop(["allocation", "pct_id", "ccg_id", "intervention"], axis=1),
-           how='left',
-           on='joint_id')
+# add joint-group allocations, visit dates and list size info to page views
+# data, gathered by each page view's joint team code (joint teams without page
+# views have no rows, as they would drop out of the aggregation below anyway)
+joints = allocations_with_dates_and_sizes.drop_duplicates("joint_id")     .set_index("joint_id").reindex(dims.joint_ids)
+all_data = stats_with_allocations.drop(["allocation", "pct_id", "intervention"], axis=1)
+for column in ["allocation", "intervention", "list_size", "date_int"]:
+    all_data[column] = joints[column].to_numpy()[page_joints]
 all_data.head(2)
 
 
@@ -175,13 +172,13 @@ all_data.head(2)
 
 
 # assign each page view occurrence to before vs after intervention (1 month ~ 28 days)
+# from its joint team's intervention date, in days
+page_view_windows = {"before": (-28, 0), "after": (1, 29)}
 
-all_data["datediff"] = all_data.Date - all_data.date_int
-all_data["timing"] = "none"
-all_data.loc[(all_data.datediff <= "28 days") & (all_data.datediff > "0 days"),
-      "timing"] = "after"
-all_data.loc[(all_data.datediff >= "-28 days") & (all_data.datediff < "0 days"),
-      "timing"] = "before"
+all_data["datediff"] = day_offsets(
+    all_data.joint_id, all_data.Date,
+    allocations_with_dates_and_sizes.joint_id, allocations_with_dates_and_sizes.date_int)
+all_data["timing"] = label_windows(all_data.datediff, page_view_windows)
 all_data["Unique Pageviews"] = all_data["Unique Pageviews"].fillna(0)
 all_data.head(2)
 
@@ -192,7 +189,7 @@ all_data.head(2)
 # group up page views data to joint teams and sum page views before
 # and after interventions
 
-all_data_agg = all_data.groupby(["intervention", "joint_id", "org_type", "list_size", "timing"])      .agg({"Unique Pageviews": sum, "Page": "nunique"}).unstack().unstack(2).fillna(0).stack()
+all_data_agg = all_data.groupby(["intervention", "joint_id", "org_type", "list_size", "timing"], observed=True)      .agg({"Unique Pageviews": sum, "Page": "nunique"}).unstack().unstack(2).fillna(0).stack()
 # added an extra unstack and stack here to fill nulls with zero and ensure each joint_id always counted in its allocation group
 #even if it does not have any page views in either the ccg or practice org_type
 
@@ -252,90 +249,28 @@ compute_regression(
 # In[16]:
 
 
-# import data from django administration, filtered for confirmed sign-ups only (no date filter)
-
-alerts = pd.read_csv(os.path.join('..','data','orgbookmarks-2019-04-30.csv'))
-alerts["created_at"] = pd.to_datetime(alerts.created_at).dt.strftime('%Y-%m-%d')
-
-alerts = alerts.loc[alerts["approved"]=="t"] 
-## added this extra step to filter for confirmed sign ups as download from archive is not pre-filtered
-
-alerts = alerts.rename(columns={"pct_id":"pct", "practice_id":"practice", "user_id":"user"})
-alerts.head()
-
-
-# In[17]:
-
-
-# map practices to joint teams (and thus only include RCT subjects)
-alerts = alerts.merge(
-    rct_practices[["ccg_id", "code"]],
-    left_on="practice",
-    right_on="code",
-    how="left").drop("code",axis=1)
-# Fill nulls in ccg_id column from values in pct colume
-alerts.ccg_id = alerts.ccg_id.combine_first(alerts.pct)
-alerts.head()
-
-
-# In[18]:
-
-
-# Add RCT allocations to data
-alerts = rct_ccgs.merge(alerts, left_on="pct_id", right_on="ccg_id", how="left")
-# flag whether each alert is a practice or CCG alert
-conditions = [
-    (alerts.pct.str.len()==3),
-    (alerts.practice.str.len()==6)]
-
-choices = ['ccg', 'practice']
-alerts['org_type'] = np.select(conditions, choices, default='none')
-alerts.head()
-
-
-# In[19]:
-
-
-# join to visit dates
-alerts_with_dates_and_stats = allocations_with_dates_and_sizes                              .drop(["size_rank", "allocation", "intervention"],axis=1)                              .merge(alerts.drop(["approved"], axis=1),
-                                     how='left', on='joint_id')
-alerts_with_dates_and_stats.head()
-
-
-# In[20]:
-
-
-# assign each page view occurrence to before vs after intervention (1
-# month ~ 28 days)
-alerts_with_dates_and_stats["created_at"] = pd.to_datetime(alerts_with_dates_and_stats.created_at)
-alerts_with_dates_and_stats["datediff"] = (
-    alerts_with_dates_and_stats.created_at - alerts_with_dates_and_stats.date_int)
-alerts_with_dates_and_stats["timing"] = "none"
-# all alerts set up prior to day of intervention will be used as a co-variable:
-alerts_with_dates_and_stats.loc[
-    (alerts_with_dates_and_stats.datediff < "0 days"),
-    "timing"] = "before"
-
-
-# In[21]:
-
-
-# main outcome: alerts set up within 3 months of intervention:
-alerts_with_dates_and_stats.loc[
-    (alerts_with_dates_and_stats.datediff >= "0 days") &
-    (alerts_with_dates_and_stats.datediff <= "84 days"),
-    "timing"] = "after"  # (within 3 months)
+# import data from django administration (no date filter), adding any new or changed
+# sign-ups to the alerts log, and index confirmed sign-ups by org, day and user
+alert_users = refresh_alerts(load_dataset('orgbookmarks-2019-04-30.csv'))
 
 
 # In[22]:
 
 
-# aggregate data: sum alerts before and after intervention for each joint team
-alerts_agg = alerts_with_dates_and_stats     .groupby(["intervention", "joint_id", "list_size", "timing", "org_type"])     .agg({"user": "nunique"})     .unstack()     .fillna(0)
-alerts_agg = alerts_agg.rename(columns={"user": "alerts"}).unstack().reset_index().fillna(0)
-
-# flatten columns:
-alerts_agg.columns = alerts_agg.columns.map('_'.join).map(lambda x: x.rstrip("_"))
+# count distinct users signing up to CCG alerts, and to alerts for the practices in
+# each joint team (at the time of sign-up), before and after intervention
+alert_windows = {
+    # all alerts set up prior to day of intervention will be used as a co-variable:
+    "before": (None, 0),
+    # main outcome: alerts set up within 3 months of intervention:
+    "after": (0, 85),
+}
+alerts_agg = allocations_with_dates_and_sizes[["intervention", "joint_id", "list_size"]].join(
+    window_counts(alert_users, membership, rct_ccgs,
+                  allocations_with_dates_and_sizes.drop_duplicates("joint_id")
+                  .set_index("joint_id").date_int,
+                  alert_windows),
+    on="joint_id")
 
 alerts_agg["list_size_100k"] = alerts_agg["list_size"]/100000
 alerts_agg = alerts_agg[
@@ -347,8 +282,6 @@ alerts_agg = alerts_agg[
      "alerts_practice_after",
      "alerts_practice_before"]]
 
-
-
 alerts_agg.head()
 
 
@@ -11,11 +11,17 @@
 
 
 import os
-import requests
 import pandas as pd
 import numpy as np
 
 from analysis import compute_regression
+from cube import CUBE_PATH, aggregate_periods, build_cube
+from datasets import load_dataset
+from dimensions import load_rct_ccgs
+from measure_definitions import get_definition
+from permutation import permutation_test
+from measures import bigquery_reader, get_measure_data
+from measure_store import STORE_PATH, read_measure_data, refresh_measure_data
 
 import logging
 logger = logging.getLogger('pandas_gbq')
@@ -36,14 +42,10 @@ all_measures = ['lpcoprox', 'lpdosulepin', 'lpdoxazosin',
                 'lpomega3', 'lpoxycodone', 'lpperindopril', 
                 'lprubefacients', 'lptadalafil', 'lptramadolpara', 
                 'lptravelvacs', 'lptrimipramine','lpherbal']
-definition_url = (
-    "https://raw.githubusercontent.com/ebmdatalab/openprescribing/"
-    "{commit}/openprescribing/frontend/management/commands/measure_definitions/"
-    "{measure}.json")
 commit_for_measure_definitions = "6f949660fee06401102136926eaba075d963511d"
 
 # import herbal list manually due to different construction of query based on a separate file
-herbal_bnf_list = pd.read_csv(os.path.join('..','data','herbal_list.csv'), usecols=["bnf_code"])
+herbal_bnf_list = load_dataset('herbal_list.csv', columns=["bnf_code"])
 herbal_bnf_list = tuple(herbal_bnf_list["bnf_code"])
 
 
@@ -52,95 +54,62 @@ herbal_bnf_list = tuple(herbal_bnf_list["bnf_code"])
 
 # Import data from BigQuery
 # (Specifically, per-measure cost/items numerators, and population denominators)
-if DUMMY_RUN and os.path.exists(os.path.join('..','data','all_measure_data.csv')):
-    rawdata = pd.read_csv(os.path.join('..','data','all_measure_data.csv')).drop(['Unnamed: 0'], axis=1)
-else:
-    rawdata = pd.DataFrame()
-    sql_template = open("measure.sql", "r").read()
+# Only months newer than those already in the local measure store are
+# fetched; on a dummy run nothing is fetched if the store exists.
+if not (DUMMY_RUN and os.path.exists(STORE_PATH)):
+    where_conditions = {}
     for measure in all_measures:
         if measure == "lpherbal":
-            where_condition = f"(bnf_code IN {herbal_bnf_list})"
+            where_conditions[measure] = f"(bnf_code IN {herbal_bnf_list})"
         else:
-            measure_definition = requests.get(definition_url.format(
-                commit=commit_for_measure_definitions, measure=measure)).json()
-            where_condition = " ".join(measure_definition['numerator_where'])
-        sql = sql_template.format(
-            date_from=baseline_start, 
-            date_to=post_followup_start, 
-            where_condition=where_condition)
-        df = pd.read_gbq(sql, GBQ_PROJECT_ID, dialect='standard')
-        df["month"] = pd.to_datetime(df.month)
-        df["measure"] = measure
-        rawdata = rawdata.append(df)
+            # definitions are cached locally after the first fetch
+            where_conditions[measure] = get_definition(
+                measure, commit_for_measure_definitions).numerator_condition
+    # all measures are fetched in a single query, sharing one denominator
+    def fetch(date_from, date_to):
+        return get_measure_data(
+            where_conditions,
+            date_from=date_from,
+            date_to=date_to,
+            read_sql=bigquery_reader(GBQ_PROJECT_ID))
+    refresh_measure_data(
+        fetch, baseline_start, post_followup_start, measures=all_measures)
+rawdata = read_measure_data(
+    measures=all_measures, date_from=baseline_start, date_to=post_followup_start)
 rawdata.head(1)
 
 
-# In[3]:
-
-
-rawdata.to_csv(os.path.join('..','data','all_measure_data.csv'))
-
-
 # In[4]:
 
 
-# Aggregate across all measures 
-data = rawdata.groupby(["pct_id", "month"]).agg(
-    {'items':'sum', 'cost': 'sum', 'denominator':'first'}).reset_index()
-data = data.rename(columns={"cost": "numerator"})
-data['calc_value'] = data['numerator'] / data['denominator']
-data.head(2)
+# Build the org x measure x month cube, which the secondary outcomes
+# notebook loads from disk
+cube = build_cube(rawdata, CUBE_PATH)
+cube.values.shape
 
 
 # In[5]:
 
 
 # select data only for the baseline and follow-up periods
-
-conditions = [
-    (data['month'] >= post_followup_start),
-    (data['month'] >= followup_start),
-    (data['month'] >= mid_start),
-    (data['month'] >= baseline_start),
-    (data['month'] < baseline_start)]
-
-choices = ['after', 'follow-up', 'mid', 'baseline', 'before']
-data['period'] = np.select(conditions, choices, default='0')
-# Restrict to columns of interest
-data = data[["pct_id", "period", "month", "numerator", "denominator", "items"]]
-data = data.loc[
-    (data['period'] == "baseline") | (data['period'] == "follow-up")
-].set_index(["pct_id", "period", "month"])
-
-data.head(3)
+periods = {
+    "baseline": (baseline_start, mid_start),
+    "follow-up": (followup_start, post_followup_start)}
 
 
 # In[6]:
 
 
-# group measurements for each CCG for each period
-agg_6m = data.groupby(["pct_id", "period"]).agg(
-    {"numerator": "sum", "items": "sum", "denominator": "mean"})
+# group measurements for each CCG for each period, summed across all measures
+agg_6m = aggregate_periods(cube, periods).rename(columns={"cost": "numerator"})
 agg_6m.head()
 
 
 # In[7]:
 
 
-### CCGs that have been allocated to the RCT 
-rct_ccgs = pd.read_csv(os.path.join('..','data','randomisation_group.csv'))
-
-
-# Joint Team information (which CCGs work together in Joint Teams)
-team = pd.read_csv(os.path.join('..','data','joint_teams.csv'))
-
-# Map CCGs to Joint Teams
-rct_ccgs = rct_ccgs.merge(team, on="joint_team", how="left")
-
-# Fill blank ccg_ids from joint_id column, so even CCGs not in Joint Teams 
-# have a value for joint_id
-rct_ccgs["pct_id"] = rct_ccgs["ccg_id"].combine_first(rct_ccgs["joint_id"])
-rct_ccgs = rct_ccgs[["joint_id", "allocation", "pct_id"]]
+### CCGs that have been allocated to the RCT, mapped to Joint Teams
+rct_ccgs = load_rct_ccgs()
 
 # Combine CCG/Joint Team info with measure data
 rct_ccgs = rct_ccgs.merge(agg_6m.reset_index(), on="pct_id", how="left")
@@ -268,6 +237,20 @@ formula = ('data["follow_up_items_thou"] '
 compute_regression(rct_agg_6m, formula=formula)
 
 
+# ### Randomisation inference
+# Permutation tests of P1 and P2: the allocation is re-drawn 100,000 times under the rule used in the allocation notebook, and the intervention coefficient is recomputed for every draw.
+
+# In[ ]:
+
+
+for outcome, baseline in [("follow_up_calc_value", "baseline_calc_value"),
+                          ("follow_up_items_thou", "baseline_items_thou")]:
+    result = permutation_test(rct_agg_6m, outcome, [baseline], n_workers=os.cpu_count())
+    print(outcome, "coefficient:", round(result.estimate, 2),
+          "p-value:", round(result.p_value, 4),
+          "95% CI:", tuple(round(x, 2) for x in result.conf_int))
+
+
 # ### Sensitivity Analysis
 
 # Some CCGs did not successfully receive the intervention.
@@ -275,8 +258,8 @@ compute_regression(rct_agg_6m, formula=formula)
 # In[14]:
 
 
-visit = pd.read_csv(os.path.join('..','data','allocated_ccgs_visit_timetable.csv'))
-visit["flag"] = np.where(visit["date"].str.len()>0,1,0)
+visit = load_dataset('allocated_ccgs_visit_timetable.csv')
+visit["flag"] = np.where(visit["date"].notna(),1,0)
 
 data2 = rct_agg_6m.merge(visit, on="joint_id", how="left").drop("date", axis=1)
 data2["flag"] = data2["flag"].fillna(0).astype("int")
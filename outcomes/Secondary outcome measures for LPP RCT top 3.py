@@ -11,12 +11,11 @@
 # In[1]:
 
 
-import os
 import requests
-import pandas as pd
-import numpy as np
 
-from analysis import compute_regression
+from analysis import compute_regression, measure_regressions
+from cube import CUBE_PATH, aggregate_periods, load_cube
+from dimensions import load_rct_ccgs
 
 GBQ_PROJECT_ID = '620265099307'
 
@@ -33,53 +32,28 @@ post_followup_start = '2019-10-01'  # month after end of follow-up period
 # Load data which should have been generated already by running the 
 # primary outcome notebook
 # (Specifically, per-measure cost/items numerators, and population denominators)
-rawdata = pd.read_csv(os.path.join('..','data','all_measure_data.csv'))
-rawdata["month"] = pd.to_datetime(rawdata.month)
-rawdata.head(2)
+cube = load_cube(CUBE_PATH)
+cube.values.shape
 
 
 # In[3]:
 
 
-data = rawdata.copy()
-
 ### select data only for the baseline and follow-up periods
-import datetime
-
-conditions = [
-    (data['month'] >= post_followup_start),
-    (data['month'] >= followup_start),
-    (data['month'] >= mid_start),
-    (data['month'] >= baseline_start),
-    (data['month'] < baseline_start)]
-
-choices = ['after', 'follow-up', 'mid', 'baseline','before']
-data['period'] = np.select(conditions, choices, default='0')
-
-# take columns of interest from df
-df2 = data[["measure","pct_id","period", "month", "cost","items","denominator"]]
-df2 = df2.loc[(df2['period']== "baseline") | (df2['period']== "follow-up")].set_index(
-    ["pct_id","period", "month"])
-df2.head()
+periods = {
+    "baseline": (baseline_start, mid_start),
+    "follow-up": (followup_start, post_followup_start)}
 
 
 # In[4]:
 
 
 ### sum numerator and average population denominators for each CCG for each period
-agg_6m = df2.groupby(["measure","pct_id","period"]).agg({"cost":sum,"items":sum,"denominator":"mean"})
+agg_6m = aggregate_periods(cube, periods, by_measure=True)
 agg_6m.head()
 
-### CCGs that have been allocated in the RCT
-ccgs = pd.read_csv(os.path.join('..','data','randomisation_group.csv'))
-# import joint team information
-team = pd.read_csv(os.path.join('..','data','joint_teams.csv'))
-
-ccgs = ccgs.merge(team,on="joint_team", how="left")
-#fill blank ccg_ids from joint_id column, so even CCGs not in Joint Teams 
-# have a value for joint_id
-ccgs["pct_id"] = ccgs["ccg_id"].combine_first(ccgs["joint_id"])
-ccgs = ccgs[["joint_id","allocation","pct_id"]]
+### CCGs that have been allocated in the RCT, with joint team information
+ccgs = load_rct_ccgs()
  
 # Combine CCG/Joint Team info with measure data
 rct_agg_6m = ccgs.merge(agg_6m.reset_index(), on="pct_id",how="left")
@@ -218,3 +192,11 @@ display(out)
 formula = ('data["follow_up_calc_value"] ~ data["baseline_calc_value"] +intervention')
 compute_regression(data, formula=formula)
 
+
+# ## All measures
+# Cost and items per 1000 registered patients for every low-priority measure, with Holm-adjusted p-values for the intervention coefficient.
+
+# In[ ]:
+
+
+measure_regressions(rct_agg_6m, metrics=("cost", "items"), correction="holm")
@@ -0,0 +1,265 @@
+"""
+Incremental counts of distinct users signing up to alerts.
+
+Each export of alert sign-ups from the django administration (such as
+`orgbookmarks-2019-04-30.csv`) is a snapshot of every bookmark so far.
+Snapshots are added to an append-only log in `LOG_PATH`, one Parquet
+part per snapshot holding only the bookmarks that are new or have
+changed (say, been approved) since the last one; the latest version of
+each bookmark `id` wins. Bookmarks missing from a later snapshot stay
+in the log.
+
+Approved bookmarks are indexed by the org they are for (a CCG or a
+practice), the day they were created and their user, as sorted keys
+packing the org's code with the day (see `dimensions.day_keys`), with
+the user of each entry and how many bookmarks it stands for. The
+users of any orgs over any date range are then a few contiguous slices
+of the index, found with `np.searchsorted`, so counting distinct users
+never rescans the bookmarks. Adding a snapshot merges only its changes
+into the index, which is saved alongside the log.
+"""
+import glob
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from dimensions import DAY_SPAN, day_keys, lookup
+from membership import members
+
+LOG_PATH = os.path.join('..', 'data', 'alerts_log')
+INDEX_FILE = 'index.npz'
+
+COLUMNS = ["id", "pct_id", "practice_id", "user_id", "created_at", "approved"]
+
+UserIndex = namedtuple("UserIndex", [
+    "orgs", "users", "keys", "user_codes", "counts", "n_parts"])
+
+
+def _parts(path):
+    return sorted(glob.glob(os.path.join(path, 'part-*.parquet')))
+
+
+def _tidy(df):
+    # Bookmarks with plain columns, so snapshots and the log compare equal
+    df = df[COLUMNS].copy()
+    for column in ["pct_id", "practice_id", "approved"]:
+        df[column] = df[column].astype(object).where(df[column].notna(), None)
+    df["created_at"] = pd.to_datetime(df.created_at)
+    return df
+
+
+def read_log(path=LOG_PATH):
+    """Return the latest version of every bookmark in the log."""
+    parts = _parts(path)
+    if not parts:
+        return _tidy(pd.DataFrame(columns=COLUMNS))
+    df = pd.concat(
+        [pq.read_table(part).to_pandas() for part in parts], ignore_index=True)
+    # parts are in snapshot order, so the last version of a bookmark is latest
+    return _tidy(df.drop_duplicates("id", keep="last"))
+
+
+def ingest_snapshot(snapshot, path=LOG_PATH):
+    """Append the bookmarks in `snapshot` that are new or changed to the log.
+
+    Returns the appended bookmarks, and the versions in the log that
+    they replace.
+    """
+    snapshot = _tidy(snapshot).drop_duplicates("id", keep="last")
+    logged = read_log(path).set_index("id")
+    previous = logged.reindex(snapshot.id)
+    same = np.ones(len(snapshot), dtype=bool)
+    for column in COLUMNS[1:]:
+        new = snapshot[column].to_numpy()
+        old = previous[column].to_numpy()
+        same &= (new == old) | (pd.isnull(new) & pd.isnull(old))
+    added = snapshot.loc[~same].reset_index(drop=True)
+    replaced = logged.loc[logged.index.intersection(added.id)].reset_index()
+    if len(added):
+        os.makedirs(path, exist_ok=True)
+        part = os.path.join(path, 'part-{:05d}.parquet'.format(len(_parts(path))))
+        # Write to a temporary file first, so an interrupted write is not used
+        pq.write_table(
+            pa.Table.from_pandas(added, preserve_index=False), part + ".tmp")
+        os.replace(part + ".tmp", part)
+    return added, replaced
+
+
+def _entries(bookmarks):
+    # The (org, day, user) of each approved bookmark
+    bookmarks = bookmarks.loc[bookmarks.approved == "t"]
+    orgs = bookmarks.practice_id.where(
+        bookmarks.practice_id.notna(), bookmarks.pct_id)
+    keep = (orgs.notna() & bookmarks.created_at.notna()).to_numpy()
+    return (orgs.to_numpy(dtype=object)[keep],
+            bookmarks.created_at.to_numpy(dtype='datetime64[ns]')[keep],
+            bookmarks.user_id.to_numpy(dtype=np.int64)[keep])
+
+
+def empty_index():
+    """Return an index of no bookmarks."""
+    return UserIndex(
+        pd.Index([], dtype=object, name="org"),
+        pd.Index([], dtype=np.int64, name="user_id"),
+        np.array([], dtype=np.int64), np.array([], dtype=np.int64),
+        np.array([], dtype=np.int64), 0)
+
+
+def update_index(index, added, removed=None, n_parts=None):
+    """Merge bookmarks added to and removed from the log into `index`.
+
+    Only approved bookmarks are counted. `n_parts` is the number of log
+    parts the updated index reflects.
+    """
+    org_ids, dates, user_ids = _entries(added)
+    signs = np.ones(len(dates), dtype=np.int64)
+    if removed is not None:
+        removed_orgs, removed_dates, removed_users = _entries(removed)
+        org_ids = np.concatenate([org_ids, removed_orgs])
+        dates = np.concatenate([dates, removed_dates])
+        user_ids = np.concatenate([user_ids, removed_users])
+        signs = np.concatenate([signs, -np.ones(len(removed_dates), dtype=np.int64)])
+
+    # new orgs and users are added to the sorted indexes, and the codes
+    # already in the index are recoded to match
+    orgs = index.orgs.union(pd.Index(np.unique(org_ids), dtype=object))
+    users = index.users.union(pd.Index(np.unique(user_ids), dtype=np.int64))
+    old_orgs = orgs.get_indexer(index.orgs)[index.keys // DAY_SPAN]
+    old_users = users.get_indexer(index.users)[index.user_codes]
+    keys = np.concatenate([
+        old_orgs * DAY_SPAN + index.keys % DAY_SPAN,
+        day_keys(orgs.get_indexer(org_ids), dates, 0)])
+    user_codes = np.concatenate([old_users, users.get_indexer(user_ids)])
+    counts = np.concatenate([index.counts, signs])
+    n_parts = index.n_parts if n_parts is None else n_parts
+    if not len(keys):
+        return UserIndex(
+            orgs.rename("org"), users.rename("user_id"), keys, user_codes,
+            counts, n_parts)
+
+    # sum the counts of each (org, day, user), dropping those that reach zero
+    order = np.lexsort((user_codes, keys))
+    keys, user_codes, counts = keys[order], user_codes[order], counts[order]
+    first = np.r_[True, (keys[1:] != keys[:-1]) | (user_codes[1:] != user_codes[:-1])]
+    starts = np.flatnonzero(first)
+    counts = np.add.reduceat(counts, starts)
+    keys, user_codes = keys[starts], user_codes[starts]
+    keep = counts > 0
+    return UserIndex(
+        orgs.rename("org"), users.rename("user_id"), keys[keep],
+        user_codes[keep], counts[keep], n_parts)
+
+
+def build_index(bookmarks, n_parts=0):
+    """Index `bookmarks`, such as the whole log."""
+    return update_index(empty_index(), bookmarks, n_parts=n_parts)
+
+
+def save_index(index, path=LOG_PATH):
+    """Save `index` alongside the log."""
+    os.makedirs(path, exist_ok=True)
+    target = os.path.join(path, INDEX_FILE)
+    with open(target + ".tmp", 'wb') as f:
+        np.savez(
+            f, orgs=index.orgs.to_numpy(dtype=str),
+            users=index.users.to_numpy(dtype=np.int64), keys=index.keys,
+            user_codes=index.user_codes, counts=index.counts,
+            n_parts=index.n_parts)
+    os.replace(target + ".tmp", target)
+
+
+def load_index(path=LOG_PATH):
+    """Load the index saved alongside the log.
+
+    The index is rebuilt from the log if it is missing or does not
+    reflect every part of the log.
+    """
+    n_parts = len(_parts(path))
+    target = os.path.join(path, INDEX_FILE)
+    if os.path.exists(target):
+        with np.load(target) as saved:
+            if int(saved["n_parts"]) == n_parts:
+                return UserIndex(
+                    pd.Index(saved["orgs"].astype(object), name="org"),
+                    pd.Index(saved["users"], name="user_id"),
+                    saved["keys"], saved["user_codes"], saved["counts"],
+                    n_parts)
+    return build_index(read_log(path), n_parts)
+
+
+def refresh_alerts(snapshot, path=LOG_PATH):
+    """Add a snapshot of bookmarks to the log and return the updated index.
+
+    `snapshot` is a frame of bookmarks, as loaded by
+    `datasets.load_dataset('orgbookmarks-<date>.csv')`.
+    """
+    index = load_index(path)
+    added, replaced = ingest_snapshot(snapshot, path)
+    index = update_index(index, added, replaced, len(_parts(path)))
+    save_index(index, path)
+    return index
+
+
+def _broadcast(dates, n):
+    # One date (or None) for every org, or a date for each
+    if dates is None:
+        dates = pd.NaT
+    return [dates] * n if not np.ndim(dates) else dates
+
+
+def distinct_users(index, orgs, date_from=None, date_to=None):
+    """Count the distinct users with bookmarks for any of `orgs`.
+
+    Only bookmarks created in [date_from, date_to) count. The dates may
+    be None (unbounded), one date for every org, or a date for each org,
+    NaT where unbounded.
+    """
+    org_codes = lookup(index.orgs, orgs)
+    starts = day_keys(org_codes, _broadcast(date_from, len(org_codes)), 0)
+    ends = day_keys(org_codes, _broadcast(date_to, len(org_codes)), DAY_SPAN)
+    found = org_codes >= 0
+    lo = np.searchsorted(index.keys, starts[found])
+    hi = np.searchsorted(index.keys, ends[found])
+    lengths = np.maximum(hi - lo, 0)
+    # positions of every entry in the slices [lo, hi)
+    positions = np.arange(lengths.sum()) - np.repeat(
+        np.cumsum(lengths) - lengths - lo, lengths)
+    seen = np.zeros(len(index.users), dtype=bool)
+    seen[index.user_codes[positions]] = True
+    return int(seen.sum())
+
+
+def window_counts(index, membership, rct_ccgs, dates, windows):
+    """Count distinct users of CCG and practice alerts around each date.
+
+    `dates` is a Series of intervention dates indexed by joint team,
+    whose CCGs are listed in `rct_ccgs` (as from
+    `dimensions.load_rct_ccgs`), and `windows` are day offsets from
+    them as in `windows.py`. Practice alerts count for the joint team
+    their practice was in on the day they were created. Returns a
+    frame indexed by joint team, with columns `alerts_ccg_<window>`
+    and `alerts_practice_<window>`; joint teams without a date have no
+    alerts.
+    """
+    counts = {
+        "alerts_{}_{}".format(org_type, name): []
+        for name in windows for org_type in ["ccg", "practice"]}
+    for joint_id, date in dates.items():
+        ccgs = rct_ccgs.pct_id[rct_ccgs.joint_id == joint_id]
+        for name, (start, end) in windows.items():
+            ccg_users = practice_users = 0
+            if pd.notnull(date):
+                date_from = None if start is None else date + pd.Timedelta(days=start)
+                date_to = None if end is None else date + pd.Timedelta(days=end)
+                ccg_users = distinct_users(index, ccgs, date_from, date_to)
+                practices = members(membership, ccgs, date_from, date_to)
+                practice_users = distinct_users(
+                    index, practices.code, practices.valid_from,
+                    practices.valid_to)
+            counts["alerts_ccg_{}".format(name)].append(ccg_users)
+            counts["alerts_practice_{}".format(name)].append(practice_users)
+    return pd.DataFrame(counts, index=pd.Index(dates.index, name="joint_id"))
@@ -1,24 +1,32 @@
+import itertools
+from collections import namedtuple
+
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from IPython.display import display
+from scipy import stats
 import statsmodels.formula.api as smf
+from statsmodels.stats.multitest import multipletests
+
+from sketch import QuantileSketch
+
+BatchedOLS = namedtuple(
+    "BatchedOLS", ["params", "bse", "tvalues", "pvalues", "df_resid"])
+RegressionResult = namedtuple(
+    "RegressionResult",
+    ["params", "bse", "conf_int", "pvalues", "nobs", "df_resid"])
 
 
 def trim_5_percentiles(df, debug=False):
     # max-out top 5% to reduce any extreme outliers
     df = df.copy()
-
-    max_out = df['Unique Pageviews_before'].quantile(0.95)
-    df["proxy_pageviews_before"] = np.where(
-        df['Unique Pageviews_before'] < max_out,
-        df['Unique Pageviews_before'],
-        max_out)
-    max_out_b = df['Unique Pageviews_after'].quantile(0.95)
-    df["proxy_pageviews_after"] = np.where(
-        df['Unique Pageviews_after'] < max_out_b,
-        df['Unique Pageviews_after'],
-        max_out_b)
+    winsorize(
+        df,
+        ['Unique Pageviews_before', 'Unique Pageviews_after'],
+        upper=0.95,
+        output={'Unique Pageviews_before': "proxy_pageviews_before",
+                'Unique Pageviews_after': "proxy_pageviews_after"})
 
     if debug:
         result = pd.DataFrame(
@@ -42,9 +50,96 @@ def trim_5_percentiles(df, debug=False):
     return df
 
 
-def compute_regression(df, formula=""):
+def _cap(df, columns, low, high, output):
+    values = np.clip(df[columns].to_numpy(dtype=float), low, high)
+    for i, column in enumerate(columns):
+        df[output.get(column, column)] = values[:, i]
+
+
+def winsorize(df, columns, lower=None, upper=None, by=None, output=None):
+    """Cap `columns` of `df` at their `lower` and `upper` quantiles.
+
+    Either quantile may be None to leave that side uncapped. With `by`
+    (a column name or list of them), quantiles are computed within each
+    group. All quantiles come from a single (grouped) `quantile` call.
+    Capped values overwrite the columns in place, unless `output` maps a
+    column to the name of a new column to write instead. Returns `df`.
+    """
+    columns = list(columns)
+    output = output or {}
+    quantiles = [q for q in (lower, upper) if q is not None]
+    if by is None:
+        bounds = df[columns].quantile(quantiles)
+        low = bounds.loc[lower].to_numpy() if lower is not None else -np.inf
+        high = bounds.loc[upper].to_numpy() if upper is not None else np.inf
+    else:
+        grouped = df.groupby(by)
+        bounds = grouped[columns].quantile(quantiles)
+        # rows without a group (missing keys) are left uncapped
+        codes = grouped.ngroup().fillna(-1).astype(int).to_numpy()
+        def per_row(q, default):
+            per_group = bounds.xs(q, level=-1).to_numpy()
+            per_group = np.vstack([per_group, np.full((1, len(columns)), default)])
+            per_group[np.isnan(per_group)] = default
+            return per_group[codes]
+        low = -np.inf if lower is None else per_row(lower, -np.inf)
+        high = np.inf if upper is None else per_row(upper, np.inf)
+    _cap(df, columns, low, high, output)
+    return df
+
+
+def winsorize_chunks(read_chunks, columns, lower=None, upper=None, by=None,
+                     output=None, compression=200):
+    """Winsorize a table too big for memory, one chunk at a time.
+
+    `read_chunks` is called twice and must return an iterable of
+    DataFrames each time, e.g. `lambda: pd.read_csv(path, chunksize=10**6)`.
+    The first pass builds a `QuantileSketch` per column (and group), the
+    second yields each chunk capped at the approximate quantiles, as
+    `winsorize` would.
+    """
+    columns = list(columns)
+    output = output or {}
+
+    def groups(chunk):
+        # positional rows of each group; rows with missing keys are left out
+        if by is None:
+            return [(None, slice(None))]
+        return chunk.groupby(by).indices.items()
+
+    sketches = {}
+    for chunk in read_chunks():
+        for key, rows in groups(chunk):
+            for column in columns:
+                sketch = sketches.setdefault(
+                    (key, column), QuantileSketch(compression))
+                sketch.update(chunk[column].to_numpy()[rows])
+
+    def bounds(key, q, default):
+        if q is None:
+            return [default] * len(columns)
+        return [sketches[(key, column)].quantile(q) for column in columns]
+
+    for chunk in read_chunks():
+        chunk = chunk.copy()
+        low = np.full((len(chunk), len(columns)), -np.inf)
+        high = np.full((len(chunk), len(columns)), np.inf)
+        for key, rows in groups(chunk):
+            low[rows] = bounds(key, lower, -np.inf)
+            high[rows] = bounds(key, upper, np.inf)
+        _cap(chunk, columns, low, high, output)
+        yield chunk
+
+
+def compute_regression(df, formula="", outcome=None, covariates=None):
     """Fit a regression model
+
+    With `outcome` and `covariates` (column names), fits the model
+    directly with `fit_ols` and returns its `RegressionResult` instead of
+    a statsmodels summary.
     """
+    if outcome is not None:
+        return fit_ols(df, outcome, covariates)
     # Uses R-style formula as described here
     # https://www.statsmodels.org/dev/example_formulas.html
     data = df.copy()
@@ -53,4 +148,200 @@ def compute_regression(df, formula=""):
         formula=formula,
         data=data).fit()
 
-    return lm.summary()
\ No newline at end of file
+    return lm.summary()
+
+
+def batched_ols(X, y, mask=None):
+    """Fit many OLS models with the same number of parameters at once.
+
+    `X` has shape (n_models, n_obs, n_params) and `y` (n_models, n_obs).
+    Rows where `mask` is False, or where any value is missing, are left
+    out of the corresponding model. Returns a `BatchedOLS` of arrays with
+    one row per model. Models whose design matrix is rank deficient have
+    NaN parameters and statistics, without affecting the others.
+    """
+    X = np.asarray(X, dtype=float)
+    y = np.asarray(y, dtype=float)
+    valid = ~(np.isnan(y) | np.isnan(X).any(axis=2))
+    if mask is not None:
+        valid &= mask
+    X = np.where(valid[..., None], X, 0.0)
+    y = np.where(valid, y, 0.0)
+    q, r = np.linalg.qr(X)
+    # a design is singular exactly when R has a (numerically) zero diagonal
+    diagonal = np.abs(np.diagonal(r, axis1=1, axis2=2))
+    tolerance = max(X.shape[1:]) * np.finfo(float).eps * diagonal.max(
+        axis=1, keepdims=True)
+    singular = (diagonal <= tolerance).any(axis=1)
+    r = np.where(singular[:, None, None], np.eye(X.shape[2]), r)
+    params = np.linalg.solve(r, np.einsum("mnk,mn->mk", q, y)[..., None])[..., 0]
+    resid = y - np.einsum("mnk,mk->mn", X, params)
+    df_resid = valid.sum(axis=1) - X.shape[2]
+    sigma2 = (resid ** 2).sum(axis=1) / df_resid
+    r_inv = np.linalg.inv(r)
+    cov_diag = (r_inv ** 2).sum(axis=2)
+    bse = np.sqrt(sigma2[:, None] * cov_diag)
+    params[singular] = np.nan
+    bse[singular] = np.nan
+    tvalues = params / bse
+    pvalues = 2 * stats.t.sf(np.abs(tvalues), df_resid[:, None])
+    return BatchedOLS(params, bse, tvalues, pvalues, df_resid)
+
+
+def fit_ols(df, outcome, covariates, alpha=0.05):
+    """Fit `outcome ~ covariates` (with an intercept) by least squares.
+
+    Only the named columns are read from `df`, and rows with missing
+    values are dropped, as statsmodels does by default. Returns a
+    `RegressionResult` of plain dicts keyed by parameter name
+    ("Intercept" and the covariates), which can be serialised and
+    compared; `conf_int` maps each name to its (lower, upper) bounds.
+    """
+    covariates = list(covariates)
+    y = df[outcome].to_numpy(dtype=float)
+    X = np.column_stack(
+        [np.ones(len(y))] + [df[c].to_numpy(dtype=float) for c in covariates])
+    fit = batched_ols(X[None], y[None])
+    names = ["Intercept"] + covariates
+    params, bse, pvalues = fit.params[0], fit.bse[0], fit.pvalues[0]
+    df_resid = int(fit.df_resid[0])
+    margin = stats.t.ppf(1 - alpha / 2, df_resid) * bse
+    return RegressionResult(
+        params=dict(zip(names, params.tolist())),
+        bse=dict(zip(names, bse.tolist())),
+        conf_int={name: (lower, upper) for name, lower, upper in zip(
+            names, (params - margin).tolist(), (params + margin).tolist())},
+        pvalues=dict(zip(names, pvalues.tolist())),
+        nobs=df_resid + len(names),
+        df_resid=df_resid)
+
+
+def measure_regressions(df, metrics=("cost", "items"), correction="holm",
+                        alpha=0.05):
+    """Fit the ANCOVA for every measure and metric in a single pass.
+
+    `df` has one row per joint team and measure, with `joint_id`,
+    `allocation`, `measure` and `<metric>_baseline`,
+    `<metric>_follow-up`, `denominator_baseline` and
+    `denominator_follow-up` columns, like `rct_agg_6m` in the secondary
+    outcomes notebook. For each measure and metric,
+
+        follow-up per 1,000 ~ baseline per 1,000 + intervention
+
+    is fitted, all models together with `batched_ols`. P-values for the
+    intervention coefficient are adjusted across all models with
+    statsmodels' `multipletests` using `correction`; models with a
+    singular design (say, a measure with no baseline spend) get NaN
+    and are left out of the adjustment. Returns one row per model.
+    """
+    measures = np.sort(df.measure.unique())
+    units = np.sort(df.joint_id.unique())
+
+    def per_unit(column):
+        # (measures x joint teams) array of a column
+        return df.pivot_table(
+            index="measure", columns="joint_id", values=column, aggfunc="sum"
+        ).reindex(index=measures, columns=units).to_numpy(dtype=float)
+
+    intervention = df.groupby("joint_id").allocation.first().map(
+        {'con': 0, 'I': 1})
+    denominator_baseline = per_unit("denominator_baseline")
+    denominator_follow_up = per_unit("denominator_follow-up")
+    outcomes, baselines, keys = [], [], []
+    for metric in metrics:
+        baselines.append(per_unit(metric + "_baseline") / denominator_baseline)
+        outcomes.append(per_unit(metric + "_follow-up") / denominator_follow_up)
+        keys.extend((measure, metric) for measure in measures)
+    baseline = np.concatenate(baselines)
+    y = np.concatenate(outcomes)
+    z = np.broadcast_to(
+        intervention.reindex(units).to_numpy(dtype=float), y.shape)
+    X = np.stack([np.ones_like(y), baseline, z], axis=2)
+    fit = batched_ols(X, y)
+
+    coef, bse = fit.params[:, 2], fit.bse[:, 2]
+    margin = stats.t.ppf(1 - alpha / 2, fit.df_resid) * bse
+    pvalues = fit.pvalues[:, 2]
+    # models that could not be fitted (NaN) take no part in the correction
+    fitted = ~np.isnan(pvalues)
+    adjusted = np.full(len(pvalues), np.nan)
+    reject = np.zeros(len(pvalues), dtype=bool)
+    if fitted.any():
+        reject[fitted], adjusted[fitted], _, _ = multipletests(
+            pvalues[fitted], alpha=alpha, method=correction)
+    results = pd.DataFrame(keys, columns=["measure", "metric"])
+    results["coef"] = coef
+    results["bse"] = bse
+    results["ci_lower"] = coef - margin
+    results["ci_upper"] = coef + margin
+    results["pvalue"] = pvalues
+    results["pvalue_adjusted"] = adjusted
+    results["reject"] = reject
+    results["nobs"] = fit.df_resid + X.shape[2]
+    return results
+
+
+def _drop_rows(A, beta, X, y, rows):
+    """Remove rows from many fits with successive rank-one downdates.
+
+    `A` (n_fits, k, k) holds the inverse of X'X and `beta` (n_fits, k)
+    the coefficients of each fit. Row `rows[i, t]` of `X`/`y` is removed
+    from fit `i` at step `t`; negative entries are padding.
+    """
+    for step in rows.T:
+        active = step >= 0
+        x = X[step]
+        Ax = np.einsum("skl,sl->sk", A, x)
+        leverage = np.einsum("sk,sk->s", x, Ax)
+        resid = y[step] - np.einsum("sk,sk->s", x, beta)
+        scale = np.where(active, 1 / (1 - leverage), 0.0)
+        beta = beta - Ax * (resid * scale)[:, None]
+        A = A + np.einsum("sk,sl->skl", Ax, Ax) * scale[:, None, None]
+    return A, beta
+
+
+def influence_by_group(df, outcome, covariates, group="joint_id",
+                       term="intervention", pairs=False):
+    """Estimate `term` with each group (or pair of groups) left out.
+
+    The model `outcome ~ covariates` is factorised once; each
+    leave-out fit is then obtained by downdating that factorisation one
+    row at a time (Sherman-Morrison) rather than refitting. Returns a
+    table with the groups dropped, the estimate of `term` without them
+    and its change from the full-data estimate, largest changes first.
+    """
+    covariates = list(covariates)
+    data = df[[outcome, group] + covariates].dropna()
+    y = data[outcome].to_numpy(dtype=float)
+    X = np.column_stack(
+        [np.ones(len(y))] + [data[c].to_numpy(dtype=float) for c in covariates])
+    position = 1 + covariates.index(term)
+    q, r = np.linalg.qr(X)
+    r_inv = np.linalg.inv(r)
+    A = r_inv @ r_inv.T
+    beta = r_inv @ (q.T @ y)
+
+    codes, labels = pd.factorize(data[group])
+    members = [np.flatnonzero(codes == i) for i in range(len(labels))]
+    if pairs:
+        dropped = list(itertools.combinations(range(len(labels)), 2))
+    else:
+        dropped = [(i,) for i in range(len(labels))]
+    sets = [np.concatenate([members[i] for i in groups]) for groups in dropped]
+    rows = np.full((len(sets), max(len(s) for s in sets)), -1)
+    for i, s in enumerate(sets):
+        rows[i, :len(s)] = s
+    _, betas = _drop_rows(
+        np.broadcast_to(A, (len(sets),) + A.shape).copy(),
+        np.broadcast_to(beta, (len(sets),) + beta.shape).copy(),
+        X, y, rows)
+
+    result = pd.DataFrame({
+        "dropped": ["+".join(str(labels[i]) for i in groups)
+                    for groups in dropped],
+        "estimate": betas[:, position],
+    })
+    result["delta"] = result.estimate - beta[position]
+    return result.reindex(
+        result.delta.abs().sort_values(ascending=False).index
+    ).reset_index(drop=True)
@@ -8,7 +8,23 @@ List of metrics and dimensions:
 https://developers.google.com/analytics/devguides/reporting/core/dimsmets
 """
 
-from apiclient.discovery import build
+import hashlib
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+import warnings
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from apiclient.discovery import build_from_document
+from apiclient.errors import HttpError
+import numpy as np
 import pandas as pd
 import httplib2
 from oauth2client import client
@@ -19,60 +35,592 @@ SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
 DISCOVERY_URI = ('https://analyticsreporting.googleapis.com/$discovery/rest')
 # Path to client_secrets.json file.
 CLIENT_SECRETS_PATH = 'client_secrets.json'
+# Path to stored OAuth credentials
+CREDENTIALS_PATH = 'analyticsreporting.dat'
+# Local copy of the discovery document, fetched once
+DISCOVERY_CACHE_PATH = 'analyticsreporting_discovery.json'
+# The API accepts at most this many report requests per batchGet
+MAX_REPORTS_PER_BATCH = 5
+# Report requests in one batchGet must agree on these fields
+BATCH_FIELDS = ('viewId', 'dateRanges', 'samplingLevel', 'segments',
+                'cohortGroup')
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded',
+                      'quotaExceeded')
+# Default location of the report cache
+CACHE_PATH = os.path.join('..', 'data', 'analytics_cache')
+# Days after which Google Analytics data for a date is treated as final
+SETTLE_DAYS = 3
+# Metrics that sum exactly across date ranges, so that the parts of a
+# query split by date can be added back together
+ADDITIVE_METRICS = {
+    'ga:pageviews', 'ga:uniquePageviews', 'ga:entrances', 'ga:exits',
+    'ga:bounces', 'ga:sessions', 'ga:sessionDuration', 'ga:timeOnPage',
+    'ga:newUsers', 'ga:hits', 'ga:totalEvents', 'ga:uniqueEvents',
+    'ga:goalCompletionsAll', 'ga:transactions', 'ga:transactionRevenue',
+}
+# Dimensions that give each day its own rows, so parts never overlap
+DAY_DIMENSIONS = {'ga:date', 'ga:dateHour', 'ga:dateHourMinute'}
+# dtypes for each metric type; TIME values are in seconds
+METRIC_DTYPES = {
+    'INTEGER': 'int64',
+    'FLOAT': 'float64',
+    'CURRENCY': 'float64',
+    'PERCENT': 'float64',
+    'TIME': 'float64',
+}
+
+
+class ServicePool(object):
+    """Thread-safe pool of service objects made by `new_service`.
+
+    Neither service objects nor their HTTP connections are thread-safe,
+    so each is used by one thread at a time: `checkout` hands out an
+    idle service, or makes a new one if none is idle, and takes it back
+    afterwards. A long-lived pool reuses services, and their open
+    connections, across queries whatever threads run them.
+    """
+
+    def __init__(self, new_service):
+        self.new_service = new_service
+        self.idle = queue.LifoQueue()
+
+    @contextmanager
+    def checkout(self):
+        try:
+            service = self.idle.get_nowait()
+        except queue.Empty:
+            service = self.new_service()
+        try:
+            yield service
+        finally:
+            self.idle.put(service)
+
+
+class AnalyticsClient(object):
+    """Long-lived, thread-safe source of analyticsreporting services.
+
+    Credentials are loaded (or obtained through the OAuth flow) once,
+    and the discovery document is fetched once and cached on disk at
+    `discovery_cache_path`. `services` is a `ServicePool` of authorized
+    services, each with its own HTTP connection, shared by every query.
+    """
+
+    def __init__(self, client_secrets_path=CLIENT_SECRETS_PATH,
+                 credentials_path=CREDENTIALS_PATH,
+                 discovery_cache_path=DISCOVERY_CACHE_PATH):
+        self.client_secrets_path = client_secrets_path
+        self.credentials_path = credentials_path
+        self.discovery_cache_path = discovery_cache_path
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self._credentials = None
+        self._discovery_document = None
+        self.services = ServicePool(self.new_service)
+
+    def credentials(self):
+        with self.lock:
+            if self._credentials is None:
+                # Set up a Flow object to be used if we need to authenticate.
+                flow = client.flow_from_clientsecrets(
+                    self.client_secrets_path, scope=SCOPES,
+                    message=tools.message_if_missing(self.client_secrets_path))
+                # If the credentials don't exist or are invalid run
+                # through the native client flow. The Storage object
+                # will ensure that if successful the good credentials
+                # will get written back to a file.
+                storage = file.Storage(self.credentials_path)
+                credentials = storage.get()
+                flags = []
+                if credentials is None or credentials.invalid:
+                    credentials = tools.run_flow(flow, storage, flags)
+                self._credentials = credentials
+            return self._credentials
+
+    def discovery_document(self):
+        with self.lock:
+            if self._discovery_document is None:
+                if os.path.exists(self.discovery_cache_path):
+                    with open(self.discovery_cache_path, 'r') as f:
+                        self._discovery_document = f.read()
+                else:
+                    response, content = httplib2.Http().request(
+                        DISCOVERY_URI + '?version=v4')
+                    if response.status != 200:
+                        raise HttpError(response, content, uri=DISCOVERY_URI)
+                    content = content.decode('utf-8')
+                    tmp = self.discovery_cache_path + '.tmp'
+                    with open(tmp, 'w') as f:
+                        f.write(content)
+                    os.replace(tmp, self.discovery_cache_path)
+                    self._discovery_document = content
+            return self._discovery_document
+
+    def new_service(self):
+        """Return a new authorized analyticsreporting service."""
+        http = self.credentials().authorize(http=httplib2.Http())
+        return build_from_document(self.discovery_document(), http=http)
+
+    def service(self):
+        """Return this thread's authorized analyticsreporting service."""
+        if not hasattr(self.local, 'service'):
+            self.local.service = self.new_service()
+        return self.local.service
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide `AnalyticsClient`, creating it if needed."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AnalyticsClient()
+        return _client
 
 
 def initialize_analyticsreporting():
     """Initializes the analyticsreporting service object.
 
     Returns: an authorized analyticsreporting service
-       object.
+       object, shared by later calls from the same thread.
 
     """
-    # Set up a Flow object to be used if we need to authenticate.
-    flow = client.flow_from_clientsecrets(
-        CLIENT_SECRETS_PATH, scope=SCOPES,
-        message=tools.message_if_missing(CLIENT_SECRETS_PATH))
-
-    # Prepare credentials, and authorize HTTP object with them.  If
-    # the credentials don't exist or are invalid run through the
-    # native client flow. The Storage object will ensure that if
-    # successful the good credentials will get written back to a file.
-    storage = file.Storage('analyticsreporting.dat')
-    credentials = storage.get()
-    flags = []
-    if credentials is None or credentials.invalid:
-        credentials = tools.run_flow(flow, storage, flags)
-    http = credentials.authorize(http=httplib2.Http())
-    # Build the service object.
-    analytics = build('analytics', 'v4',
-                      http=http,
-                      discoveryServiceUrl=DISCOVERY_URI)
-    return analytics
-
-
-def get_report(analytics, queries):
-    # Use the Analytics Service Object to query the Analytics Reporting API V4.
-    response = analytics.reports().batchGet(
-        body={
-            'reportRequests': queries
+    return get_client().service()
+
+
+class CacheMiss(KeyError):
+    """Raised in replay mode when a report is not in the cache."""
+
+
+def request_key(query):
+    """Return a canonical hash of a report request."""
+    canonical = json.dumps(query, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def is_historical(query, today=None):
+    """Whether every date range of `query` ended long enough ago to be final.
+
+    Relative dates such as "today" or "7daysAgo", and queries without
+    date ranges, are never historical.
+    """
+    today = today or date.today()
+    ranges = query.get('dateRanges') or []
+    if not ranges:
+        return False
+    for date_range in ranges:
+        try:
+            end = date(*map(int, date_range['endDate'].split('-')))
+        except (KeyError, ValueError, TypeError):
+            return False
+        if end > today - timedelta(days=SETTLE_DAYS):
+            return False
+    return True
+
+
+class ReportCache(object):
+    """On-disk cache of report pages, keyed by `request_key`.
+
+    Pages for historical date ranges (see `is_historical`) never expire;
+    others are refetched once older than `ttl` seconds. When the cache
+    grows beyond `max_bytes`, the least recently used pages are evicted,
+    expiring ones before historical ones. Historical pages are stored as
+    `<key>.historical.json` and others as `<key>.json`, so eviction
+    never opens a page. In `replay` mode every page must come from the
+    cache: a missing page raises `CacheMiss` instead of being fetched,
+    and nothing is written.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=24 * 60 * 60,
+                 max_bytes=2 ** 30, replay=False):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.replay = replay
+        self.lock = threading.Lock()
+        # size of the cache when last measured, plus pages written since
+        self.total = None
+        os.makedirs(path, exist_ok=True)
+
+    def _filename(self, query, historical):
+        suffix = '.historical.json' if historical else '.json'
+        return os.path.join(self.path, request_key(query) + suffix)
+
+    def get(self, query):
+        # a page fetched before its dates were final is stored as expiring
+        for historical in (True, False):
+            filename = self._filename(query, historical)
+            try:
+                with open(filename, 'r') as f:
+                    entry = json.load(f)
+                break
+            except FileNotFoundError:
+                continue
+        else:
+            if self.replay:
+                raise CacheMiss(request_key(query))
+            return None
+        expired = time.time() - entry['fetched_at'] > self.ttl
+        if expired and not entry['historical'] and not self.replay:
+            return None
+        try:
+            # mark as recently used, for eviction
+            os.utime(filename)
+        except FileNotFoundError:
+            pass
+        return entry['report']
+
+    def put(self, query, report):
+        if self.replay:
+            return
+        entry = {
+            'fetched_at': time.time(),
+            'historical': is_historical(query),
+            'report': report,
         }
-    ).execute()
-    data = []
-    unpaged_queries = []
-    for i, report in enumerate(response.get('reports', [])):
-        d, nextPageToken = process_report(report)
-        data.extend(d)
-        if nextPageToken:
-            unpaged_query = queries[i].copy()
-            unpaged_query['pageToken'] = nextPageToken
-            unpaged_queries.append(unpaged_query)
-    if unpaged_queries:
-        data.extend(get_report(analytics, unpaged_queries))
-    return data
+        filename = self._filename(query, entry['historical'])
+        tmp = '{}.{}.tmp'.format(filename, threading.get_ident())
+        with open(tmp, 'w') as f:
+            json.dump(entry, f)
+        size = os.path.getsize(tmp)
+        os.replace(tmp, filename)
+        if entry['historical']:
+            # drop the expiring copy from before the dates were final
+            try:
+                os.remove(self._filename(query, False))
+            except FileNotFoundError:
+                pass
+        with self.lock:
+            # the directory is only measured again once it may be too big
+            if self.total is None or self.total + size > self.max_bytes:
+                self._evict()
+            else:
+                self.total += size
+
+    def _evict(self):
+        # other threads may remove pages at any point, so missing ones
+        # are skipped
+        entries = []
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            historical = entry.name.endswith('.historical.json')
+            entries.append(
+                ((historical, stat.st_mtime), entry.path, stat.st_size))
+        total = sum(size for _, _, size in entries)
+        for _, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.total = total
+
+
+class RateLimiter(object):
+    """Space out calls so that at most `max_qps` start per second."""
+
+    def __init__(self, max_qps):
+        self.interval = 1.0 / max_qps
+        self.lock = threading.Lock()
+        self.next_call = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = max(0, self.next_call - now)
+            self.next_call = max(now, self.next_call) + self.interval
+        time.sleep(delay)
+
+
+def pack_requests(requests):
+    """Group `(key, query)` pairs into batches for a single batchGet.
+
+    Each batch holds at most `MAX_REPORTS_PER_BATCH` queries which agree
+    on the `BATCH_FIELDS`, as the API requires.
+    """
+    groups = {}
+    for key, query in requests:
+        batch_key = json.dumps(
+            {field: query.get(field) for field in BATCH_FIELDS}, sort_keys=True)
+        groups.setdefault(batch_key, []).append((key, query))
+    return [
+        group[i:i + MAX_REPORTS_PER_BATCH]
+        for group in groups.values()
+        for i in range(0, len(group), MAX_REPORTS_PER_BATCH)]
+
+
+def _is_retryable(error):
+    status = int(error.resp.status)
+    if status == 403:
+        content = error.content
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', 'replace')
+        return any(reason in content for reason in RATE_LIMIT_REASONS)
+    return status in (429, 500, 503)
+
+
+def _execute(services, queries, limiter, max_retries):
+    for attempt in range(max_retries + 1):
+        limiter.wait()
+        try:
+            with services.checkout() as service:
+                return service.reports().batchGet(
+                    body={'reportRequests': queries}).execute()
+        except HttpError as error:
+            if attempt == max_retries or not _is_retryable(error):
+                raise
+            # exponential backoff with jitter, as recommended by Google
+            time.sleep(min(2 ** attempt, 64) + random.random())
+
+
+def _parse_date(value):
+    return date(*map(int, value.split('-')))
+
+
+def split_query(query, max_days=None):
+    """Split the date range of `query` into several queries.
+
+    With `max_days`, the range is cut into consecutive chunks of at most
+    that many days; otherwise it is halved. Queries with several date
+    ranges, relative dates (such as "7daysAgo") or a single day are
+    returned unsplit, as a one-element list.
+    """
+    ranges = query.get('dateRanges') or []
+    if len(ranges) != 1:
+        return [query]
+    try:
+        start = _parse_date(ranges[0]['startDate'])
+        end = _parse_date(ranges[0]['endDate'])
+    except (KeyError, ValueError, TypeError):
+        return [query]
+    n_days = (end - start).days + 1
+    if max_days is None:
+        max_days = (n_days + 1) // 2
+    if n_days <= 1 or n_days <= max_days:
+        return [query]
+    parts = []
+    for offset in range(0, n_days, max_days):
+        part_start = start + timedelta(days=offset)
+        part_end = min(end, part_start + timedelta(days=max_days - 1))
+        parts.append(dict(query, dateRanges=[{
+            'startDate': part_start.isoformat(),
+            'endDate': part_end.isoformat()}]))
+    return parts
+
+
+def is_splittable(query):
+    """Whether the parts of `query` split by date combine exactly.
+
+    They do when a dimension such as `ga:date` keeps every day's rows
+    apart, or when every metric is additive (see `ADDITIVE_METRICS`).
+    Averages, rates and counts of users are not.
+    """
+    dimensions = {d.get('name') for d in query.get('dimensions') or []}
+    if dimensions & DAY_DIMENSIONS:
+        return True
+    return all(metric.get('expression') in ADDITIVE_METRICS
+               for metric in query.get('metrics') or [])
+
+
+def is_sampled(report):
+    """Whether Google Analytics sampled the data in `report`."""
+    return bool(report.get('data', {}).get('samplesReadCounts'))
+
+
+def _follow_up(key, query, report, split_sampled):
+    """Return whether to keep `report`, and the requests that follow it.
+
+    A sampled first page is dropped and its query split in two, if it
+    can be (see `is_splittable`); otherwise the next page (if any) is
+    requested.
+    """
+    i, part, page = key
+    if split_sampled and page == 0 and is_sampled(report):
+        halves = split_query(query)
+        if len(halves) > 1 and is_splittable(query):
+            return False, [((i, part + (j,), 0), half)
+                           for j, half in enumerate(halves)]
+        if len(halves) > 1:
+            warnings.warn(
+                "Sampled report not split, as its metrics do not add up "
+                "across date ranges; add a ga:date dimension to split it")
+    token = report.get('nextPageToken')
+    if not token:
+        return True, []
+    return True, [((i, part, page + 1), dict(query, pageToken=token))]
+
+
+def iter_reports(services, queries, max_workers=4, max_qps=10.0,
+                 max_retries=5, cache=None, split_sampled=True, max_days=None,
+                 max_in_flight=None):
+    """Fetch every page of every query, yielding `(key, report)` pairs.
+
+    `services` is a `ServicePool` (such as `get_client().services`), or
+    a function returning a new analyticsreporting service object, which
+    is called at most once per worker thread. `key` is `(query_index, part, page_number)`, where `part` is
+    a tuple locating the report's date range within the query's when
+    the query was split (sorting keys puts parts in date order).
+
+    To avoid sampling, queries can be split up front into date ranges
+    of at most `max_days` days, and with `split_sampled` any query whose
+    first page comes back sampled has its date range halved and is
+    fetched again, recursively, down to single days. Only queries whose
+    parts combine exactly are split (see `is_splittable`): splitting
+    others up front raises ValueError, and their sampled reports are
+    kept with a warning. Queries are packed
+    into batchGet calls of up to `MAX_REPORTS_PER_BATCH`, and a batch's
+    next pages are requested as soon as it arrives, so pages of
+    different queries are fetched concurrently on `max_workers` threads.
+    Calls are throttled to `max_qps` and retried with backoff on rate
+    limit and server errors. Pages found in `cache` (a `ReportCache`)
+    are not requested, and fetched pages are added to it. Reports are
+    yielded as they arrive; at most `max_in_flight` batches (twice
+    `max_workers` by default) are requested ahead of the consumer, so
+    memory stays bounded however many pages there are.
+    """
+    if max_in_flight is None:
+        max_in_flight = 2 * max_workers
+    if not isinstance(services, ServicePool):
+        services = ServicePool(services)
+    limiter = RateLimiter(max_qps)
+
+    def fetch(batch):
+        response = _execute(
+            services, [query for _, query in batch], limiter, max_retries)
+        reports = response.get('reports', [])
+        if cache is not None:
+            for (_, query), report in zip(batch, reports):
+                cache.put(query, report)
+        return batch, reports
+
+    ready = deque()
+    for i, query in enumerate(queries):
+        parts = split_query(query, max_days) if max_days else [query]
+        if len(parts) > 1 and not is_splittable(query):
+            raise ValueError(
+                "Query {} cannot be split by date, as its metrics do not "
+                "add up across date ranges".format(i))
+        for j, part in enumerate(parts):
+            ready.append(((i, (j,) if len(parts) > 1 else (), 0), part))
+    waiting = deque()
+    pending = set()
+    received = []
+    with ThreadPoolExecutor(max_workers) as executor:
+        while ready or waiting or pending or received:
+            to_fetch = []
+            while ready:
+                key, query = ready.popleft()
+                report = cache.get(query) if cache is not None else None
+                if report is None:
+                    to_fetch.append((key, query))
+                else:
+                    keep, requests = _follow_up(key, query, report, split_sampled)
+                    if keep:
+                        received.append((key, report))
+                    ready.extend(requests)
+            waiting.extend(pack_requests(to_fetch))
+            while waiting and len(pending) < max_in_flight:
+                pending.add(executor.submit(fetch, waiting.popleft()))
+            for item in received:
+                yield item
+            received = []
+            if pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch, reports = future.result()
+                    for (key, query), report in zip(batch, reports):
+                        keep, requests = _follow_up(
+                            key, query, report, split_sampled)
+                        if keep:
+                            received.append((key, report))
+                        ready.extend(requests)
+
+
+def columns_to_frame(pages):
+    """Build one DataFrame from a list of column dicts.
+
+    Pages with the same columns (the usual case) are concatenated column
+    by column; otherwise missing columns are filled with NaN.
+    """
+    if not pages:
+        return pd.DataFrame()
+    names = list(pages[0])
+    if all(list(page) == names for page in pages):
+        return pd.DataFrame(
+            {name: np.concatenate([page[name] for page in pages])
+             for name in names})
+    return pd.concat(
+        [pd.DataFrame(page) for page in pages], ignore_index=True, sort=False)
+
+
+def _stitch(pages, dimensions):
+    """Combine the pages of a query whose date range was split.
+
+    Rows for the same dimension values in different parts are summed,
+    which is exact as only splittable queries are split (see
+    `is_splittable`).
+    """
+    frame = columns_to_frame(pages)
+    if not dimensions:
+        return frame.sum().to_frame().T
+    return frame.groupby(dimensions, as_index=False, sort=False).sum()
+
+
+def _parse_reports(reports):
+    # Parse each report as it arrives, so the raw response can be freed
+    for key, report in reports:
+        page, _ = process_report(report)
+        yield key, page, report.get('columnHeader', {}).get('dimensions', [])
+
+
+def _collect(pages):
+    # Put pages back in query, date and page order before combining them
+    frames = []
+    pages = sorted(pages, key=lambda item: item[0])
+    for i, query_pages in itertools.groupby(pages, lambda item: item[0][0]):
+        query_pages = list(query_pages)
+        columns = [page for _, page, _ in query_pages]
+        if any(part for (_, part, _), _, _ in query_pages):
+            frames.append(_stitch(columns, query_pages[0][2]))
+        else:
+            frames.append(columns_to_frame(columns))
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+
+def get_report(analytics, queries, cache=None):
+    """Return a DataFrame of every page of every query, in query order."""
+    # A single service object is not thread-safe, so fetch serially
+    return _collect(_parse_reports(iter_reports(
+        lambda: analytics, queries, max_workers=1, cache=cache)))
+
+
+def _parse_values(values, dtype):
+    # Empty cells become NaN, which needs a float column
+    missing = values == ''
+    if missing.any():
+        return np.where(missing, 'nan', values).astype('float64')
+    return values.astype(dtype)
 
 
 def process_report(report):
-    data = []
+    """Parse one page of a report into typed columns.
+
+    Returns a dict mapping column names to arrays, and the token of the
+    next page (or None). Dimensions are strings; metrics are parsed
+    according to their `metricHeaderEntries` type. With several date
+    ranges, metric columns are suffixed `_range_<i>`.
+    """
     nextPageToken = report.get('nextPageToken', None)
     columnHeader = report.get('columnHeader', {})
     dimensionHeaders = columnHeader.get('dimensions', [])
@@ -82,38 +630,67 @@ def process_report(report):
     samplingSpaceSizes = report.get('data', {}).get('samplingSpaceSizes', [])
     if samplesReadCounts:
         print("Warning: data sampled at around {}%".format(
-            round(float(samplesReadCounts[0])/samplingSpaceSizes[0] * 100)))
-    for row in rows:
-        dimensions = row.get('dimensions', [])
-        dateRangeValues = row.get('metrics', [])
-        data_row = {}
-
-        for header, dimension in zip(dimensionHeaders, dimensions):
-            data_row[header] = dimension
-
-        for i, values in enumerate(dateRangeValues):
-            for metricHeader, value in zip(metricHeaders, values.get('values')):
-                col_name = metricHeader.get('name')
-                if len(dateRangeValues) > 1:
-                    col_name += "_range_{}".format(i)
-                if value:
-                    if "." in value:
-                        value = float(value)
-                    else:
-                        value = int(value)
-                data_row[col_name] = value
-                data.append(data_row)
-    return data, nextPageToken
-
-
-def query_analytics(query, columns=[]):
-    """Parses and prints the Analytics Reporting API V4 response"""
-    analytics = initialize_analyticsreporting()
-    data = get_report(analytics, query)
-    df = pd.DataFrame(data)
+            round(float(samplesReadCounts[0]) / float(samplingSpaceSizes[0]) * 100)))
+
+    n_ranges = len(rows[0].get('metrics', [])) if rows else 1
+    dimensions = np.array(
+        [value for row in rows for value in row.get('dimensions', [])],
+        dtype=object).reshape(len(rows), len(dimensionHeaders))
+    metrics = np.array(
+        [value for row in rows for values in row.get('metrics', [])
+         for value in values.get('values')],
+        dtype=str).reshape(len(rows), n_ranges, len(metricHeaders))
+
+    columns = {}
+    for i, header in enumerate(dimensionHeaders):
+        columns[header] = dimensions[:, i]
+    for i in range(n_ranges):
+        for j, metricHeader in enumerate(metricHeaders):
+            col_name = metricHeader.get('name')
+            if n_ranges > 1:
+                col_name += "_range_{}".format(i)
+            dtype = METRIC_DTYPES.get(metricHeader.get('type'), 'float64')
+            columns[col_name] = _parse_values(metrics[:, i, j], dtype)
+    return columns, nextPageToken
+
+
+def _tidy(df, columns):
     for col in df.columns:
         if col.startswith("ga:date"):
             df[col] = pd.to_datetime(df[col])
     if columns:
         df.columns = columns
     return df
+
+
+def stream_analytics(query, columns=[], max_workers=4, cache=None,
+                     max_days=None, max_in_flight=None):
+    """Yield `(key, DataFrame)` for each page of the response, as it arrives.
+
+    `key` is `(query_index, part, page_number)` as in `iter_reports`;
+    sorting on it restores query and date order. Each frame has typed
+    columns, named `columns` if given, so pages can be written to disk
+    or aggregated as they come without holding the whole report. When
+    a query's date range was split, its parts arrive as separate pages
+    with overlapping dimension values, to be summed by the caller.
+    """
+    for key, page, _ in _parse_reports(iter_reports(
+            get_client().services, query, max_workers=max_workers,
+            cache=cache, max_days=max_days, max_in_flight=max_in_flight)):
+        yield key, _tidy(pd.DataFrame(page), columns)
+
+
+def query_analytics(query, columns=[], max_workers=4, cache=None,
+                    max_days=None):
+    """Parses and prints the Analytics Reporting API V4 response
+
+    Pass a `ReportCache` as `cache` to reuse earlier responses, or one
+    with `replay=True` to run entirely from the cache. Date ranges are
+    split (up front into `max_days` chunks, and again whenever a report
+    is sampled) and the parts stitched together, so counts are unsampled,
+    where the metrics allow it (see `is_splittable`).
+    Use `stream_analytics` to handle the response page by page instead.
+    """
+    return _tidy(_collect(_parse_reports(iter_reports(
+        get_client().services, query, max_workers=max_workers,
+        cache=cache, max_days=max_days))), columns)
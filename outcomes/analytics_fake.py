@@ -0,0 +1,82 @@
+"""
+A local stand-in for the Analytics Reporting API v4 service.
+
+`FakeAnalyticsService` behaves like the object returned by
+`analytics.initialize_analyticsreporting` for `reports().batchGet()`,
+so the fetch engine in `analytics` can be exercised without network
+access or credentials:
+
+    service = FakeAnalyticsService(make_report, rate_limit_errors=2)
+    reports = list(analytics.iter_reports(lambda: service, queries))
+"""
+import json
+import threading
+
+import httplib2
+from apiclient.errors import HttpError
+
+from analytics import BATCH_FIELDS, MAX_REPORTS_PER_BATCH
+
+
+def _error(status, message):
+    content = json.dumps({'error': {'code': status, 'message': message}})
+    return HttpError(httplib2.Response({'status': status}),
+                     content.encode('utf-8'))
+
+
+class FakeAnalyticsService(object):
+    """Serve reports built by `make_report(query)`, paginated.
+
+    `make_report` returns a complete report dict (`columnHeader` and
+    `data.rows`) for a report request. Pages hold `pageSize` rows
+    (default `page_size`). The first `rate_limit_errors` calls fail with
+    HTTP 429. Every request body is recorded in `calls`.
+    """
+
+    def __init__(self, make_report, page_size=1000, rate_limit_errors=0):
+        self.make_report = make_report
+        self.page_size = page_size
+        self.rate_limit_errors = rate_limit_errors
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def reports(self):
+        return self
+
+    def batchGet(self, body):
+        return _FakeRequest(self, body)
+
+    def _execute(self, body):
+        with self.lock:
+            self.calls.append(body)
+            if self.rate_limit_errors > 0:
+                self.rate_limit_errors -= 1
+                raise _error(429, 'Rate limit exceeded')
+        queries = body['reportRequests']
+        if len(queries) > MAX_REPORTS_PER_BATCH:
+            raise _error(400, 'Too many report requests')
+        for field in BATCH_FIELDS:
+            if len({json.dumps(q.get(field), sort_keys=True) for q in queries}) > 1:
+                raise _error(400, 'Report requests differ in ' + field)
+        return {'reports': [self._page(query) for query in queries]}
+
+    def _page(self, query):
+        report = self.make_report(query)
+        rows = report.get('data', {}).get('rows', [])
+        start = int(query.get('pageToken', 0))
+        end = start + int(query.get('pageSize', self.page_size))
+        page = dict(report)
+        page['data'] = dict(report.get('data', {}), rows=rows[start:end])
+        if end < len(rows):
+            page['nextPageToken'] = str(end)
+        return page
+
+
+class _FakeRequest(object):
+
+    def __init__(self, service, body):
+        self.service = service
+        self.body = body
+
+    def execute(self):
+        return self.service._execute(self.body)
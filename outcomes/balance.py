@@ -0,0 +1,128 @@
+"""
+Simulate allocations to judge covariate balance between trial arms.
+
+Candidate allocations are drawn in batches under one of three schemes,
+all using the rank-mod-2 rule from the allocation notebook:
+
+* "simple": the rule applied across all units, as in the trial;
+* "clustered": the rule applied to clusters given by a column, such as
+  `joint_id` when units are CCGs, so that every unit in a joint team is
+  in the same group;
+* "stratified": the rule applied within quantile groups (terciles by
+  default) of a column, such as `baseline`.
+
+For every draw the difference in means and standardised mean
+difference (SMD) of each covariate between the intervention and control
+groups are computed with matrix products over the whole batch. The
+chosen allocation can then be placed within the simulated distribution.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from permutation import chunk_seeds, draw_allocations
+from utils import run_chunks
+
+BalanceResult = namedtuple("BalanceResult", [
+    "mean_difference", "smd", "summary"])
+
+
+def scheme_design(df, scheme, cluster_column="joint_id",
+                  stratify_column="baseline", n_strata=3):
+    """Return the clusters and strata of the units in `df` under `scheme`.
+
+    Clusters are integer codes for each unit, allocated as a whole, or
+    None if units are allocated one by one; strata are integer strata
+    for `draw_allocations`, or None.
+    """
+    if scheme == "simple":
+        return None, None
+    if scheme == "clustered":
+        codes = pd.factorize(df[cluster_column])[0]
+        # units without a cluster are each a cluster of their own
+        unclustered = codes < 0
+        codes[unclustered] = codes.max() + 1 + np.arange(unclustered.sum())
+        return codes, None
+    if scheme == "stratified":
+        strata = pd.qcut(df[stratify_column], n_strata, labels=False)
+        return None, strata.to_numpy()
+    raise ValueError("Unknown allocation scheme: {}".format(scheme))
+
+
+def balance_statistics(allocations, covariates):
+    """Return the mean differences and SMDs for a batch of allocations.
+
+    `allocations` is a boolean (n_draws, n_units) array, True for the
+    intervention group, and `covariates` an (n_units, n_covariates)
+    array. Both results have shape (n_draws, n_covariates). Raises
+    ValueError if an arm of any allocation has fewer than two units,
+    as its variance (and so the SMD) is then undefined.
+    """
+    treated = allocations.astype(float)
+    control = 1 - treated
+    n_treated = treated.sum(axis=1)[:, None]
+    n_control = control.sum(axis=1)[:, None]
+    if (n_treated < 2).any() or (n_control < 2).any():
+        raise ValueError(
+            "Every arm needs at least two units for a standardised mean "
+            "difference; an allocation has {} treated and {} control".format(
+                int(n_treated.min()), int(n_control.min())))
+    mean_treated = treated @ covariates / n_treated
+    mean_control = control @ covariates / n_control
+    var_treated = (treated @ covariates ** 2 / n_treated - mean_treated ** 2) \
+        * n_treated / (n_treated - 1)
+    var_control = (control @ covariates ** 2 / n_control - mean_control ** 2) \
+        * n_control / (n_control - 1)
+    difference = mean_treated - mean_control
+    smd = difference / np.sqrt((var_treated + var_control) / 2)
+    return difference, smd
+
+
+def _balance_chunk(args):
+    seed_seq, n_draws, covariates, clusters, strata = args
+    rng = np.random.default_rng(seed_seq)
+    if clusters is None:
+        allocations = draw_allocations(rng, n_draws, len(covariates), strata)
+    else:
+        # allocate clusters, then give each unit its cluster's group
+        allocations = draw_allocations(rng, n_draws, clusters.max() + 1)
+        allocations = allocations[:, clusters]
+    return balance_statistics(allocations, covariates)
+
+
+def simulate_balance(df, covariates=("baseline",), scheme="simple",
+                     n_draws=1000000, seed=321, n_workers=None,
+                     chunk_size=50000, chosen="allocation", **scheme_args):
+    """Simulate allocations of the units in `df` and score their balance.
+
+    `df` has one row per unit, such as the `top40` frame. If `df` has a
+    `chosen` column of "I"/"con" labels, the summary includes the
+    balance of that allocation and the percentage of simulated draws
+    with an absolute SMD no larger than it. Draws are spread over every
+    core unless `n_workers` is given. Extra keyword arguments are passed
+    to `scheme_design`.
+    """
+    covariates = list(covariates)
+    values = df[covariates].to_numpy(dtype=float)
+    clusters, strata = scheme_design(df, scheme, **scheme_args)
+    tasks = [(seed_seq, size, values, clusters, strata)
+             for seed_seq, size in chunk_seeds(n_draws, chunk_size, seed)]
+    chunks = run_chunks(_balance_chunk, tasks, n_workers)
+    difference = np.concatenate([c[0] for c in chunks])
+    smd = np.concatenate([c[1] for c in chunks])
+
+    abs_smd = np.abs(smd)
+    summary = pd.DataFrame({
+        "mean_abs_smd": abs_smd.mean(axis=0),
+        "median_abs_smd": np.median(abs_smd, axis=0),
+        "p95_abs_smd": np.percentile(abs_smd, 95, axis=0),
+    }, index=pd.Index(covariates, name="covariate"))
+    if chosen in df.columns:
+        allocation = (df[chosen] == "I").to_numpy()[None, :]
+        chosen_difference, chosen_smd = balance_statistics(allocation, values)
+        summary["chosen_difference"] = chosen_difference[0]
+        summary["chosen_smd"] = chosen_smd[0]
+        summary["chosen_percentile"] = 100 * (
+            abs_smd <= np.abs(chosen_smd)).mean(axis=0)
+    return BalanceResult(difference, smd, summary)
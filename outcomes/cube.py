@@ -0,0 +1,145 @@
+"""
+Dense org x measure x month cube of measure data.
+
+The long frame of measure data (one row per pct_id, measure and month)
+is stored as a single array of shape
+
+    (n_orgs, n_measures, n_months, len(FIELDS))
+
+with integer-coded axes, so outcomes become reductions over axes rather
+than chains of groupby/unstack. A cube saved to disk is loaded as a
+read-only memory map, so several worker processes can share it without
+copying.
+"""
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from periods import prefix_sums, window_length, window_sum
+
+CUBE_PATH = os.path.join('..', 'data', 'measure_cube')
+
+FIELDS = ("cost", "items", "denominator")
+COST, ITEMS, DENOMINATOR = range(len(FIELDS))
+
+Cube = namedtuple("Cube", ["values", "orgs", "measures", "months"])
+
+
+def axis_codes(index, labels):
+    """Return the integer positions of `labels` along a cube axis."""
+    codes = index.get_indexer(labels)
+    if (codes < 0).any():
+        missing = pd.Index(labels)[codes < 0]
+        raise KeyError("Not in cube: {}".format(list(missing)))
+    return codes
+
+
+def build_cube(df, path=None):
+    """Build a cube from a long frame of measure data.
+
+    `df` needs `pct_id`, `measure`, `month` and the columns in `FIELDS`,
+    with at most one row per pct_id, measure and month. Cells without a
+    row are zero. If `path` is given, the cube is written there and
+    returned as a memory map.
+    """
+    orgs = pd.Index(np.sort(df.pct_id.unique()), name="pct_id")
+    measures = pd.Index(np.sort(df.measure.unique()), name="measure")
+    months = pd.DatetimeIndex(
+        np.sort(pd.to_datetime(df.month).unique()), name="month")
+    shape = (len(orgs), len(measures), len(months), len(FIELDS))
+    if path is None:
+        values = np.zeros(shape)
+    else:
+        os.makedirs(path, exist_ok=True)
+        values = np.lib.format.open_memmap(
+            os.path.join(path, "values.npy"),
+            mode="w+", dtype=np.float64, shape=shape)
+        values[:] = 0
+    org_codes = orgs.get_indexer(df.pct_id)
+    measure_codes = measures.get_indexer(df.measure)
+    month_codes = months.get_indexer(pd.to_datetime(df.month))
+    for i, field in enumerate(FIELDS):
+        values[org_codes, measure_codes, month_codes, i] = df[field].to_numpy()
+    if path is not None:
+        values.flush()
+        axes = {
+            "orgs": list(orgs),
+            "measures": list(measures),
+            "months": list(months.strftime('%Y-%m-%d')),
+            "fields": list(FIELDS),
+        }
+        with open(os.path.join(path, "axes.json"), "w") as f:
+            json.dump(axes, f)
+    return Cube(values, orgs, measures, months)
+
+
+def load_cube(path=CUBE_PATH, mmap_mode="r"):
+    """Load a cube written by `build_cube`, memory-mapped by default."""
+    with open(os.path.join(path, "axes.json"), "r") as f:
+        axes = json.load(f)
+    values = np.load(os.path.join(path, "values.npy"), mmap_mode=mmap_mode)
+    return Cube(
+        values,
+        pd.Index(axes["orgs"], name="pct_id"),
+        pd.Index(axes["measures"], name="measure"),
+        pd.DatetimeIndex(axes["months"], name="month"))
+
+
+def cube_prefix_sums(cube):
+    """Return prefix sums of the cube along its month axis.
+
+    The sums have shape `(n_orgs, n_measures, len(FIELDS), n_months + 1)`;
+    see `periods.window_sum`.
+    """
+    return prefix_sums(cube.values, cube.months, axis=2)
+
+
+def aggregate_periods(cube, periods, by_measure=False, measures=None,
+                      prefix=None):
+    """Sum cost and items and average the denominator over each period.
+
+    `periods` maps a period name to a `(start, end)` pair of months,
+    where `end` is excluded. Measures are summed together unless
+    `by_measure` is set; the denominator is the same for every measure.
+    Pass `prefix` from `cube_prefix_sums` to reuse it across calls.
+    Returns a frame indexed like a groupby on `pct_id` (and `measure`)
+    and `period`, with no rows if every period is outside the cube.
+    """
+    if prefix is None:
+        prefix = cube_prefix_sums(cube)
+    if measures is None:
+        measure_codes = np.arange(len(cube.measures))
+    else:
+        measure_codes = axis_codes(cube.measures, measures)
+    names = (["measure"] if by_measure else []) + ["pct_id", "period"]
+    frames = [pd.DataFrame(
+        columns=["cost", "items", "denominator"], dtype=float,
+        index=pd.MultiIndex.from_tuples([], names=names))]
+    for period, (start, end) in periods.items():
+        n_months = window_length(prefix, start, end)
+        if not n_months:
+            continue
+        totals = window_sum(prefix, start, end)[:, measure_codes]
+        cost = totals[..., COST]
+        items = totals[..., ITEMS]
+        denominator = totals[..., DENOMINATOR] / n_months
+        if by_measure:
+            index = pd.MultiIndex.from_product(
+                [cube.measures[measure_codes], cube.orgs, [period]],
+                names=["measure", "pct_id", "period"])
+            # arrays are (org, measure); the index is measure-major
+            cost, items, denominator = cost.T, items.T, denominator.T
+        else:
+            index = pd.MultiIndex.from_product(
+                [cube.orgs, [period]], names=["pct_id", "period"])
+            cost = cost.sum(axis=1)
+            items = items.sum(axis=1)
+            denominator = denominator.max(axis=1)
+        frames.append(pd.DataFrame({
+            "cost": cost.ravel(),
+            "items": items.ravel(),
+            "denominator": denominator.ravel()}, index=index))
+    return pd.concat(frames).sort_index()
@@ -0,0 +1,153 @@
+"""
+Typed, cached loading of the csv files in data/.
+
+Each csv file matches a `Schema` in `SCHEMAS`, which declares the type
+of every column: numpy dtypes, "category" for repeated codes, and
+`strftime` formats for dates, so nothing is left to inference (which
+reads dd/mm/yyyy dates such as 01/11/2018 month first).
+
+The first load of a file parses it and writes an uncompressed Feather
+copy to `CACHE_PATH`, named after a hash of the file's contents and
+its schema. Later loads find that copy and read it memory-mapped, with
+no text parsing; editing the csv or its schema makes a new copy.
+"""
+import fnmatch
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+import pandas as pd
+import pyarrow.feather as feather
+
+DATA_PATH = os.path.join('..', 'data')
+CACHE_PATH = os.path.join(DATA_PATH, 'feather_cache')
+
+Schema = namedtuple("Schema", ["columns", "dates"])
+
+# Page views exported from the Google Analytics UI
+PAGE_VIEWS = Schema(
+    columns={
+        "Page": "category",
+        "Pageviews": "int64",
+        "Unique Pageviews": "int64",
+        "Avg. Time on Page": "object",
+        "Entrances": "int64",
+        "Bounce Rate": "object",
+        "% Exit": "object",
+        "Page Value": "object",
+    },
+    dates={"Date": '%Y%m%d'})
+
+SCHEMAS = {
+    "page_views_*.csv": PAGE_VIEWS,
+    # Alert sign-ups exported from the django administration
+    "orgbookmarks-*.csv": Schema(
+        columns={
+            "id": "int64",
+            "pct_id": "category",
+            "practice_id": "category",
+            "user_id": "int64",
+            "approved": "category",
+        },
+        dates={"created_at": '%d/%m/%Y'}),
+    "practice_to_ccg.csv": Schema(
+        columns={"ccg_id": "object", "code": "object"}, dates={}),
+    "randomisation_group.csv": Schema(
+        columns={
+            "joint_id": "object",
+            "numerator": "float64",
+            "denominator": "float64",
+            "baseline": "float64",
+            "baseline_ranking": "float64",
+            "rand_num": "float64",
+            "allocation_ranking": "int64",
+            "allocation_code": "int64",
+            "allocation": "object",
+            "name": "object",
+            "joint_team": "object",
+            "CCGs_included": "float64",
+        },
+        dates={}),
+    "joint_teams.csv": Schema(
+        columns={"ccg_id": "object", "joint_team": "object"}, dates={}),
+    "ccg_populations.csv": Schema(
+        columns={
+            "pct_id": "object",
+            "over_65": "float64",
+            "total_list_size": "float64",
+        },
+        dates={}),
+    "practice_statistics.csv": Schema(
+        columns={"pct_id": "object", "list_size": "float64"}, dates={}),
+    "allocated_ccgs_visit.csv": Schema(
+        columns={
+            "joint_id": "object",
+            "name": "object",
+            "joint_team": "object",
+            "CCGs_included": "float64",
+        },
+        dates={}),
+    "allocated_ccgs_visit_timetable.csv": Schema(
+        columns={"joint_id": "object"}, dates={"date": '%d/%m/%Y'}),
+    "herbal_list.csv": Schema(
+        columns={"bnf_code": "object", "name": "object"}, dates={}),
+}
+
+
+def schema_for(name):
+    """Return the schema of the csv file `name`."""
+    for pattern, schema in SCHEMAS.items():
+        if fnmatch.fnmatch(os.path.basename(name), pattern):
+            return schema
+    raise KeyError("No schema for {}".format(name))
+
+
+def read_csv(path, schema):
+    """Parse a csv file according to `schema`."""
+    dtypes = dict(schema.columns, **{column: "object" for column in schema.dates})
+    # Google Analytics exports write large counts as "1,234"
+    df = pd.read_csv(path, usecols=list(dtypes), dtype=dtypes, thousands=',')
+    for column, date_format in schema.dates.items():
+        df[column] = pd.to_datetime(df[column], format=date_format)
+    return df
+
+
+def cache_key(path, schema):
+    """Hash the contents of the file at `path` together with its schema."""
+    digest = hashlib.sha256(json.dumps(schema, sort_keys=True).encode('utf-8'))
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2 ** 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def convert(path, cache_path=CACHE_PATH, schema=None):
+    """Parse the csv file at `path` into the cache, if it is not there yet.
+
+    The file's schema is looked up in `SCHEMAS` unless `schema` is
+    given. Returns the path of the cached copy.
+    """
+    if schema is None:
+        schema = schema_for(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    cached = os.path.join(
+        cache_path, "{}-{}.feather".format(stem, cache_key(path, schema)[:16]))
+    if not os.path.exists(cached):
+        os.makedirs(cache_path, exist_ok=True)
+        # Write to a temporary file first, so an interrupted write is not used
+        feather.write_feather(
+            read_csv(path, schema), cached + ".tmp", compression="uncompressed")
+        os.replace(cached + ".tmp", cached)
+    return cached
+
+
+def load_dataset(name, columns=None, path=DATA_PATH, cache_path=CACHE_PATH,
+                 schema=None):
+    """Load the csv file `name` from `path` with its declared types.
+
+    Only `columns` are read from the cache, if given.
+    """
+    cached = convert(os.path.join(path, name), cache_path, schema)
+    return feather.read_table(
+        cached, columns=columns, memory_map=True).to_pandas()
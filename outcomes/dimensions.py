@@ -0,0 +1,136 @@
+"""
+Integer-coded lookups from practices to CCGs, joint teams and allocations.
+
+Practices, CCGs and joint teams each get a dense integer code, their
+position in a sorted index. The links between them are arrays indexed by
+code,
+
+    practice -> CCG -> joint team -> allocation / intervention
+
+so mapping millions of events to their trial arm is a few array gathers
+rather than hash merges. A code of -1 means "not known" (or not in the
+RCT) and is carried through every lookup.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from datasets import DATA_PATH, load_dataset
+
+Dimensions = namedtuple("Dimensions", [
+    "practices", "ccgs", "joint_ids", "practice_ccg", "ccg_joint",
+    "joint_allocation", "joint_intervention"])
+
+# Keys packing a code with a day are code * DAY_SPAN + DAY_ORIGIN + days
+# since 1970-01-01, so they sort by code and then by day
+DAY_SPAN = 2 ** 21
+DAY_ORIGIN = 2 ** 20
+
+
+def load_rct_ccgs(path=DATA_PATH):
+    """Return the CCGs allocated in the RCT, with their joint team.
+
+    One row per CCG, with `joint_id`, `allocation` and `pct_id`. CCGs
+    not in a joint team are their own joint team.
+    """
+    rct_ccgs = load_dataset('randomisation_group.csv', path=path)
+    # Joint Team information (which CCGs work together in Joint Teams)
+    team = load_dataset('joint_teams.csv', path=path)
+    rct_ccgs = rct_ccgs.merge(team, on="joint_team", how="left")
+    # Fill blank ccg_ids from joint_id column, so even CCGs not in Joint
+    # Teams have a value for joint_id
+    rct_ccgs["pct_id"] = rct_ccgs["ccg_id"].combine_first(rct_ccgs["joint_id"])
+    return rct_ccgs[["joint_id", "allocation", "pct_id"]]
+
+
+def build_dimensions(rct_ccgs, practice_to_ccg):
+    """Build the lookups from `load_rct_ccgs` and a practice mapping.
+
+    `practice_to_ccg` has a `code` and `ccg_id` for each practice, as
+    in `practice_to_ccg.csv`.
+    """
+    practice_to_ccg = practice_to_ccg.dropna(subset=["code"]) \
+        .drop_duplicates("code").set_index("code")
+    practices = pd.Index(np.sort(practice_to_ccg.index.unique()), name="code")
+    ccgs = pd.Index(np.unique(np.concatenate([
+        rct_ccgs.pct_id.dropna().to_numpy(dtype=object),
+        practice_to_ccg.ccg_id.dropna().to_numpy(dtype=object)])),
+        name="pct_id")
+    joints = rct_ccgs.drop_duplicates("joint_id").set_index("joint_id")
+    joint_ids = pd.Index(np.sort(joints.index), name="joint_id")
+    joints = joints.reindex(joint_ids)
+
+    practice_ccg = ccgs.get_indexer(practice_to_ccg.ccg_id.reindex(practices))
+    ccg_joint = np.full(len(ccgs), -1)
+    ccg_joint[ccgs.get_indexer(rct_ccgs.pct_id)] = \
+        joint_ids.get_indexer(rct_ccgs.joint_id)
+    return Dimensions(
+        practices, ccgs, joint_ids, practice_ccg, ccg_joint,
+        joints.allocation.to_numpy(dtype=object),
+        joints.allocation.map({'con': 0, 'I': 1}).to_numpy(dtype=float))
+
+
+def load_dimensions(path=DATA_PATH):
+    """Build the lookups from the csv files in `path`."""
+    practice_to_ccg = load_dataset('practice_to_ccg.csv', path=path)
+    return build_dimensions(load_rct_ccgs(path), practice_to_ccg)
+
+
+def take(table, codes, fill=-1):
+    """Gather `table[codes]`, with `fill` where a code is -1."""
+    return np.append(table, fill)[codes]
+
+
+def day_keys(codes, dates, fill):
+    """Pack each code with a date into one sortable integer key.
+
+    Dates are clipped to the days a code spans; missing dates are the
+    day offset `fill`, such as 0 (before any day) or `DAY_SPAN` (after).
+    """
+    dates = pd.to_datetime(pd.Series(dates)).to_numpy().astype('datetime64[D]')
+    days = np.clip(dates.astype(np.int64) + DAY_ORIGIN, 0, DAY_SPAN - 1)
+    return np.asarray(codes) * DAY_SPAN + np.where(np.isnat(dates), fill, days)
+
+
+def lookup(index, values):
+    """Return the position of each of `values` in `index`, or -1.
+
+    Categorical values are looked up once per category.
+    """
+    if isinstance(getattr(values, "dtype", None), pd.CategoricalDtype):
+        values = pd.Categorical(values)
+        return take(index.get_indexer(values.categories), values.codes)
+    return index.get_indexer(values)
+
+
+def ccg_codes(dims, ccg_ids):
+    """Return the code of each CCG id."""
+    return lookup(dims.ccgs, ccg_ids)
+
+
+def practice_ccg_codes(dims, practice_ids):
+    """Return the code of each practice's CCG."""
+    return take(dims.practice_ccg, lookup(dims.practices, practice_ids))
+
+
+def org_ccg_codes(dims, org_ids):
+    """Return the CCG code of each org, which is a CCG or a practice."""
+    codes = ccg_codes(dims, org_ids)
+    return np.where(codes >= 0, codes, practice_ccg_codes(dims, org_ids))
+
+
+def allocations(dims, codes, index=None):
+    """Return the RCT `pct_id`, `joint_id`, `allocation` and `intervention`.
+
+    `codes` are CCG codes; values are missing for CCGs not in the RCT.
+    """
+    joint_codes = take(dims.ccg_joint, codes)
+    return pd.DataFrame({
+        "pct_id": np.where(
+            joint_codes >= 0,
+            take(dims.ccgs.to_numpy(dtype=object), codes, np.nan), np.nan),
+        "joint_id": take(dims.joint_ids.to_numpy(dtype=object), joint_codes, np.nan),
+        "allocation": take(dims.joint_allocation, joint_codes, np.nan),
+        "intervention": take(dims.joint_intervention, joint_codes, np.nan),
+    }, index=index)
@@ -0,0 +1,177 @@
+"""
+Ingest Google Analytics page view exports into a Parquet store.
+
+Exports downloaded from the Google Analytics interface, such as
+`page_views_ccg.csv`, hold formatted values, which are parsed into
+numbers:
+
+    Avg. Time on Page     00:01:02  ->  62.0 (seconds)
+    Bounce Rate, % Exit   4.55%     ->  0.0455
+    Page Value            $10.00    ->  10.0
+
+`ingest_exports` reads every export in a directory in parallel (through
+the `datasets` cache), drops rows for a page and date that a more
+recent export also covers, and writes the result to a hive-partitioned
+Parquet dataset with one directory per month, e.g.
+
+    data/page_views_store/month=2018-09/part-0.parquet
+
+Each row keeps the last date of its export, so exports ingested later
+resolve overlaps with stored rows the same way, whatever the order in
+which exports are ingested.
+
+Run it as a script to ingest a directory of exports:
+
+    python ga_exports.py ../data --pattern 'page_views_*.csv'
+"""
+import argparse
+import glob
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from datasets import PAGE_VIEWS, load_dataset
+from utils import combine_filters, run_chunks
+
+STORE_PATH = os.path.join('..', 'data', 'page_views_store')
+PATTERN = 'page_views_*.csv'
+
+# A page's views on a date come from one export only
+KEY = ["Date", "Page"]
+# The last date covered by the export a row comes from; of two exports
+# covering a page and date, the one ending later wins
+EXPORT_END = "Export End"
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("month", pa.string())]), flavor="hive")
+
+
+def parse_duration(values):
+    """Parse HH:MM:SS durations into seconds."""
+    return pd.to_timedelta(values).dt.total_seconds()
+
+
+def parse_percentage(values):
+    """Parse percentages such as "4.55%" into fractions."""
+    return pd.to_numeric(
+        values.str.replace(r'[%,]', '', regex=True)) / 100
+
+
+def parse_currency(values):
+    """Parse amounts such as "$1,000.00" into numbers."""
+    return pd.to_numeric(values.str.replace(r'[^\d.\-]', '', regex=True))
+
+
+FORMATTED = {
+    "Avg. Time on Page": parse_duration,
+    "Bounce Rate": parse_percentage,
+    "% Exit": parse_percentage,
+    "Page Value": parse_currency,
+}
+
+
+def read_export(path):
+    """Read one export, with its formatted columns parsed."""
+    df = load_dataset(
+        os.path.basename(path), path=os.path.dirname(path), schema=PAGE_VIEWS)
+    for column, parse in FORMATTED.items():
+        df[column] = parse(df[column])
+    df["Page"] = df.Page.astype(object)
+    df[EXPORT_END] = df.Date.max()
+    return df
+
+
+def combine_exports(frames):
+    """Concatenate exports, keeping the most recent where they overlap.
+
+    An export is more recent if its dates end later, as given by its
+    `EXPORT_END` column (the last date of a frame without one); rows
+    where that is missing are the oldest. Rows for a page and date
+    already in a more recent export are dropped, and where two exports
+    end on the same date the earlier frame wins.
+    """
+    frames = [df if EXPORT_END in df else df.assign(**{EXPORT_END: df.Date.max()})
+              for df in frames if len(df)]
+    if not frames:
+        return pd.DataFrame(columns=KEY + [EXPORT_END])
+    df = pd.concat(frames, ignore_index=True).sort_values(
+        EXPORT_END, ascending=False, kind="stable", na_position="last")
+    return df.loc[~df.duplicated(KEY)].sort_values(KEY, ignore_index=True)
+
+
+def read_page_views(path=STORE_PATH, columns=None, date_from=None,
+                    date_to=None):
+    """Read page views from the store, optionally for a date range.
+
+    The inclusive date range prunes whole month partitions.
+    """
+    dataset = ds.dataset(path, format="parquet", partitioning=PARTITIONING)
+    conditions = []
+    if date_from is not None:
+        date_from = pd.Timestamp(date_from)
+        conditions.append(ds.field("month") >= date_from.strftime('%Y-%m'))
+        conditions.append(ds.field("Date") >= date_from)
+    if date_to is not None:
+        date_to = pd.Timestamp(date_to)
+        conditions.append(ds.field("month") <= date_to.strftime('%Y-%m'))
+        conditions.append(ds.field("Date") <= date_to)
+    df = dataset.to_table(filter=combine_filters(conditions)).to_pandas()
+    df = df.drop(columns="month")
+    return df if columns is None else df[columns]
+
+
+def write_page_views(df, path=STORE_PATH):
+    """Write page views into the store, replacing the months they cover."""
+    df = df.assign(month=df.Date.dt.strftime('%Y-%m'))
+    ds.write_dataset(
+        pa.Table.from_pandas(df, preserve_index=False), path,
+        format="parquet",
+        partitioning=PARTITIONING,
+        basename_template="part-{i}.parquet",
+        existing_data_behavior="delete_matching")
+
+
+def ingest_exports(path, pattern=PATTERN, store_path=STORE_PATH,
+                   n_workers=None):
+    """Add every export in `path` matching `pattern` to the store.
+
+    Exports are read on `n_workers` processes (every core by default).
+    Rows already stored for the months the exports cover are replaced
+    by rows for the same page and date only from an export ending at
+    least as late as theirs did, so ingesting an older export again
+    does not overwrite newer data. Returns the number of rows in those
+    months after ingesting.
+    """
+    paths = sorted(glob.glob(os.path.join(path, pattern)))
+    if not paths:
+        raise FileNotFoundError(
+            "No exports matching {} in {}".format(pattern, path))
+    df = combine_exports(run_chunks(read_export, paths, n_workers))
+    if not len(df):
+        return 0
+    if os.path.exists(store_path):
+        stored = read_page_views(
+            store_path, date_from=df.Date.min().replace(day=1),
+            date_to=df.Date.max() + pd.offsets.MonthEnd(0))
+        if EXPORT_END not in stored:
+            # stores written before exports were dated are the oldest
+            stored[EXPORT_END] = pd.NaT
+        df = combine_exports([df, stored])
+    write_page_views(df, store_path)
+    return len(df)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('path', help="directory of Google Analytics exports")
+    parser.add_argument('--pattern', default=PATTERN,
+                        help="glob pattern of the exports (default: %(default)s)")
+    parser.add_argument('--store', default=STORE_PATH,
+                        help="Parquet store to write (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of processes (default: every core)")
+    args = parser.parse_args()
+    n_rows = ingest_exports(args.path, args.pattern, args.store, args.workers)
+    print("{} rows of page views in {}".format(n_rows, args.store))
@@ -0,0 +1,117 @@
+"""
+Local cache of OpenPrescribing measure definitions.
+
+Definitions are pinned to a commit of the openprescribing repository,
+so a (commit, measure) pair always refers to the same document. Each
+document is fetched once, stored under the SHA-256 of its contents,
+and recorded in an index keyed by commit and measure. After that,
+definitions are read from disk without any network access.
+"""
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+import requests
+
+DEFINITIONS_PATH = os.path.join('..', 'data', 'measure_definitions')
+DEFINITION_URL = (
+    "https://raw.githubusercontent.com/ebmdatalab/openprescribing/"
+    "{commit}/openprescribing/frontend/management/commands/measure_definitions/"
+    "{measure}.json")
+
+MeasureDefinition = namedtuple("MeasureDefinition", [
+    "measure",
+    "commit",
+    "name",
+    "numerator_condition",
+    "denominator_condition",
+    "definition",
+])
+
+
+def _index_path(path):
+    return os.path.join(path, "index.json")
+
+
+def _read_index(path):
+    try:
+        with open(_index_path(path), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_atomic(filename, content):
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(content)
+    os.replace(tmp, filename)
+
+
+def _store(path, commit, measure, content):
+    os.makedirs(path, exist_ok=True)
+    digest = hashlib.sha256(content).hexdigest()
+    _write_atomic(os.path.join(path, digest + ".json"), content)
+    index = _read_index(path)
+    index["{}/{}".format(commit, measure)] = digest
+    _write_atomic(_index_path(path),
+                  json.dumps(index, indent=1, sort_keys=True).encode("utf-8"))
+
+
+def _load(path, commit, measure):
+    digest = _read_index(path).get("{}/{}".format(commit, measure))
+    if digest is None:
+        return None
+    with open(os.path.join(path, digest + ".json"), "rb") as f:
+        content = f.read()
+    if hashlib.sha256(content).hexdigest() != digest:
+        raise ValueError(
+            "Cached definition for {} at {} is corrupt".format(measure, commit))
+    return content
+
+
+def _condition(clauses):
+    # Definitions store SQL clauses either as a string or a list of lines
+    if isinstance(clauses, list):
+        return " ".join(clauses)
+    return clauses
+
+
+def parse_definition(measure, commit, content):
+    """Return a `MeasureDefinition` from the raw JSON of a definition."""
+    definition = json.loads(content)
+    return MeasureDefinition(
+        measure=measure,
+        commit=commit,
+        name=definition.get("name"),
+        numerator_condition=_condition(definition.get("numerator_where")),
+        denominator_condition=_condition(definition.get("denominator_where")),
+        definition=definition)
+
+
+def get_definition(measure, commit, path=DEFINITIONS_PATH, offline=False):
+    """Return the definition of `measure` at `commit`.
+
+    The definition is fetched from GitHub and cached the first time it
+    is requested. With `offline=True`, a `KeyError` is raised instead of
+    making any network call when it is not cached.
+    """
+    content = _load(path, commit, measure)
+    if content is None:
+        if offline:
+            raise KeyError(
+                "No cached definition for {} at {}".format(measure, commit))
+        response = requests.get(
+            DEFINITION_URL.format(commit=commit, measure=measure))
+        response.raise_for_status()
+        content = response.content
+        _store(path, commit, measure, content)
+    return parse_definition(measure, commit, content)
+
+
+def get_definitions(measures, commit, path=DEFINITIONS_PATH, offline=False):
+    """Return a dict mapping each of `measures` to its definition."""
+    return {
+        measure: get_definition(measure, commit, path=path, offline=offline)
+        for measure in measures}
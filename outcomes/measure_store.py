@@ -0,0 +1,115 @@
+"""
+Local Parquet store of per-measure monthly data.
+
+The store replaces `all_measure_data.csv`. It is a hive-partitioned
+dataset with one directory per measure and month, e.g.
+
+    data/measure_store/measure=lpcoprox/month=2018-04-01/part-0.parquet
+
+so that reads can skip whole partitions when filtering on measure or
+date, and a refresh only has to fetch and write months that are not
+already stored.
+"""
+import glob
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from utils import combine_filters
+
+STORE_PATH = os.path.join('..', 'data', 'measure_store')
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("measure", pa.string()), ("month", pa.string())]),
+    flavor="hive")
+
+
+def _month_key(value):
+    return pd.Timestamp(value).strftime('%Y-%m-%d')
+
+
+def write_measure_data(df, path=STORE_PATH):
+    """Write a long frame of measure data into the store.
+
+    Any partitions already stored for the same measure and month are
+    replaced.
+    """
+    df = df.assign(month=pd.to_datetime(df.month).dt.strftime('%Y-%m-%d'))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    ds.write_dataset(
+        table, path,
+        format="parquet",
+        partitioning=PARTITIONING,
+        basename_template="part-{i}.parquet",
+        existing_data_behavior="delete_matching")
+
+
+def stored_months(path=STORE_PATH):
+    """Return a dict mapping each stored measure to its sorted months.
+
+    This only lists partition directories and does not open any files.
+    """
+    months = {}
+    for month_dir in glob.glob(os.path.join(path, "measure=*", "month=*")):
+        measure_dir, month = os.path.split(month_dir)
+        measure = os.path.basename(measure_dir)[len("measure="):]
+        months.setdefault(measure, []).append(month[len("month="):])
+    return {measure: sorted(m) for measure, m in months.items()}
+
+
+def latest_month(path=STORE_PATH, measures=None):
+    """Return the latest month stored for every one of `measures`.
+
+    Returns None if any of the measures has no data stored yet.
+    """
+    months = stored_months(path)
+    if measures is None:
+        measures = list(months)
+    if not measures or any(measure not in months for measure in measures):
+        return None
+    return pd.Timestamp(min(months[measure][-1] for measure in measures))
+
+
+def refresh_measure_data(fetch, date_from, date_to, path=STORE_PATH,
+                         measures=None):
+    """Fetch and store only the months newer than those already stored.
+
+    `fetch(date_from, date_to)` should return a long frame of measure
+    data for the given inclusive range of months, for example by calling
+    `measures.get_measure_data`. Returns the newly fetched rows.
+    """
+    latest = latest_month(path, measures)
+    if latest is not None:
+        date_from = max(pd.Timestamp(date_from),
+                        latest + pd.DateOffset(months=1))
+    date_from, date_to = _month_key(date_from), _month_key(date_to)
+    if date_from > date_to:
+        return pd.DataFrame()
+    df = fetch(date_from, date_to)
+    write_measure_data(df, path)
+    return df
+
+
+def read_measure_data(path=STORE_PATH, measures=None, pct_ids=None,
+                      date_from=None, date_to=None):
+    """Read measure data from the store, optionally filtered.
+
+    Filters on `measures` and on the inclusive date range prune whole
+    partitions; the `pct_ids` filter is pushed down to the Parquet row
+    groups.
+    """
+    dataset = ds.dataset(path, format="parquet", partitioning=PARTITIONING)
+    conditions = []
+    if measures is not None:
+        conditions.append(ds.field("measure").isin(list(measures)))
+    if pct_ids is not None:
+        conditions.append(ds.field("pct_id").isin(list(pct_ids)))
+    if date_from is not None:
+        conditions.append(ds.field("month") >= _month_key(date_from))
+    if date_to is not None:
+        conditions.append(ds.field("month") <= _month_key(date_to))
+    df = dataset.to_table(filter=combine_filters(conditions)).to_pandas()
+    df["month"] = pd.to_datetime(df.month)
+    return df
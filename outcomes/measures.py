@@ -0,0 +1,105 @@
+"""
+Extract per-measure numerators and population denominators.
+
+Every measure is fetched by a single query (see `measures_batched.sql`)
+which returns one long frame with a `measure` column, rather than one
+query per measure.
+
+The same SQL can be run offline against a local SQLite database built
+from small frames, which is useful for checking the query without
+BigQuery credentials:
+
+    read_sql = sqlite_reader(practice_statistics, prescribing, practices)
+    df = get_measure_data(conditions, '2018-04-01', '2019-10-01', read_sql,
+                          tables=LOCAL_TABLES)
+"""
+import os
+import sqlite3
+
+import pandas as pd
+
+BATCHED_SQL_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "measures_batched.sql")
+
+BIGQUERY_TABLES = {
+    "practice_statistics": "ebmdatalab.hscic.practice_statistics_all_years",
+    "prescribing": "`ebmdatalab.hscic.normalised_prescribing_standard`",
+    "practices": "ebmdatalab.research.practices_2019_09",
+}
+LOCAL_TABLES = {name: name for name in BIGQUERY_TABLES}
+
+
+def batched_measure_sql(where_conditions, date_from, date_to,
+                        tables=BIGQUERY_TABLES):
+    """Return SQL computing items, cost and denominator for every measure.
+
+    `where_conditions` maps each measure name to its numerator condition,
+    e.g. `{"lpcoprox": "(bnf_code LIKE '0407010Y0%')"}`.
+    """
+    measures = list(where_conditions)
+    names = "\n    UNION ALL\n".join(
+        "    SELECT '{}' AS measure".format(measure) for measure in measures)
+    flags = ",\n".join(
+        "    ({}) AS matches_{}".format(where_conditions[measure], i)
+        for i, measure in enumerate(measures))
+    any_condition = " OR ".join(
+        "({})".format(where_conditions[measure]) for measure in measures)
+    cases = "\n".join(
+        "      WHEN '{}' THEN matches_{}".format(measure, i)
+        for i, measure in enumerate(measures))
+    with open(BATCHED_SQL_PATH, "r") as f:
+        template = f.read()
+    return template.format(
+        date_from=date_from,
+        date_to=date_to,
+        measure_names=names,
+        measure_flags=flags,
+        any_condition=any_condition,
+        measure_cases=cases,
+        **tables)
+
+
+def get_measure_data(where_conditions, date_from, date_to, read_sql,
+                     tables=BIGQUERY_TABLES):
+    """Fetch monthly items, cost and denominator per CCG for all measures.
+
+    `read_sql` takes a SQL string and returns a DataFrame; see
+    `bigquery_reader` and `sqlite_reader`.
+    """
+    sql = batched_measure_sql(
+        where_conditions, date_from, date_to, tables=tables)
+    df = read_sql(sql)
+    df["month"] = pd.to_datetime(df.month)
+    return df
+
+
+def bigquery_reader(project_id):
+    """Return a `read_sql` function that queries BigQuery."""
+    def read_sql(sql):
+        return pd.read_gbq(sql, project_id, dialect='standard')
+    return read_sql
+
+
+def sqlite_reader(practice_statistics, prescribing, practices):
+    """Return a `read_sql` function that queries local frames.
+
+    The frames are loaded into an in-memory SQLite database under the
+    names in `LOCAL_TABLES`. Dates are stored as `YYYY-MM-DD` strings so
+    that they compare the same way as in BigQuery.
+    """
+    conn = sqlite3.connect(":memory:")
+    frames = {
+        "practice_statistics": practice_statistics,
+        "prescribing": prescribing,
+        "practices": practices,
+    }
+    for name, frame in frames.items():
+        frame = frame.copy()
+        for col in frame.columns:
+            if pd.api.types.is_datetime64_any_dtype(frame[col]):
+                frame[col] = frame[col].dt.strftime('%Y-%m-%d')
+        frame.to_sql(LOCAL_TABLES[name], conn, index=False)
+
+    def read_sql(sql):
+        return pd.read_sql_query(sql, conn)
+    return read_sql
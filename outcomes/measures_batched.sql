@@ -0,0 +1,83 @@
+-- Reconstruct CCG-level numerators and denominators for several measures
+-- in one query. The prescribing table is scanned once, each row is
+-- flagged with the measures it counts towards, and the denominator is
+-- computed once and shared by every measure. BigQuery does not
+-- materialise WITH clauses, so `matched` is referenced only once: the
+-- numerators of every measure are aggregated together, picking each
+-- row's flag for the measure it is paired with.
+WITH
+  denominator_for_all_months AS (
+  SELECT
+    stats.month AS month,
+    practices.ccg_id AS pct_id,
+    SUM(stats.total_list_size / 1000.0) AS denominator
+  FROM
+    {practice_statistics} AS stats
+  INNER JOIN
+    {practices} AS practices
+  ON
+    stats.practice = practices.code
+  WHERE
+    setting = 4
+    AND month >= '{date_from}'
+    AND month <= '{date_to}'
+  GROUP BY
+    month, pct_id
+    ),
+  measures AS (
+{measure_names}
+    ),
+  matched AS (
+  SELECT
+    practices.ccg_id AS pct_id,
+    p.month,
+    items,
+    actual_cost,
+{measure_flags}
+  FROM
+    {prescribing} AS p
+  INNER JOIN
+    {practices} AS practices
+  ON
+    p.practice = practices.code
+  WHERE
+    setting = 4
+    AND p.month >= '{date_from}'
+    AND p.month <= '{date_to}'
+    AND ({any_condition})
+    ),
+  numerator AS (
+  SELECT
+    measures.measure,
+    pct_id,
+    month,
+    SUM(items) AS items,
+    SUM(actual_cost) AS cost
+  FROM
+    matched
+  CROSS JOIN
+    measures
+  WHERE
+    CASE measures.measure
+{measure_cases}
+    END
+  GROUP BY
+    measures.measure, pct_id, month
+    )
+SELECT
+  denominator_for_all_months.month,
+  denominator_for_all_months.pct_id,
+  COALESCE(items, 0) AS items,
+  COALESCE(cost, 0) AS cost,
+  denominator,
+  measures.measure
+FROM
+  denominator_for_all_months
+CROSS JOIN
+  measures
+LEFT JOIN
+  numerator
+ON
+  denominator_for_all_months.month = numerator.month
+  AND denominator_for_all_months.pct_id = numerator.pct_id
+  AND measures.measure = numerator.measure
@@ -0,0 +1,145 @@
+"""
+Practice membership of CCGs over time.
+
+Practices move between CCGs, close and merge, so attributing activity
+to the CCG recorded in one snapshot of the practice table (such as
+`ebmdatalab.research.practices_2019_09`) misassigns some of it. Here
+snapshots of the practice table taken on different dates are turned
+into intervals
+
+    practice, [valid_from, valid_to) -> CCG
+
+and (practice, date) pairs are looked up with one `np.searchsorted`
+over keys packing the practice code with the day, so tens of millions
+of rows need no Python loop.
+
+A membership seen in a snapshot holds from that snapshot's date until
+the next snapshot showing the practice in another CCG, closed or gone.
+Memberships in the earliest snapshot are taken to hold since before it,
+and those in the latest until further notice; these open ends are NaT.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from dimensions import DAY_SPAN, day_keys, lookup, take
+
+# Snapshot date -> BigQuery table of practices; add snapshots as they are taken
+SNAPSHOTS = {
+    "2019-09-01": "ebmdatalab.research.practices_2019_09",
+}
+
+PRACTICES_SQL = '''select distinct code, ccg_id, status_code
+from `{table}`
+where setting = 4
+'''
+
+Membership = namedtuple("Membership", [
+    "practices", "ccgs", "practice_codes", "valid_from", "valid_to",
+    "ccg_codes"])
+
+
+def bigquery_snapshots(project_id, tables=SNAPSHOTS):
+    """Read each snapshot of the practice table in `tables` from BigQuery."""
+    return {
+        date: pd.read_gbq(
+            PRACTICES_SQL.format(table=table), project_id, dialect='standard')
+        for date, table in tables.items()}
+
+
+def membership_from_snapshots(snapshots):
+    """Build practice memberships from snapshots of the practice table.
+
+    `snapshots` maps the date of each snapshot to a frame with the `code`
+    and `ccg_id` of each practice, and optionally its `status_code`,
+    where "C" marks a closed practice.
+    """
+    dates = sorted(snapshots, key=pd.Timestamp)
+    frames = []
+    for i, date in enumerate(dates):
+        frame = snapshots[date]
+        if "status_code" in frame.columns:
+            frame = frame.loc[frame.status_code != "C"]
+        frame = frame.dropna(subset=["code", "ccg_id"]).drop_duplicates("code")
+        frames.append(pd.DataFrame({
+            "code": frame.code.to_numpy(dtype=object),
+            "ccg_id": frame.ccg_id.to_numpy(dtype=object),
+            "snapshot": i}))
+    seen = pd.concat(frames, ignore_index=True)
+    practices = pd.Index(np.sort(seen.code.unique()), name="code")
+    ccgs = pd.Index(np.sort(seen.ccg_id.unique()), name="ccg_id")
+
+    # (practice x snapshot) grid of CCG codes, -1 where closed or absent
+    grid = np.full((len(practices), len(dates)), -1)
+    grid[practices.get_indexer(seen.code), seen.snapshot.to_numpy()] = \
+        ccgs.get_indexer(seen.ccg_id)
+    # an interval starts wherever the CCG differs from the last snapshot's,
+    # and ends where the next one for the same practice starts
+    changed = np.ones(grid.shape, dtype=bool)
+    changed[:, 1:] = grid[:, 1:] != grid[:, :-1]
+    practice_codes, starts = np.nonzero(changed)
+    ccg_codes = grid[practice_codes, starts]
+    ends = np.r_[starts[1:], 0]
+    ends[np.r_[practice_codes[1:] != practice_codes[:-1], True]] = len(dates)
+    # drop the gaps while practices are closed or absent
+    keep = ccg_codes >= 0
+    practice_codes, starts, ends, ccg_codes = (
+        practice_codes[keep], starts[keep], ends[keep], ccg_codes[keep])
+
+    snapshot_dates = pd.DatetimeIndex(
+        [pd.Timestamp(date) for date in dates] + [pd.NaT]
+    ).to_numpy().astype('datetime64[D]')
+    valid_from = snapshot_dates[starts]
+    valid_from[starts == 0] = np.datetime64('NaT')
+    return Membership(
+        practices, ccgs, practice_codes, valid_from, snapshot_dates[ends],
+        ccg_codes)
+
+
+def ccg_at(membership, practices, dates, ccgs=None):
+    """Return the code of the CCG each practice belonged to on each date.
+
+    Codes index `membership.ccgs`, or `ccgs` if it is given (such as
+    `Dimensions.ccgs`). They are -1 for unknown practices, missing
+    dates, and dates when the practice was in no CCG.
+    """
+    practice = lookup(membership.practices, practices)
+    if not len(membership.practice_codes):
+        return np.full(len(practice), -1)
+    starts = day_keys(membership.practice_codes, membership.valid_from, 0)
+    ends = day_keys(membership.practice_codes, membership.valid_to, DAY_SPAN)
+    missing = pd.isnull(pd.Series(dates)).to_numpy()
+    keys = day_keys(practice, dates, 0)
+    interval = np.maximum(np.searchsorted(starts, keys, side="right") - 1, 0)
+    found = ((practice >= 0) & ~missing
+             & (membership.practice_codes[interval] == practice)
+             & (keys >= starts[interval]) & (keys < ends[interval]))
+    codes = np.where(found, membership.ccg_codes[interval], -1)
+    if ccgs is not None:
+        codes = take(ccgs.get_indexer(membership.ccgs), codes)
+    return codes
+
+
+def members(membership, ccgs, date_from=None, date_to=None):
+    """Return the practices that were in any of `ccgs` between two dates.
+
+    Returns a frame with the `code` of each practice and the part of
+    its membership within [date_from, date_to) as `valid_from` and
+    `valid_to`, which are NaT where unbounded. A practice that moved
+    between the CCGs has one row per membership.
+    """
+    in_ccgs = np.isin(membership.ccg_codes, membership.ccgs.get_indexer(ccgs))
+    valid_from = pd.Series(membership.valid_from[in_ccgs], dtype='datetime64[ns]')
+    valid_to = pd.Series(membership.valid_to[in_ccgs], dtype='datetime64[ns]')
+    if date_from is not None:
+        date_from = pd.Timestamp(date_from)
+        valid_from = valid_from.where(valid_from > date_from, date_from)
+    if date_to is not None:
+        date_to = pd.Timestamp(date_to)
+        valid_to = valid_to.where(valid_to < date_to, date_to)
+    df = pd.DataFrame({
+        "code": membership.practices[membership.practice_codes[in_ccgs]],
+        "valid_from": valid_from,
+        "valid_to": valid_to})
+    return df.loc[~(df.valid_from >= df.valid_to)].reset_index(drop=True)
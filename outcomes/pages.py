@@ -0,0 +1,56 @@
+"""
+Parse OpenPrescribing page paths from Google Analytics exports.
+
+Paths such as `/ccg/02P/measures/?tags=lowpriority` or
+`/practice/H81116/measures/?tags=lowpriority` are split into the type
+of organisation, its code and the measure tags with one compiled
+regular expression. Exports repeat each path on many dates, so the
+paths are factorized first and only the distinct ones are parsed; the
+results are categoricals sharing those integer codes.
+
+This replaces slicing 3 characters (for paths containing "ccg") or 6
+characters off the start of each path, which agrees on CCG and
+practice pages. Other paths, such as feedback pages
+(`/feedback/?from_url=/ccg/02P/`) or measure pages
+(`/measure/lpcoprox/ccg/02P/`), were given fragments such as "/fe" or
+"/me" that match no organisation; they are now missing. `known_orgs`
+drops them either way, so page view counts are unchanged, except that
+practice pages with "ccg" elsewhere in the path, which slicing took
+for CCG pages, now count for their practice.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+PAGE_PATTERN = re.compile(
+    r"^/(?P<org_type>ccg|practice)/(?P<org_id>[^/?#]+)"
+    r"(?:[^?#]*\?(?:[^#]*&)?tags=(?P<tags>[^&#]*))?")
+
+
+def parse_pages(pages):
+    """Return the `org_type`, `org_id` and `tags` of each page path.
+
+    `pages` is a Series of paths. The result is a frame of categoricals
+    with the same index; paths that are not a CCG or practice page (such
+    as feedback pages) are missing in every column.
+    """
+    codes, uniques = pd.factorize(pages)
+    parsed = pd.Series(uniques, dtype=object).str.extract(PAGE_PATTERN)
+    columns = {}
+    for name in parsed.columns:
+        values = pd.Categorical(parsed[name])
+        columns[name] = pd.Categorical.from_codes(
+            np.where(codes < 0, -1, values.codes[codes]), values.categories)
+    return pd.DataFrame(columns, index=pages.index)
+
+
+def known_orgs(df, ccgs, practices):
+    """Return a boolean array, True where `org_id` is a known code.
+
+    CCG codes are checked against `ccgs` and practice codes against
+    `practices`, according to `org_type`.
+    """
+    is_ccg = (df.org_type == "ccg") & df.org_id.isin(ccgs)
+    is_practice = (df.org_type == "practice") & df.org_id.isin(practices)
+    return (is_ccg | is_practice).to_numpy()
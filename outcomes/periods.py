@@ -0,0 +1,80 @@
+"""
+Aggregate monthly values over arbitrary windows using prefix sums.
+
+Months are converted to integer offsets from the first month of the
+data, and cumulative sums are kept along the month axis with a leading
+zero. The total over any window of months `[start, end)` is then
+
+    sums[..., end_offset] - sums[..., start_offset]
+
+so trying many different baseline and follow-up windows costs one
+vector subtraction each rather than a new groupby.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+PrefixSums = namedtuple("PrefixSums", ["sums", "months"])
+
+
+def month_offset(months, origin):
+    """Return the number of whole months from `origin` to each of `months`."""
+    months = pd.DatetimeIndex(pd.to_datetime(months))
+    origin = pd.Timestamp(origin)
+    return np.asarray(
+        (months.year - origin.year) * 12 + (months.month - origin.month))
+
+
+def prefix_sums(values, months, axis=-1):
+    """Return cumulative sums of `values` along its month axis.
+
+    `months` labels the positions along `axis`. Any months missing
+    between the first and last are treated as zero. The month axis is
+    moved to the end of the result, which has one more entry than the
+    number of months in the range.
+    """
+    months = pd.DatetimeIndex(pd.to_datetime(months))
+    values = np.moveaxis(np.asarray(values), axis, -1)
+    offsets = month_offset(months, months[0])
+    n_months = offsets[-1] + 1
+    if len(offsets) != n_months:
+        dense = np.zeros(values.shape[:-1] + (n_months,), dtype=values.dtype)
+        dense[..., offsets] = values
+        values = dense
+    sums = np.zeros(values.shape[:-1] + (n_months + 1,))
+    np.cumsum(values, axis=-1, out=sums[..., 1:])
+    all_months = pd.date_range(months[0], periods=n_months, freq="MS")
+    return PrefixSums(sums, all_months)
+
+
+def _bounds(prefix, start, end):
+    n_months = len(prefix.months)
+    first = np.clip(month_offset(np.atleast_1d(start), prefix.months[0]),
+                    0, n_months)
+    last = np.clip(month_offset(np.atleast_1d(end), prefix.months[0]),
+                   0, n_months)
+    return first, np.maximum(first, last)
+
+
+def window_sum(prefix, start, end):
+    """Return the total over the months in `[start, end)`.
+
+    `start` and `end` may be single months or equal-length sequences of
+    months, in which case the last axis of the result has one entry per
+    window.
+    """
+    first, last = _bounds(prefix, start, end)
+    totals = prefix.sums[..., last] - prefix.sums[..., first]
+    if np.ndim(start) == 0 and np.ndim(end) == 0:
+        totals = totals[..., 0]
+    return totals
+
+
+def window_length(prefix, start, end):
+    """Return the number of months of data in each window `[start, end)`."""
+    first, last = _bounds(prefix, start, end)
+    lengths = last - first
+    if np.ndim(start) == 0 and np.ndim(end) == 0:
+        lengths = lengths[0]
+    return lengths
@@ -0,0 +1,155 @@
+"""
+Randomisation inference for the trial outcomes.
+
+The allocation is re-drawn many times under the rule used in the
+allocation notebook: each unit gets a uniform random number, units are
+ranked by it, and those with an odd rank receive the intervention. For
+every draw the intervention coefficient of the ANCOVA model
+
+    outcome ~ covariates + intervention
+
+is computed. All draws in a chunk are handled at once: by the
+Frisch-Waugh-Lovell theorem the coefficient is the regression of the
+outcome on the intervention indicator after both are residualised on
+the covariates, and residualising a whole matrix of indicators is one
+matrix product.
+
+Draws are split into fixed-size chunks, each with its own
+`numpy.random.SeedSequence` child, so results are the same whatever
+the number of worker processes.
+"""
+import warnings
+from collections import namedtuple
+
+import numpy as np
+
+from utils import run_chunks
+
+# times the confidence interval grid is widened (fourfold each time)
+# before an endpoint on its edge is taken to be unbounded
+MAX_WIDENINGS = 5
+
+PermutationResult = namedtuple("PermutationResult", [
+    "estimate", "p_value", "conf_int", "n_draws", "null_estimates"])
+
+
+def draw_allocations(rng, n_draws, n_units, strata=None):
+    """Return a boolean array of shape (n_draws, n_units).
+
+    True marks units allocated to the intervention group. If `strata`
+    gives a non-negative integer stratum for each unit, the rule is
+    applied within each stratum separately, with the group given the
+    odd ranks drawn at random per stratum, so the extra unit of an
+    odd-sized stratum is equally likely to go to either group.
+    """
+    keys = rng.random((n_draws, n_units))
+    if strata is None:
+        return (keys.argsort(axis=1).argsort(axis=1) + 1) % 2 == 1
+    strata = np.asarray(strata)
+    # sorting on stratum + key groups units by stratum, ordered by key
+    ranks = (keys + strata).argsort(axis=1).argsort(axis=1)
+    counts = np.bincount(strata)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    parities = rng.integers(0, 2, (n_draws, len(counts)))
+    return (ranks - starts[strata] + 1 + parities[:, strata]) % 2 == 1
+
+
+def chunk_seeds(n_draws, chunk_size, seed):
+    """Split `n_draws` into chunks, each with its own seed sequence.
+
+    Returns a list of `(seed_sequence, n_draws_in_chunk)` pairs that
+    depends only on the arguments, not on how the chunks are run.
+    """
+    sizes = [chunk_size] * (n_draws // chunk_size)
+    if n_draws % chunk_size:
+        sizes.append(n_draws % chunk_size)
+    return list(zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes))
+
+
+def _design(df, outcome, covariates, treatment):
+    columns = [outcome] + list(covariates) + [treatment]
+    data = df[columns].dropna().to_numpy(dtype=float)
+    y, z = data[:, 0], data[:, -1]
+    covariates = np.column_stack([np.ones(len(data)), data[:, 1:-1]])
+    q, _ = np.linalg.qr(covariates)
+    return y, z, q
+
+
+def _residualise(q, values):
+    # Remove the part of each row of `values` explained by the covariates
+    return values - (values @ q) @ q.T
+
+
+def _null_chunk(args):
+    seed_seq, n_draws, q, y, z, strata = args
+    rng = np.random.default_rng(seed_seq)
+    allocations = _residualise(
+        q, draw_allocations(rng, n_draws, len(y), strata).astype(float))
+    scale = np.einsum("ij,ij->i", allocations, allocations)
+    estimates = allocations @ y / scale
+    # coefficient on the permuted indicator of the observed indicator,
+    # used to shift the null distribution when inverting the test
+    shifts = allocations @ z / scale
+    return estimates, shifts
+
+
+def _p_values(estimate, null_estimates, shifts, effects):
+    """Two-sided p-values for each hypothesised constant effect."""
+    p_values = np.empty(len(effects))
+    for i in range(0, len(effects), 16):
+        tau = effects[i:i + 16]
+        observed = np.abs(estimate - tau)
+        null = np.abs(null_estimates[:, None] - shifts[:, None] * tau)
+        extreme = (null >= observed - 1e-12 * np.abs(observed)).sum(axis=0)
+        p_values[i:i + 16] = (1 + extreme) / (1 + len(null_estimates))
+    return p_values
+
+
+def permutation_test(df, outcome, covariates, treatment="intervention",
+                     n_draws=100000, seed=321, n_workers=1, chunk_size=10000,
+                     alpha=0.05, n_grid=201, strata=None):
+    """Test the intervention effect by re-randomising the allocation.
+
+    Returns a `PermutationResult` with the observed coefficient, the
+    two-sided Monte Carlo p-value `(1 + extreme draws) / (1 + n_draws)`,
+    and a `1 - alpha` confidence interval found by inverting the test
+    over a grid of `n_grid` constant effects. The grid spans 4 standard
+    deviations of the null distribution either side of the estimate,
+    and is widened while the interval reaches its edge; an endpoint
+    still on the edge after `MAX_WIDENINGS` is infinite, with a
+    warning. `strata` re-draws the allocation within strata, as in
+    `draw_allocations`; it must align with the rows of `df` that have
+    no missing values.
+    """
+    y, z, q = _design(df, outcome, covariates, treatment)
+    z_resid = _residualise(q, z[None, :])[0]
+    estimate = z_resid @ y / (z_resid @ z_resid)
+
+    tasks = [(seed_seq, size, q, y, z, strata)
+             for seed_seq, size in chunk_seeds(n_draws, chunk_size, seed)]
+    chunks = run_chunks(_null_chunk, tasks, n_workers)
+    null_estimates = np.concatenate([c[0] for c in chunks])
+    shifts = np.concatenate([c[1] for c in chunks])
+
+    p_value = _p_values(estimate, null_estimates, shifts, np.zeros(1))[0]
+    spread = 4 * null_estimates.std()
+    for _ in range(MAX_WIDENINGS + 1):
+        effects = np.linspace(estimate - spread, estimate + spread, n_grid)
+        accepted = effects[
+            _p_values(estimate, null_estimates, shifts, effects) > alpha]
+        on_edge = len(accepted) and (
+            accepted[0] == effects[0] or accepted[-1] == effects[-1])
+        if not on_edge:
+            break
+        spread *= 4
+    if not len(accepted):
+        conf_int = (np.nan, np.nan)
+    else:
+        conf_int = (-np.inf if accepted[0] == effects[0] else accepted[0],
+                    np.inf if accepted[-1] == effects[-1] else accepted[-1])
+        if np.isinf(conf_int).any():
+            warnings.warn(
+                "The confidence interval reaches the edge of the grid of "
+                "effects tested, {} either side of the estimate, so it is "
+                "taken to be unbounded there".format(effects[-1] - estimate))
+    return PermutationResult(estimate, p_value, conf_int, n_draws, null_estimates)
@@ -0,0 +1,98 @@
+"""
+Simulation-based power calculation for the trial design.
+
+Monthly numerator and denominator trajectories of real units (CCGs or
+joint teams) are resampled to make simulated trials. In each one, half
+the units are allocated to the intervention with the rank-mod-2 rule,
+the intervention units' follow-up numerator is reduced by the effect
+size, and the ANCOVA model used for P1/P2
+
+    follow-up value ~ baseline value + intervention
+
+is fitted. Power is the share of simulated trials with a significant
+intervention coefficient. All trials in a grid cell are fitted together
+with `analysis.batched_ols`, and grid cells run in a process pool.
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from analysis import batched_ols
+from permutation import draw_allocations
+from utils import run_chunks
+
+
+def trajectories_from_frame(df, unit="joint_id", month="month",
+                            numerator="numerator", denominator="denominator"):
+    """Return (units x months) numerator and denominator arrays.
+
+    `df` has one row per unit and month; missing months are zero.
+    """
+    numerators = df.pivot_table(
+        index=unit, columns=month, values=numerator, aggfunc="sum", fill_value=0)
+    denominators = df.pivot_table(
+        index=unit, columns=month, values=denominator, aggfunc="sum",
+        fill_value=0).reindex_like(numerators)
+    return numerators.to_numpy(dtype=float), denominators.to_numpy(dtype=float)
+
+
+def _window_value(numerators, denominators, start, length):
+    # summed numerator per average denominator, as in the outcome notebooks
+    window = slice(start, start + length)
+    return (numerators[:, window].sum(axis=1),
+            denominators[:, window].mean(axis=1))
+
+
+def _simulate_cell(args):
+    (seed_seq, numerators, denominators, effect, n_units, followup_months,
+     baseline_months, followup_start, n_sims, alpha) = args
+    rng = np.random.default_rng(seed_seq)
+    base_num, base_den = _window_value(
+        numerators, denominators, 0, baseline_months)
+    follow_num, follow_den = _window_value(
+        numerators, denominators, followup_start, followup_months)
+
+    units = rng.integers(0, len(numerators), size=(n_sims, n_units))
+    intervention = draw_allocations(rng, n_sims, n_units).astype(float)
+    baseline = base_num[units] / base_den[units]
+    follow_up = (follow_num[units] * (1 - effect * intervention)
+                 / follow_den[units])
+    X = np.stack([np.ones_like(baseline), baseline, intervention], axis=2)
+    fit = batched_ols(X, follow_up)
+    significant = fit.pvalues[:, 2] < alpha
+    return {
+        "effect": effect,
+        "n_units": n_units,
+        "followup_months": followup_months,
+        "power": significant.mean(),
+        "mean_estimate": np.nanmean(fit.params[:, 2]),
+    }
+
+
+def simulate_power(numerators, denominators, effects, n_units=(40,),
+                   followup_months=(6,), baseline_months=6, followup_start=12,
+                   n_sims=2000, alpha=0.05, seed=321, n_workers=None):
+    """Estimate power over a grid of designs.
+
+    `numerators` and `denominators` are (units x months) arrays, e.g.
+    from `trajectories_from_frame`. `effects` are proportional
+    reductions in the intervention group's follow-up numerator (0.1 is
+    a 10% reduction). The baseline covers the first `baseline_months`
+    months, and follow-up starts `followup_start` months after the
+    baseline starts. Returns one row per combination of effect, number
+    of units and follow-up length.
+    """
+    n_months = numerators.shape[1]
+    if followup_start + max(followup_months) > n_months:
+        raise ValueError(
+            "Follow-up of {} months starting at month {} needs more than "
+            "the {} months of data".format(
+                max(followup_months), followup_start, n_months))
+    grid = list(itertools.product(effects, n_units, followup_months))
+    seeds = np.random.SeedSequence(seed).spawn(len(grid))
+    tasks = [
+        (seed_seq, numerators, denominators, effect, units, months,
+         baseline_months, followup_start, n_sims, alpha)
+        for seed_seq, (effect, units, months) in zip(seeds, grid)]
+    return pd.DataFrame(run_chunks(_simulate_cell, tasks, n_workers))
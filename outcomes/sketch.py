@@ -0,0 +1,73 @@
+"""
+Mergeable approximate quantile sketch, in the style of a t-digest.
+
+Values are summarised by a bounded number of weighted centroids, with
+small centroids near the tails and larger ones in the middle, so
+extreme quantiles (such as the 95th percentile used to cap outliers)
+stay accurate. Unlike a classic t-digest, each update merges a whole
+batch of values at once with sorting and `np.add.reduceat`, without a
+Python loop over values.
+"""
+import numpy as np
+
+
+class QuantileSketch:
+    """Approximate quantiles of a stream of values.
+
+    `compression` bounds the number of centroids kept (roughly
+    `compression` of them); higher is more accurate.
+    """
+
+    def __init__(self, compression=200):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def count(self):
+        return self.weights.sum()
+
+    def update(self, values):
+        """Add an array of values to the sketch; NaNs are ignored."""
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.min = min(self.min, values.min())
+            self.max = max(self.max, values.max())
+            self._merge(values, np.ones(len(values)))
+        return self
+
+    def merge(self, other):
+        """Add the contents of another sketch to this one."""
+        if len(other.weights):
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self._merge(other.means, other.weights)
+        return self
+
+    def _merge(self, means, weights):
+        means = np.concatenate([self.means, means])
+        weights = np.concatenate([self.weights, weights])
+        order = np.argsort(means, kind="mergesort")
+        means, weights = means[order], weights[order]
+        cumulative = np.cumsum(weights)
+        q = (cumulative - weights / 2) / cumulative[-1]
+        # arcsine scale function: one unit of k per centroid
+        k = self.compression / np.pi * np.arcsin(2 * q - 1)
+        buckets = np.floor(k)
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        self.weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / self.weights
+
+    def quantile(self, q):
+        """Return the approximate quantile(s) `q` (between 0 and 1)."""
+        if not len(self.weights):
+            return np.full(np.shape(q), np.nan)
+        positions = np.cumsum(self.weights) - self.weights / 2
+        total = positions[-1] + self.weights[-1] / 2
+        return np.interp(
+            np.asarray(q) * total,
+            np.r_[0, positions, total],
+            np.r_[self.min, self.means, self.max])
@@ -0,0 +1,76 @@
+import pandas as pd
+
+from alerts import (
+    distinct_users, load_index, read_log, refresh_alerts, window_counts)
+from membership import membership_from_snapshots
+
+
+def bookmarks(rows):
+    return pd.DataFrame(rows, columns=[
+        "id", "pct_id", "practice_id", "user_id", "created_at", "approved"
+    ]).assign(created_at=lambda df: pd.to_datetime(df.created_at))
+
+
+FIRST = bookmarks([
+    (1, "00A", None, 10, "2019-01-10", "t"),
+    (2, "00A", None, 11, "2019-02-10", "t"),
+    (3, None, "A01", 10, "2019-03-10", "t"),
+    (4, None, "A01", 12, "2019-03-11", "f"),
+])
+
+# 4 is approved, 5 is new and 2 is unchanged
+SECOND = bookmarks([
+    (1, "00A", None, 10, "2019-01-10", "t"),
+    (2, "00A", None, 11, "2019-02-10", "t"),
+    (3, None, "A01", 10, "2019-03-10", "t"),
+    (4, None, "A01", 12, "2019-03-11", "t"),
+    (5, "00B", None, 11, "2019-03-12", "t"),
+])
+
+
+def test_refresh_on_an_empty_log(tmp_path):
+    index = refresh_alerts(bookmarks([]), tmp_path)
+    assert distinct_users(index, ["00A"]) == 0
+    index = refresh_alerts(FIRST, tmp_path)
+    assert distinct_users(index, ["00A", "A01"]) == 2
+
+
+def test_refresh_appends_only_changes(tmp_path):
+    refresh_alerts(FIRST, tmp_path)
+    index = refresh_alerts(SECOND, tmp_path)
+    assert len(list(tmp_path.glob("part-*.parquet"))) == 2
+    assert len(read_log(tmp_path)) == 5
+    assert distinct_users(index, ["A01"]) == 2
+    assert distinct_users(index, ["00A", "00B", "A01"]) == 3
+    # the saved index matches one rebuilt from the log
+    assert load_index(tmp_path).keys.tolist() == index.keys.tolist()
+    (tmp_path / "index.npz").unlink()
+    assert load_index(tmp_path).keys.tolist() == index.keys.tolist()
+
+
+def test_distinct_users_between_dates(tmp_path):
+    index = refresh_alerts(SECOND, tmp_path)
+    assert distinct_users(index, ["00A"], "2019-02-10") == 1
+    assert distinct_users(index, ["00A"], None, "2019-02-10") == 1
+    assert distinct_users(index, ["00A", "A01"], "2019-02-01", "2019-03-11") == 2
+    assert distinct_users(
+        index, ["00A", "A01"], ["2019-02-01", pd.NaT],
+        ["2019-03-01", "2019-03-11"]) == 2
+    assert distinct_users(index, ["ZZZ"]) == 0
+
+
+def test_window_counts(tmp_path):
+    index = refresh_alerts(SECOND, tmp_path)
+    membership = membership_from_snapshots({
+        "2019-01-01": pd.DataFrame({"code": ["A01"], "ccg_id": ["00A"]})})
+    rct_ccgs = pd.DataFrame({"joint_id": ["J1", "J1", "J2"],
+                             "pct_id": ["00A", "00B", "00C"]})
+    dates = pd.Series(pd.to_datetime(["2019-03-01", pd.NaT]),
+                      index=["J1", "J2"])
+    counts = window_counts(
+        index, membership, rct_ccgs, dates,
+        {"before": (None, 0), "after": (0, 85)})
+    assert counts.loc["J1"].to_dict() == {
+        "alerts_ccg_before": 2, "alerts_practice_before": 0,
+        "alerts_ccg_after": 1, "alerts_practice_after": 2}
+    assert counts.loc["J2"].sum() == 0
@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+import statsmodels.formula.api as smf
+from statsmodels.stats.multitest import multipletests
+
+from analysis import (
+    batched_ols, compute_regression, influence_by_group, measure_regressions,
+    trim_5_percentiles, winsorize, winsorize_chunks)
+
+
+def pageviews(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "group": rng.choice(["a", "b", None], n),
+        "Unique Pageviews_before": rng.exponential(100, n),
+        "Unique Pageviews_after": rng.exponential(100, n)})
+
+
+def test_grouped_winsorize_leaves_missing_keys_uncapped():
+    df = pageviews()
+    capped = winsorize(df.copy(), ["Unique Pageviews_before"], upper=0.9,
+                       by="group")
+    missing = df.group.isna()
+    assert capped.loc[missing].equals(df.loc[missing])
+    for key, rows in df.groupby("group"):
+        limit = rows["Unique Pageviews_before"].quantile(0.9)
+        assert np.allclose(
+            capped.loc[rows.index, "Unique Pageviews_before"],
+            rows["Unique Pageviews_before"].clip(upper=limit))
+
+
+def test_winsorize_chunks_agrees_with_winsorize():
+    df = pageviews(5000)
+    columns = ["Unique Pageviews_before", "Unique Pageviews_after"]
+    expected = winsorize(df.copy(), columns, lower=0.05, upper=0.95,
+                         by="group")
+    chunks = pd.concat(winsorize_chunks(
+        lambda: (df.iloc[i:i + 1000] for i in range(0, len(df), 1000)),
+        columns, lower=0.05, upper=0.95, by="group"))
+    assert np.allclose(chunks[columns], expected[columns], rtol=0.02)
+
+
+def test_trim_5_percentiles_matches_thresholds():
+    df = pageviews()
+    trimmed = trim_5_percentiles(df)
+    for period in ["before", "after"]:
+        column = df["Unique Pageviews_" + period]
+        max_out = column.quantile(0.95)
+        expected = np.where(column < max_out, column, max_out)
+        assert np.array_equal(
+            trimmed["proxy_pageviews_" + period], expected)
+    assert trimmed["Unique Pageviews_before"].equals(
+        df["Unique Pageviews_before"])
+
+
+def trial(n=40, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "baseline": rng.normal(10, 2, n),
+        "intervention": np.arange(n) % 2})
+    df["outcome"] = (
+        1 + 0.8 * df.baseline + 0.5 * df.intervention + rng.normal(0, 1, n))
+    df.loc[3, "baseline"] = np.nan
+    return df
+
+
+def test_fit_ols_matches_statsmodels():
+    df = trial()
+    fit = compute_regression(
+        df, outcome="outcome", covariates=["baseline", "intervention"])
+    expected = smf.ols("outcome ~ baseline + intervention", df).fit()
+    conf_int = expected.conf_int()
+    for name in ["Intercept", "baseline", "intervention"]:
+        assert np.isclose(fit.params[name], expected.params[name])
+        assert np.isclose(fit.bse[name], expected.bse[name])
+        assert np.isclose(fit.pvalues[name], expected.pvalues[name])
+        assert np.allclose(fit.conf_int[name], conf_int.loc[name])
+    assert fit.nobs == expected.nobs
+    assert fit.df_resid == expected.df_resid
+
+
+def test_batched_ols_isolates_singular_models():
+    df = trial()
+    X = np.column_stack(
+        [np.ones(len(df)), df.baseline, df.intervention])
+    # the second model's baseline is a copy of its intervention column
+    singular = X.copy()
+    singular[:, 1] = 2 * singular[:, 2]
+    fit = batched_ols(np.stack([X, singular]), np.stack([df.outcome] * 2))
+    expected = smf.ols("outcome ~ baseline + intervention", df).fit()
+    assert np.allclose(fit.params[0], expected.params)
+    assert np.allclose(fit.bse[0], expected.bse)
+    assert np.isnan(fit.params[1]).all()
+    assert np.isnan(fit.pvalues[1]).all()
+
+
+def measures_by_team(n_teams=12, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for joint_id in range(n_teams):
+        for measure in ["m1", "m2", "m3"]:
+            row = {"joint_id": joint_id, "measure": measure,
+                   "allocation": "I" if joint_id % 2 else "con",
+                   "denominator_baseline": rng.integers(500, 1000),
+                   "denominator_follow-up": rng.integers(500, 1000)}
+            for metric in ["cost", "items"]:
+                row[metric + "_baseline"] = rng.integers(0, 200)
+                row[metric + "_follow-up"] = rng.integers(0, 200)
+            rows.append(row)
+    df = pd.DataFrame(rows)
+    # no spend at baseline on m3 makes its cost models singular
+    df.loc[df.measure == "m3", "cost_baseline"] = 0
+    return df
+
+
+def test_measure_regressions_match_separate_fits():
+    df = measures_by_team()
+    results = measure_regressions(df).set_index(["measure", "metric"])
+    pvalues = []
+    for (measure, metric), result in results.iterrows():
+        rows = df.loc[df.measure == measure]
+        fit = compute_regression(pd.DataFrame({
+            "outcome": rows[metric + "_follow-up"] / rows["denominator_follow-up"],
+            "baseline": rows[metric + "_baseline"] / rows["denominator_baseline"],
+            "intervention": (rows.allocation == "I").astype(int)}),
+            outcome="outcome", covariates=["baseline", "intervention"])
+        assert np.isclose(result.coef, fit.params["intervention"], equal_nan=True)
+        assert np.isclose(result.bse, fit.bse["intervention"], equal_nan=True)
+        assert np.allclose(
+            [result.ci_lower, result.ci_upper], fit.conf_int["intervention"],
+            equal_nan=True)
+        assert np.isclose(
+            result.pvalue, fit.pvalues["intervention"], equal_nan=True)
+        pvalues.append(fit.pvalues["intervention"])
+    assert np.isnan(results.loc[("m3", "cost")].coef)
+    assert results.coef.notnull().sum() == 5
+    # only the models that could be fitted are adjusted for
+    pvalues = np.array(pvalues)
+    fitted = ~np.isnan(pvalues)
+    reject, adjusted, _, _ = multipletests(pvalues[fitted], method="holm")
+    assert np.allclose(results.pvalue_adjusted[fitted], adjusted)
+    assert results.reject[fitted].tolist() == reject.tolist()
+    assert not results.loc[("m3", "cost")].reject
+
+
+def test_influence_by_group_matches_refitting():
+    df = trial().assign(joint_id=lambda df: ["J{}".format(i // 3) for i in df.index])
+    covariates = ["baseline", "intervention"]
+    full = compute_regression(df, outcome="outcome", covariates=covariates)
+    for pairs in [False, True]:
+        influence = influence_by_group(
+            df, "outcome", covariates, pairs=pairs)
+        assert len(influence) == (91 if pairs else 14)
+        for dropped, estimate, delta in influence.itertuples(index=False):
+            refit = compute_regression(
+                df.loc[~df.joint_id.isin(dropped.split("+"))],
+                outcome="outcome", covariates=covariates)
+            assert np.isclose(estimate, refit.params["intervention"])
+            assert np.isclose(
+                delta, estimate - full.params["intervention"])
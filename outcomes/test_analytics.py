@@ -0,0 +1,338 @@
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import analytics
+from analytics import get_report, is_splittable, iter_reports, process_report
+from analytics_fake import FakeAnalyticsService
+
+
+def days(query):
+    date_range = query['dateRanges'][0]
+    start = date(*map(int, date_range['startDate'].split('-')))
+    end = date(*map(int, date_range['endDate'].split('-')))
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def make_report(query):
+    # 10 pageviews a day with an average time on page of 1.5s, sampled
+    # whenever more than one day is requested
+    metrics = [metric['expression'] for metric in query['metrics']]
+    dimensions = [d['name'] for d in query.get('dimensions', [])]
+    values = {'ga:pageviews': ('INTEGER', 10), 'ga:avgTimeOnPage': ('TIME', 1.5)}
+    report_days = days(query)
+    if dimensions == ['ga:date']:
+        rows = [{'dimensions': [day.strftime('%Y%m%d')],
+                 'metrics': [{'values': [str(values[m][1]) for m in metrics]}]}
+                for day in report_days]
+    else:
+        rows = [{'dimensions': [],
+                 'metrics': [{'values': [
+                     str(values[m][1] * (len(report_days) if m == 'ga:pageviews' else 1))
+                     for m in metrics]}]}]
+    data = {'rows': rows}
+    if len(report_days) > 1:
+        data.update(samplesReadCounts=['500'], samplingSpaceSizes=['1000'])
+    return {
+        'columnHeader': {
+            'dimensions': dimensions,
+            'metricHeader': {'metricHeaderEntries': [
+                {'name': m, 'type': values[m][0]} for m in metrics]}},
+        'data': data}
+
+
+def query(metrics, dimensions=()):
+    return {
+        'viewId': '1',
+        'dateRanges': [{'startDate': '2019-01-01', 'endDate': '2019-01-10'}],
+        'metrics': [{'expression': m} for m in metrics],
+        'dimensions': [{'name': d} for d in dimensions]}
+
+
+def test_is_splittable():
+    assert is_splittable(query(['ga:pageviews', 'ga:uniquePageviews']))
+    assert not is_splittable(query(['ga:pageviews', 'ga:avgTimeOnPage']))
+    assert not is_splittable(query(['ga:users']))
+    assert is_splittable(query(['ga:avgTimeOnPage'], ['ga:date']))
+
+
+def test_sampled_additive_query_is_split():
+    service = FakeAnalyticsService(make_report)
+    df = get_report(service, [query(['ga:pageviews'])])
+    assert df['ga:pageviews'].tolist() == [100]
+    assert len(service.calls) > 1
+
+
+def test_sampled_non_additive_query_is_kept():
+    service = FakeAnalyticsService(make_report)
+    with pytest.warns(UserWarning):
+        df = get_report(service, [query(['ga:pageviews', 'ga:avgTimeOnPage'])])
+    assert df['ga:avgTimeOnPage'].tolist() == [1.5]
+    assert len(service.calls) == 1
+
+
+def test_sampled_query_by_date_is_split():
+    service = FakeAnalyticsService(make_report)
+    df = get_report(service, [query(['ga:avgTimeOnPage'], ['ga:date'])])
+    assert len(df) == 10
+    assert (df['ga:avgTimeOnPage'] == 1.5).all()
+
+
+def test_non_additive_query_is_not_split_up_front():
+    service = FakeAnalyticsService(make_report)
+    with pytest.raises(ValueError):
+        list(iter_reports(
+            lambda: service, [query(['ga:avgTimeOnPage'])], max_days=1))
+
+
+class StubCredentials(object):
+
+    def __init__(self):
+        self.connections = []
+
+    def authorize(self, http):
+        self.connections.append(http)
+        return http
+
+
+def test_client_reuses_services_across_queries(monkeypatch):
+    credentials = StubCredentials()
+    client = analytics.AnalyticsClient()
+    client._credentials = credentials
+    client._discovery_document = '{}'
+    monkeypatch.setattr(
+        analytics, 'build_from_document',
+        lambda document, http: FakeAnalyticsService(make_report))
+    monkeypatch.setattr(analytics, '_client', client)
+    connections = []
+    for _ in range(3):
+        df = analytics.query_analytics(
+            [query(['ga:avgTimeOnPage'], ['ga:date'])], max_workers=4)
+        assert len(df) == 10
+        connections.append(len(credentials.connections))
+    # later queries reuse the services made for the first
+    assert 1 <= connections[0] <= 4
+    assert connections[1:] == connections[:1] * 2
+
+
+def page_query(i, end_date):
+    return {'viewId': '1', 'pageToken': str(i),
+            'dateRanges': [{'startDate': '2019-01-01', 'endDate': end_date}]}
+
+
+def test_cache_evicts_expiring_pages_first(tmp_path):
+    cache = analytics.ReportCache(str(tmp_path), max_bytes=2000)
+    report = {'data': {'rows': ['x' * 100]}}
+    historical = [page_query(i, '2019-01-31') for i in range(5)]
+    for query in historical:
+        cache.put(query, report)
+    expiring = [page_query(i, '2999-01-31') for i in range(20)]
+    for query in expiring:
+        cache.put(query, report)
+    assert sum(f.stat().st_size for f in tmp_path.iterdir()) <= 2000
+    assert all(cache.get(query) == report for query in historical)
+    assert cache.get(expiring[-1]) == report
+    assert cache.get(expiring[0]) is None
+
+
+def test_cache_puts_from_many_threads(tmp_path):
+    cache = analytics.ReportCache(str(tmp_path), max_bytes=3000)
+    report = {'data': {'rows': ['x' * 100]}}
+    errors = []
+
+    def put_pages(n):
+        try:
+            for i in range(50):
+                cache.put(page_query(n * 100 + i, '2999-01-31'), report)
+        except Exception as error:
+            errors.append(error)
+    threads = [threading.Thread(target=put_pages, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_process_report_types_columns():
+    report = {
+        'columnHeader': {
+            'dimensions': ['ga:date', 'ga:pagePath'],
+            'metricHeader': {'metricHeaderEntries': [
+                {'name': 'ga:pageviews', 'type': 'INTEGER'},
+                {'name': 'ga:avgTimeOnPage', 'type': 'TIME'},
+                {'name': 'ga:pageValue', 'type': 'CURRENCY'},
+                {'name': 'ga:exitRate', 'type': 'PERCENT'},
+                {'name': 'ga:entrances', 'type': 'INTEGER'}]}},
+        'data': {'rows': [
+            {'dimensions': ['20190101', '/ccg/00A/'],
+             'metrics': [{'values': ['12', '61.5', '0.0', '25.0', '3']}]},
+            {'dimensions': ['20190102', '/ccg/00B/'],
+             'metrics': [{'values': ['7', '0', '1.25', '50.0', '']}]}]},
+        'nextPageToken': '2'}
+    columns, token = process_report(report)
+    assert token == '2'
+    assert list(columns) == [
+        'ga:date', 'ga:pagePath', 'ga:pageviews', 'ga:avgTimeOnPage',
+        'ga:pageValue', 'ga:exitRate', 'ga:entrances']
+    assert columns['ga:pagePath'].tolist() == ['/ccg/00A/', '/ccg/00B/']
+    assert columns['ga:pageviews'].dtype == np.int64
+    assert columns['ga:pageviews'].tolist() == [12, 7]
+    assert columns['ga:avgTimeOnPage'].tolist() == [61.5, 0.0]
+    assert columns['ga:pageValue'].dtype == np.float64
+    assert columns['ga:exitRate'].tolist() == [25.0, 50.0]
+    # an empty cell makes a column of floats with NaN
+    assert columns['ga:entrances'][0] == 3
+    assert np.isnan(columns['ga:entrances'][1])
+
+
+def test_process_report_with_several_date_ranges():
+    report = {
+        'columnHeader': {
+            'dimensions': ['ga:pagePath'],
+            'metricHeader': {'metricHeaderEntries': [
+                {'name': 'ga:pageviews', 'type': 'INTEGER'},
+                {'name': 'ga:avgTimeOnPage', 'type': 'TIME'}]}},
+        'data': {'rows': [
+            {'dimensions': ['/ccg/00A/'],
+             'metrics': [{'values': ['1', '2.5']}, {'values': ['3', '4.5']}]},
+            {'dimensions': ['/ccg/00B/'],
+             'metrics': [{'values': ['5', '6.5']}, {'values': ['7', '8.5']}]}]}}
+    columns, token = process_report(report)
+    assert token is None
+    # one row per row of the report, with the ranges side by side
+    assert {name: values.tolist() for name, values in columns.items()} == {
+        'ga:pagePath': ['/ccg/00A/', '/ccg/00B/'],
+        'ga:pageviews_range_0': [1, 5],
+        'ga:avgTimeOnPage_range_0': [2.5, 6.5],
+        'ga:pageviews_range_1': [3, 7],
+        'ga:avgTimeOnPage_range_1': [4.5, 8.5]}
+
+
+def test_process_report_without_rows():
+    columns, _ = process_report({'columnHeader': {
+        'dimensions': ['ga:date'],
+        'metricHeader': {'metricHeaderEntries': [
+            {'name': 'ga:pageviews', 'type': 'INTEGER'}]}}})
+    assert {name: len(values) for name, values in columns.items()} == {
+        'ga:date': 0, 'ga:pageviews': 0}
+
+
+def unsampled(query):
+    report = make_report(query)
+    for field in ('samplesReadCounts', 'samplingSpaceSizes'):
+        report['data'].pop(field, None)
+    return report
+
+
+def test_service_pool_hands_each_service_to_one_thread():
+    made = []
+    pool = analytics.ServicePool(lambda: made.append(object()) or made[-1])
+    with pool.checkout() as first:
+        with pool.checkout() as second:
+            assert first is not second
+    with pool.checkout() as service:
+        assert service is first
+    assert len(made) == 2
+
+    barrier = threading.Barrier(4)
+    in_use = []
+
+    def use():
+        with pool.checkout() as service:
+            in_use.append(service)
+            barrier.wait()
+    threads = [threading.Thread(target=use) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # services in use at the same time are all different
+    assert len({id(service) for service in in_use}) == 4
+    assert len(made) == 4
+
+
+def test_queries_are_packed_into_batches():
+    service = FakeAnalyticsService(unsampled)
+    queries = [query(['ga:pageviews'], ['ga:date']) for _ in range(12)]
+    other = query(['ga:pageviews'], ['ga:date'])
+    other['dateRanges'] = [{'startDate': '2019-02-01', 'endDate': '2019-02-10'}]
+    reports = list(iter_reports(lambda: service, queries + [other]))
+    assert sorted(key[0] for key, _ in reports) == list(range(13))
+    # twelve queries fill three batches, and the other date range its own
+    assert sorted(len(call['reportRequests']) for call in service.calls) == [
+        1, 2, 5, 5]
+    for call in service.calls:
+        assert len({str(q['dateRanges']) for q in call['reportRequests']}) == 1
+
+
+def test_rate_limited_calls_are_retried(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(analytics.time, 'sleep', sleeps.append)
+    service = FakeAnalyticsService(unsampled, rate_limit_errors=2)
+    df = get_report(service, [query(['ga:pageviews'], ['ga:date'])])
+    assert len(df) == 10
+    assert len(service.calls) == 3
+    # backing off for at least 1s, then 2s, besides spacing out calls
+    backoff = [delay for delay in sleeps if delay >= 1]
+    assert len(backoff) == 2 and backoff[1] >= 2
+
+
+@pytest.fixture
+def service(monkeypatch):
+    # the service behind query_analytics and stream_analytics
+    service = FakeAnalyticsService(unsampled, page_size=3)
+    client = analytics.AnalyticsClient()
+    client.services = analytics.ServicePool(lambda: service)
+    monkeypatch.setattr(analytics, '_client', client)
+    return service
+
+
+def test_pages_are_streamed_as_typed_frames(service):
+    queries = [query(['ga:pageviews', 'ga:avgTimeOnPage'], ['ga:date'])] * 2
+    pages = list(analytics.stream_analytics(
+        queries, columns=['date', 'pageviews', 'time_on_page']))
+    keys = sorted(key for key, _ in pages)
+    assert keys == [(i, (), page) for i in range(2) for page in range(4)]
+    for _, df in pages:
+        assert list(df.columns) == ['date', 'pageviews', 'time_on_page']
+        assert pd.api.types.is_datetime64_dtype(df.date)
+        assert df.pageviews.dtype == np.int64
+        assert df.time_on_page.dtype == np.float64
+        assert 1 <= len(df) <= 3
+    streamed = pd.concat(
+        [df for _, df in sorted(pages, key=lambda page: page[0])],
+        ignore_index=True)
+    pd.testing.assert_frame_equal(streamed, analytics.query_analytics(
+        queries, columns=['date', 'pageviews', 'time_on_page']))
+    assert streamed.date.tolist()[:10] == list(
+        pd.date_range('2019-01-01', '2019-01-10'))
+
+
+def test_split_parts_are_streamed_separately(service):
+    service.make_report = make_report
+    pages = list(analytics.stream_analytics([query(['ga:pageviews'])]))
+    # the sampled range is halved down to single days
+    assert len(pages) == 10
+    assert all(len(part) > 0 for (_, part, _), _ in pages)
+    assert sum(df['ga:pageviews'].sum() for _, df in pages) == 100
+    assert analytics.query_analytics(
+        [query(['ga:pageviews'])])['ga:pageviews'].tolist() == [100]
+
+
+def test_replay_from_the_cache(service, tmp_path):
+    queries = [query(['ga:pageviews'], ['ga:date'])]
+    fetched = analytics.query_analytics(
+        queries, cache=analytics.ReportCache(str(tmp_path)))
+    n_calls = len(service.calls)
+    replay = analytics.ReportCache(str(tmp_path), replay=True)
+    pd.testing.assert_frame_equal(
+        analytics.query_analytics(queries, cache=replay), fetched)
+    assert len(service.calls) == n_calls
+    with pytest.raises(analytics.CacheMiss):
+        analytics.query_analytics(
+            queries, cache=analytics.ReportCache(
+                str(tmp_path / 'empty'), replay=True))
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from balance import _balance_chunk, balance_statistics, scheme_design
+from permutation import draw_allocations
+
+
+def test_odd_strata_are_not_always_intervention():
+    rng = np.random.default_rng(0)
+    strata = np.array([0, 0, 1, 1, 1, 2, 3, 4])
+    allocations = draw_allocations(rng, 20000, len(strata), strata)
+    assert np.allclose(allocations.mean(axis=0), 0.5, atol=0.02)
+    # strata of two units are still split between the groups
+    assert (allocations[:, 0] != allocations[:, 1]).all()
+
+
+def test_clustered_keeps_joint_teams_together():
+    df = pd.DataFrame({
+        "joint_id": ["J1", "J1", "J2", "J3", "J3", None],
+        "baseline": [1., 2., 3., 4., 5., 6.]})
+    clusters, strata = scheme_design(df, "clustered")
+    assert list(clusters) == [0, 0, 1, 2, 2, 3] and strata is None
+    seed_seq = np.random.SeedSequence(1)
+    covariates = df[["baseline"]].to_numpy()
+    # units are given the group drawn for their cluster
+    rng = np.random.default_rng(seed_seq)
+    allocations = draw_allocations(rng, 100, 4)[:, clusters]
+    assert (allocations[:, 0] == allocations[:, 1]).all()
+    assert (allocations[:, 3] == allocations[:, 4]).all()
+    difference, _ = _balance_chunk((seed_seq, 100, covariates, clusters, None))
+    assert difference.shape == (100, 1)
+
+
+def test_single_unit_arm_is_an_error():
+    covariates = np.array([[1.], [2.], [3.], [4.]])
+    difference, smd = balance_statistics(
+        np.array([[True, False, True, False]]), covariates)
+    assert difference.tolist() == [[-1.0]]
+    with pytest.raises(ValueError):
+        balance_statistics(np.array([[True, False, False, False]]), covariates)
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cube import FIELDS, aggregate_periods, build_cube, load_cube
+
+PERIODS = {"baseline": ("2018-04-01", "2018-10-01"),
+           "follow-up": ("2019-04-01", "2019-10-01")}
+
+
+def measure_data(seed=0):
+    rng = np.random.default_rng(seed)
+    months = pd.date_range("2018-01-01", "2019-12-01", freq="MS")
+    df = pd.MultiIndex.from_product(
+        [["00A", "00B", "00C"], ["lpa", "lpb"], months],
+        names=["pct_id", "measure", "month"]).to_frame(index=False)
+    df["cost"] = rng.uniform(0, 100, len(df))
+    df["items"] = rng.integers(0, 50, len(df)).astype(float)
+    # the denominator is the list size, the same for every measure
+    sizes = df[["pct_id", "month"]].drop_duplicates().assign(
+        denominator=lambda df: rng.integers(1000, 2000, len(df)))
+    return df.merge(sizes, on=["pct_id", "month"])
+
+
+def grouped_periods(df, by):
+    # the aggregation done with groupby before the cube
+    df = df.assign(period=None)
+    for period, (start, end) in PERIODS.items():
+        df.loc[(df.month >= start) & (df.month < end), "period"] = period
+    df = df.loc[df.period.notnull()]
+    if "measure" not in by:
+        df = df.groupby(["pct_id", "period", "month"]).agg(
+            {"cost": "sum", "items": "sum", "denominator": "max"}
+        ).reset_index()
+    return df.groupby(by + ["period"]).agg(
+        {"cost": "sum", "items": "sum", "denominator": "mean"})
+
+
+def test_aggregate_periods_matches_groupby():
+    df = measure_data()
+    cube = build_cube(df)
+    pd.testing.assert_frame_equal(
+        aggregate_periods(cube, PERIODS),
+        grouped_periods(df, ["pct_id"]), check_dtype=False)
+    pd.testing.assert_frame_equal(
+        aggregate_periods(cube, PERIODS, by_measure=True),
+        grouped_periods(df, ["measure", "pct_id"]), check_dtype=False)
+
+
+def test_aggregate_periods_outside_the_cube():
+    cube = build_cube(measure_data())
+    result = aggregate_periods(cube, {"later": ("2021-01-01", "2021-07-01")})
+    assert result.empty
+    assert list(result.columns) == ["cost", "items", "denominator"]
+    assert result.index.names == ["pct_id", "period"]
+
+
+def test_cube_round_trip(tmp_path):
+    df = measure_data().iloc[1:]
+    built = build_cube(df, str(tmp_path))
+    cube = load_cube(str(tmp_path))
+    assert isinstance(cube.values, np.memmap)
+    with pytest.raises(ValueError):
+        cube.values[0, 0, 0, 0] = 1
+    assert np.array_equal(cube.values, build_cube(df).values)
+    assert np.array_equal(cube.values, built.values)
+    assert cube.orgs.equals(built.orgs)
+    assert cube.measures.equals(built.measures)
+    assert cube.months.equals(built.months)
+    assert cube.values.shape == (3, 2, 24, len(FIELDS))
+    # the cell without a row is zero
+    assert not cube.values[0, 0, 0].any()
+    pd.testing.assert_frame_equal(
+        aggregate_periods(cube, PERIODS),
+        aggregate_periods(build_cube(df), PERIODS))
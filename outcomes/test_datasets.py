@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+
+import datasets
+from datasets import PAGE_VIEWS, Schema, load_dataset, schema_for
+
+TIMETABLE = "joint_id,date,notes\nJ1,01/11/2018,x\nJ2,12/03/2019,y\n"
+
+
+def write(path, text):
+    path.write_text(text)
+    return path
+
+
+def test_schema_types_every_column(tmp_path):
+    write(tmp_path / "allocated_ccgs_visit_timetable.csv", TIMETABLE)
+    df = load_dataset("allocated_ccgs_visit_timetable.csv", path=str(tmp_path),
+                      cache_path=str(tmp_path / "cache"))
+    # dates are read day first, and columns outside the schema are dropped
+    assert df.date.tolist() == [pd.Timestamp("2018-11-01"),
+                                pd.Timestamp("2019-03-12")]
+    assert list(df.columns) == ["joint_id", "date"]
+
+    write(tmp_path / "page_views_ccg.csv",
+          "Page,Date,Pageviews,Unique Pageviews,Avg. Time on Page,Entrances,"
+          "Bounce Rate,% Exit,Page Value\n"
+          '/ccg/00A/,20190301,"1,234",1000,00:01:02,1,50.00%,25.00%,$0.00\n')
+    df = load_dataset("page_views_ccg.csv", path=str(tmp_path),
+                      cache_path=str(tmp_path / "cache"))
+    assert df.Pageviews.tolist() == [1234]
+    assert isinstance(df.Page.dtype, pd.CategoricalDtype)
+    assert df.Date.tolist() == [pd.Timestamp("2019-03-01")]
+    assert schema_for("page_views_practice.csv") == PAGE_VIEWS
+
+
+def test_schema_errors(tmp_path):
+    with pytest.raises(KeyError):
+        schema_for("unknown.csv")
+    write(tmp_path / "allocated_ccgs_visit_timetable.csv", "joint_id\nJ1\n")
+    with pytest.raises(ValueError):
+        load_dataset("allocated_ccgs_visit_timetable.csv", path=str(tmp_path),
+                     cache_path=str(tmp_path / "cache"))
+
+
+def test_cache_is_rebuilt_when_the_source_changes(tmp_path, monkeypatch):
+    cache = tmp_path / "cache"
+    source = write(tmp_path / "allocated_ccgs_visit_timetable.csv", TIMETABLE)
+
+    def load(**kwargs):
+        return load_dataset(source.name, path=str(tmp_path),
+                            cache_path=str(cache), **kwargs)
+    first = load()
+    assert len(list(cache.iterdir())) == 1
+
+    # a second load reads the cached copy without parsing the csv
+    parse = datasets.read_csv
+    monkeypatch.setattr(datasets, "read_csv", None)
+    assert load(columns=["date"]).date.equals(first.date)
+    monkeypatch.setattr(datasets, "read_csv", parse)
+
+    write(source, TIMETABLE + "J3,05/06/2019,z\n")
+    assert load().joint_id.tolist() == ["J1", "J2", "J3"]
+    assert len(list(cache.iterdir())) == 2
+    # so does a change of schema
+    schema = Schema(columns={"joint_id": "category"},
+                    dates={"date": '%d/%m/%Y'})
+    assert isinstance(load(schema=schema).joint_id.dtype, pd.CategoricalDtype)
+    assert len(list(cache.iterdir())) == 3
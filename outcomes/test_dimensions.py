@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from dimensions import (
+    DAY_ORIGIN, DAY_SPAN, allocations, build_dimensions, day_keys, lookup,
+    org_ccg_codes, take)
+
+RCT_CCGS = pd.DataFrame({
+    "joint_id": ["J1", "J1", "J2"],
+    "allocation": ["I", "I", "con"],
+    "pct_id": ["00A", "00B", "00C"]})
+
+PRACTICE_TO_CCG = pd.DataFrame({
+    "code": ["A01", "B01", "Z01", None],
+    "ccg_id": ["00A", "00B", "99Z", "00C"]})
+
+
+def test_take_and_lookup_unknown_codes():
+    index = pd.Index(["00A", "00B", "00C"])
+    assert take(np.array([10, 20, 30]), [2, -1, 0]).tolist() == [30, -1, 10]
+    assert take(np.array([1.5, 2.5]), [-1, 1], np.nan)[1] == 2.5
+    assert lookup(index, ["00C", "ZZZ", "00A"]).tolist() == [2, -1, 0]
+    # categoricals, including unknown categories and missing values
+    values = pd.Series(["00B", "ZZZ", None, "00B"], dtype="category")
+    assert lookup(index, values).tolist() == [1, -1, -1, 1]
+
+
+def test_dimensions_carry_unknown_codes_through():
+    dims = build_dimensions(RCT_CCGS, PRACTICE_TO_CCG)
+    assert list(dims.ccgs) == ["00A", "00B", "00C", "99Z"]
+    codes = org_ccg_codes(dims, ["00A", "B01", "Z01", "X99", "00C"])
+    assert codes.tolist() == [0, 1, 3, -1, 2]
+    arms = allocations(dims, codes)
+    assert arms.joint_id.tolist()[:2] == ["J1", "J1"]
+    assert arms.intervention.tolist()[:2] == [1, 1]
+    # a CCG outside the RCT and an unknown org have no allocation
+    assert arms.iloc[2:4].isnull().all().all()
+    assert arms.iloc[4].tolist() == ["00C", "J2", "con", 0]
+
+
+def test_day_keys_sort_by_code_then_day():
+    dates = pd.to_datetime(
+        ["2019-03-01", "1970-01-01", "1969-12-31", pd.NaT, "2019-03-02"])
+    keys = day_keys([1, 0, 0, 0, 0], dates, 0)
+    assert (keys % DAY_SPAN - DAY_ORIGIN)[:3].tolist() == [
+        (pd.Timestamp("2019-03-01") - pd.Timestamp("1970-01-01")).days, 0, -1]
+    assert (keys // DAY_SPAN).tolist() == [1, 0, 0, 0, 0]
+    # missing dates come before every day of a code, or after with DAY_SPAN
+    assert np.argsort(keys).tolist() == [3, 2, 1, 4, 0]
+    last = day_keys([0], [pd.NaT], DAY_SPAN)[0]
+    assert keys[4] < last <= day_keys([1], [pd.NaT], 0)[0]
+    # days beyond the span are clipped, so they stay within their code
+    far = day_keys([5], pd.to_datetime(["5000-01-01"]).as_unit("s"), 0)
+    assert far.tolist() == [5 * DAY_SPAN + DAY_SPAN - 1]
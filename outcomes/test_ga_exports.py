@@ -0,0 +1,79 @@
+import pandas as pd
+import pytest
+
+from ga_exports import (
+    EXPORT_END, combine_exports, ingest_exports, parse_currency,
+    parse_duration, parse_percentage, read_page_views)
+
+
+def test_parsers():
+    assert parse_duration(pd.Series(["00:01:02", "01:00:00"])).tolist() == [
+        62.0, 3600.0]
+    assert parse_percentage(pd.Series(["4.55%", "1,000.00%"])).tolist() == [
+        0.0455, 10.0]
+    assert parse_currency(pd.Series(["$10.00", "$1,000.50", "-$2.00"])).tolist() \
+        == [10.0, 1000.5, -2.0]
+
+
+def export(dates, pageviews, page="/ccg/00A/"):
+    return pd.DataFrame({
+        "Page": page, "Date": pd.to_datetime(dates),
+        "Pageviews": pageviews})
+
+
+def test_combine_exports_keeps_the_latest_export():
+    older = export(["2019-01-30", "2019-01-31"], [1, 2])
+    newer = export(["2019-01-31", "2019-02-01"], [20, 30])
+    for frames in [[older, newer], [newer, older]]:
+        df = combine_exports(frames)
+        assert df.Pageviews.tolist() == [1, 20, 30]
+        assert df[EXPORT_END].tolist() == [
+            pd.Timestamp("2019-01-31")] + [pd.Timestamp("2019-02-01")] * 2
+    assert combine_exports([export([], [])]).empty
+
+
+def write_export(path, rows):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(rows, columns=[
+        "Page", "Date", "Pageviews", "Unique Pageviews", "Avg. Time on Page",
+        "Entrances", "Bounce Rate", "% Exit", "Page Value",
+    ]).to_csv(path, index=False)
+
+
+def row(date, pageviews, page="/ccg/00A/"):
+    return (page, date, "{:,}".format(pageviews), pageviews, "00:01:02", 1,
+            "50.00%", "25.00%", "$0.00")
+
+
+@pytest.fixture
+def data(tmp_path, monkeypatch):
+    # the feather cache is made in ../data, as from outcomes/
+    (tmp_path / "outcomes").mkdir()
+    monkeypatch.chdir(tmp_path / "outcomes")
+    return tmp_path / "data"
+
+
+def test_ingest_round_trip(data):
+    store = str(data / "store")
+    write_export(data / "january" / "page_views_ccg.csv", [
+        row("20190130", 1), row("20190131", 2)])
+    write_export(data / "later" / "page_views_ccg.csv", [
+        row("20190131", 2000), row("20190201", 30),
+        row("20190201", 5, "/practice/A01/")])
+    assert ingest_exports(str(data / "january"), store_path=store,
+                          n_workers=1) == 2
+    assert ingest_exports(str(data / "later"), store_path=store,
+                          n_workers=1) == 4
+    df = read_page_views(store)
+    assert df.Pageviews.tolist() == [1, 2000, 30, 5]
+    assert df["Avg. Time on Page"].tolist() == [62.0] * 4
+    assert df["Bounce Rate"].tolist() == [0.5] * 4
+    assert read_page_views(
+        store, columns=["Page", "Pageviews"], date_from="2019-02-01"
+    ).to_dict("list") == {
+        "Page": ["/ccg/00A/", "/practice/A01/"], "Pageviews": [30, 5]}
+
+    # ingesting the older export again leaves the newer rows in place
+    assert ingest_exports(str(data / "january"), store_path=store,
+                          n_workers=1) == 2
+    assert read_page_views(store).Pageviews.tolist() == [1, 2000, 30, 5]
@@ -0,0 +1,72 @@
+import hashlib
+import json
+
+import pytest
+
+import measure_definitions
+from measure_definitions import get_definition, get_definitions
+
+CONTENT = json.dumps({
+    "name": "Co-proxamol",
+    "numerator_where": ["bnf_code LIKE '0407010B0%'", "AND 1 = 1"],
+    "denominator_where": "1 = 1"}).encode("utf-8")
+
+
+class Response(object):
+
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def urls(monkeypatch):
+    # the urls requested from GitHub
+    requested = []
+
+    def get(url):
+        requested.append(url)
+        return Response(CONTENT)
+    monkeypatch.setattr(measure_definitions.requests, "get", get)
+    return requested
+
+
+def test_definition_is_fetched_once(tmp_path, urls):
+    definition = get_definition("lpcoprox", "abc123", path=str(tmp_path))
+    assert urls == [measure_definitions.DEFINITION_URL.format(
+        commit="abc123", measure="lpcoprox")]
+    assert definition.name == "Co-proxamol"
+    assert definition.numerator_condition == \
+        "bnf_code LIKE '0407010B0%' AND 1 = 1"
+    assert definition.denominator_condition == "1 = 1"
+
+    # the cached copy is found without any request, even offline
+    assert get_definition("lpcoprox", "abc123", path=str(tmp_path)) == definition
+    assert get_definition(
+        "lpcoprox", "abc123", path=str(tmp_path), offline=True) == definition
+    assert len(urls) == 1
+
+    # documents are stored under the hash of their contents, so the same
+    # document at another commit is recorded in the index but not copied
+    get_definitions(["lpcoprox"], "def456", path=str(tmp_path))
+    digest = hashlib.sha256(CONTENT).hexdigest()
+    index = json.loads((tmp_path / "index.json").read_text())
+    assert index == {"abc123/lpcoprox": digest, "def456/lpcoprox": digest}
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        digest + ".json", "index.json"]
+
+
+def test_offline_with_a_cold_cache_raises(tmp_path, urls):
+    with pytest.raises(KeyError):
+        get_definition("lpcoprox", "abc123", path=str(tmp_path), offline=True)
+    assert urls == []
+
+
+def test_corrupt_cache_raises(tmp_path, urls):
+    get_definition("lpcoprox", "abc123", path=str(tmp_path))
+    digest = hashlib.sha256(CONTENT).hexdigest()
+    (tmp_path / (digest + ".json")).write_bytes(b"{}")
+    with pytest.raises(ValueError):
+        get_definition("lpcoprox", "abc123", path=str(tmp_path))
@@ -0,0 +1,60 @@
+import pandas as pd
+
+from measure_store import (
+    latest_month, read_measure_data, refresh_measure_data, stored_months,
+    write_measure_data)
+
+
+def measure_data(months, measures=("lpa", "lpb"), pct_ids=("00A", "00B"),
+                 cost=1.0):
+    df = pd.MultiIndex.from_product(
+        [list(measures), list(pct_ids), pd.to_datetime(months)],
+        names=["measure", "pct_id", "month"]).to_frame(index=False)
+    return df.assign(cost=cost, items=2.0, denominator=100.0)
+
+
+def read_sorted(path, **filters):
+    return read_measure_data(path, **filters).sort_values(
+        ["measure", "pct_id", "month"], ignore_index=True)[
+            ["measure", "pct_id", "month", "cost", "items", "denominator"]]
+
+
+def test_write_and_read_back(tmp_path):
+    df = measure_data(["2019-01-01", "2019-02-01"])
+    write_measure_data(df, str(tmp_path))
+    assert stored_months(str(tmp_path)) == {
+        "lpa": ["2019-01-01", "2019-02-01"],
+        "lpb": ["2019-01-01", "2019-02-01"]}
+    stored = read_sorted(str(tmp_path))
+    pd.testing.assert_frame_equal(
+        stored, df.sort_values(["measure", "pct_id", "month"], ignore_index=True),
+        check_dtype=False, check_categorical=False)
+    filtered = read_sorted(
+        str(tmp_path), measures=["lpb"], pct_ids=["00B"],
+        date_from="2019-02-01")
+    assert filtered[["measure", "pct_id"]].drop_duplicates().values.tolist() \
+        == [["lpb", "00B"]]
+    assert filtered.month.tolist() == [pd.Timestamp("2019-02-01")]
+
+
+def test_refresh_fetches_only_new_months(tmp_path):
+    path = str(tmp_path)
+    write_measure_data(measure_data(["2019-01-01", "2019-02-01"]), path)
+    # the February partition of one measure is rewritten
+    write_measure_data(
+        measure_data(["2019-02-01"], measures=["lpa"], cost=5.0), path)
+    fetched = []
+
+    def fetch(date_from, date_to):
+        fetched.append((date_from, date_to))
+        return measure_data(pd.date_range(date_from, date_to, freq="MS"))
+    new = refresh_measure_data(fetch, "2019-01-01", "2019-03-01", path)
+    assert fetched == [("2019-03-01", "2019-03-01")]
+    assert len(new) == 4
+    assert latest_month(path) == pd.Timestamp("2019-03-01")
+    costs = read_sorted(path).groupby(["measure", "month"]).cost.sum()
+    assert costs[("lpa", pd.Timestamp("2019-02-01"))] == 10.0
+    assert costs.drop(("lpa", pd.Timestamp("2019-02-01"))).eq(2.0).all()
+    # nothing is left to fetch
+    assert refresh_measure_data(fetch, "2019-01-01", "2019-03-01", path).empty
+    assert len(fetched) == 1
@@ -0,0 +1,34 @@
+import pandas as pd
+
+from measures import LOCAL_TABLES, get_measure_data, sqlite_reader
+
+
+def test_batched_measures_against_sqlite():
+    practices = pd.DataFrame({
+        "code": ["P1", "P2", "P3"], "ccg_id": ["00A", "00A", "00B"],
+        "setting": [4, 4, 4]})
+    practice_statistics = pd.DataFrame({
+        "month": pd.to_datetime(["2019-01-01"] * 3),
+        "practice": ["P1", "P2", "P3"],
+        "total_list_size": [1000, 3000, 2000]})
+    prescribing = pd.DataFrame({
+        "month": pd.to_datetime(["2019-01-01"] * 4),
+        "practice": ["P1", "P2", "P1", "P3"],
+        "bnf_code": ["0407010Y0AA", "0407010Y0AB", "1001010ZZAA", "0601000AA"],
+        "items": [1, 2, 4, 8],
+        "actual_cost": [1.5, 2.5, 4.5, 8.5]})
+    conditions = {
+        "lpcoprox": "(bnf_code LIKE '0407010Y0%')",
+        "lpglucosamine": "(bnf_code LIKE '1001010Z%')",
+        "lpboth": "(bnf_code LIKE '0407010Y0%' OR bnf_code LIKE '1001010Z%')",
+    }
+    read_sql = sqlite_reader(practice_statistics, prescribing, practices)
+    df = get_measure_data(
+        conditions, '2019-01-01', '2019-01-01', read_sql, tables=LOCAL_TABLES)
+    df = df.set_index(["measure", "pct_id"]).sort_index()
+    assert len(df) == 6
+    assert df.loc[("lpcoprox", "00A"), ["items", "cost"]].tolist() == [3, 4.0]
+    assert df.loc[("lpglucosamine", "00A"), ["items", "cost"]].tolist() == [4, 4.5]
+    assert df.loc[("lpboth", "00A"), ["items", "cost"]].tolist() == [7, 8.5]
+    assert df.loc[("lpboth", "00B"), ["items", "cost"]].tolist() == [0, 0]
+    assert df.loc[("lpcoprox", "00A"), "denominator"] == 4.0
@@ -0,0 +1,46 @@
+import pandas as pd
+
+from dimensions import take
+from membership import ccg_at, members, membership_from_snapshots
+
+
+def snapshots():
+    # A01 moves from 00A to 00B, A02 closes and A03 stays in 00A
+    return {
+        "2019-01-01": pd.DataFrame({
+            "code": ["A01", "A02", "A03"],
+            "ccg_id": ["00A", "00A", "00A"],
+            "status_code": ["A", "A", "A"]}),
+        "2019-07-01": pd.DataFrame({
+            "code": ["A01", "A02", "A03"],
+            "ccg_id": ["00B", "00A", "00A"],
+            "status_code": ["A", "C", "A"]}),
+    }
+
+
+def test_ccg_at_either_side_of_a_move_and_a_closure():
+    membership = membership_from_snapshots(snapshots())
+    practices = ["A01", "A01", "A02", "A02", "A03", "A03", "Z99"]
+    dates = pd.to_datetime([
+        "2018-06-01", "2019-08-01", "2019-06-30", "2019-07-01",
+        "2019-06-30", "2020-01-01", "2019-06-30"])
+    codes = ccg_at(membership, practices, dates)
+    assert list(take(membership.ccgs.to_numpy(dtype=object), codes, None)) == [
+        "00A", "00B", "00A", None, "00A", "00A", None]
+
+
+def test_ccg_at_missing_dates():
+    membership = membership_from_snapshots(snapshots())
+    codes = ccg_at(membership, ["A01"], pd.to_datetime([pd.NaT]))
+    assert list(codes) == [-1]
+
+
+def test_members_clipped_to_dates():
+    membership = membership_from_snapshots(snapshots())
+    df = members(membership, ["00A"], "2019-06-01", "2019-09-01")
+    df = df.sort_values(["code", "valid_to"], ignore_index=True)
+    assert list(df.code) == ["A01", "A02", "A03"]
+    assert list(df.valid_from) == [pd.Timestamp("2019-06-01")] * 3
+    assert list(df.valid_to) == [
+        pd.Timestamp("2019-07-01"), pd.Timestamp("2019-07-01"),
+        pd.Timestamp("2019-09-01")]
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+from pages import known_orgs, parse_pages
+
+CCGS = ["02P", "99A"]
+PRACTICES = ["H81116", "A81001"]
+
+PATHS = [
+    "/ccg/02P/measures/?tags=lowpriority",
+    "/practice/H81116/measures/?tags=core",
+    "/practice/H81116/measures/?from=list&tags=lowpriority",
+    "/ccg/99A/",
+    # measure sub-pages
+    "/ccg/02P/lpcoprox/",
+    "/practice/A81001/lpdosulepin/",
+    "/measure/lpcoprox/ccg/02P/",
+    "/measure/lpcoprox/practice/A81001/",
+    # feedback pages
+    "/feedback/?from_url=/ccg/02P/measures/%3Ftags%3Dlowpriority",
+    "/feedback/?from_url=/practice/H81116/",
+    # a practice page that slicing took for a CCG page
+    "/practice/A81001/?utm_source=ccg_newsletter",
+]
+
+
+def sliced(path):
+    # org type and code as sliced from the path before parse_pages
+    if "ccg" in path:
+        return "ccg", path.replace("/ccg/", "")[:3]
+    return "practice", path.replace("/practice/", "")[:6]
+
+
+def test_parse_pages():
+    pages = pd.Series(PATHS * 2, index=np.arange(len(PATHS) * 2) * 10)
+    parsed = parse_pages(pages)
+    assert parsed.index.equals(pages.index)
+    assert parsed.org_type.tolist()[:4] == ["ccg", "practice", "practice", "ccg"]
+    assert parsed.org_id.tolist()[:4] == ["02P", "H81116", "H81116", "99A"]
+    assert parsed.tags.tolist()[:3] == ["lowpriority", "core", "lowpriority"]
+    assert parsed.tags[pages.str.contains("tags=")].notnull().all()
+    assert parsed.tags[~pages.str.contains("tags=")].isnull().all()
+    assert parsed.iloc[len(PATHS):].reset_index(drop=True).equals(
+        parsed.iloc[:len(PATHS)].reset_index(drop=True))
+
+
+def test_parse_pages_agrees_with_slicing_on_known_orgs():
+    parsed = parse_pages(pd.Series(PATHS))
+    known = known_orgs(parsed, CCGS, PRACTICES)
+    old = pd.DataFrame([sliced(path) for path in PATHS],
+                       columns=["org_type", "org_id"])
+    old_known = known_orgs(old, CCGS, PRACTICES)
+    # every page slicing attributed to an org is attributed to the same one
+    assert known[old_known].all()
+    assert (parsed.org_id.astype(object)[old_known]
+            == old.org_id[old_known]).all()
+    # the rest were fragments such as "/fe" that matched no org and are
+    # now missing, apart from the practice page mistaken for a CCG page
+    assert old.org_id[~old_known].tolist() == [
+        "/me", "/measu", "/fe", "/feedb", "/pr"]
+    assert parsed.org_id[~old_known].isna().tolist() == [
+        True, True, True, True, False]
+    assert parsed.org_id.iloc[-1] == "A81001"
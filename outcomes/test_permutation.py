@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from permutation import chunk_seeds, draw_allocations, permutation_test
+
+
+def trial(n=30, effect=0.0, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "baseline": rng.normal(10, 2, n),
+        "intervention": draw_allocations(rng, 1, n)[0].astype(int)})
+    df["outcome"] = (
+        df.baseline + effect * df.intervention + rng.normal(0, 1, n))
+    return df
+
+
+def coefficient(df, allocation):
+    X = np.column_stack([np.ones(len(df)), df.baseline, allocation])
+    return np.linalg.lstsq(X, df.outcome, rcond=None)[0][-1]
+
+
+def test_p_value_matches_refitting_each_draw():
+    df = trial(effect=0.8)
+    result = permutation_test(
+        df, "outcome", ["baseline"], n_draws=500, seed=1, chunk_size=200)
+    draws = np.concatenate([
+        draw_allocations(np.random.default_rng(seed_seq), size, len(df))
+        for seed_seq, size in chunk_seeds(500, 200, 1)])
+    null = np.array([coefficient(df, draw) for draw in draws])
+    estimate = coefficient(df, df.intervention)
+    assert np.isclose(result.estimate, estimate)
+    assert np.allclose(result.null_estimates, null)
+    extreme = (np.abs(null) >= np.abs(estimate) - 1e-9).sum()
+    assert np.isclose(result.p_value, (1 + extreme) / 501)
+    lower, upper = result.conf_int
+    assert lower < estimate < upper
+    # the same draws whatever the number of workers
+    parallel = permutation_test(
+        df, "outcome", ["baseline"], n_draws=500, seed=1, chunk_size=200,
+        n_workers=2)
+    assert np.array_equal(parallel.null_estimates, result.null_estimates)
+
+
+def test_draws_within_strata_cover_every_allocation_evenly():
+    strata = np.array([0, 0, 0, 1, 1, 1, 1])
+    draws = draw_allocations(np.random.default_rng(0), 36000, 7, strata)
+    # each stratum is split as evenly as it can be
+    assert set(draws[:, :3].sum(axis=1)) == {1, 2}
+    assert set(draws[:, 3:].sum(axis=1)) == {2}
+    # 6 ways to split the first stratum and 6 the second, equally likely
+    counts = pd.Series([tuple(draw) for draw in draws]).value_counts()
+    assert len(counts) == 36
+    assert counts.min() > 800 and counts.max() < 1200
+
+
+def test_confidence_interval_covers_the_effect():
+    covered = []
+    for seed in range(60):
+        lower, upper = permutation_test(
+            trial(effect=0.5, seed=seed), "outcome", ["baseline"],
+            n_draws=400, seed=seed).conf_int
+        covered.append(lower <= 0.5 <= upper)
+    assert 0.85 <= np.mean(covered) <= 1
+
+
+def test_unbounded_confidence_interval_is_infinite():
+    # with two units every draw is as extreme as the observed allocation
+    df = pd.DataFrame({"outcome": [1.0, 3.0], "intervention": [1, 0]})
+    with pytest.warns(UserWarning):
+        result = permutation_test(df, "outcome", [], n_draws=100)
+    assert result.conf_int == (-np.inf, np.inf)
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from windows import day_offsets, label_windows, window_masks
+
+WINDOWS = {"before": (-28, 0), "after": (1, 29)}
+
+
+def test_day_offsets():
+    offsets = day_offsets(
+        ["00A", "00A", "00B", "00C", "00A"],
+        pd.to_datetime(["2019-03-01", "2019-02-01", "2019-03-01",
+                        "2019-03-01", pd.NaT]),
+        ["00A", "00B", "00A"],
+        pd.to_datetime(["2019-03-01", pd.NaT, "2019-03-01"]))
+    # on the day, a month before, no intervention date, unknown org and
+    # no event date
+    assert offsets[:2].tolist() == [0, -28]
+    assert np.isnan(offsets[2:]).all()
+
+
+def test_day_offsets_rejects_two_dates_for_an_org():
+    with pytest.raises(ValueError):
+        day_offsets(["00A"], ["2019-03-01"], ["00A", "00A"],
+                    ["2019-03-01", "2019-03-02"])
+
+
+def test_label_windows_at_the_edges():
+    offsets = [-29, -28, -1, 0, 1, 28, 29, np.nan]
+    assert label_windows(offsets, WINDOWS).tolist() == [
+        "none", "before", "before", "none", "after", "after", "none", "none"]
+    assert window_masks(offsets, WINDOWS).tolist() == [
+        [False, False], [True, False], [True, False], [False, False],
+        [False, True], [False, True], [False, False], [False, False]]
+
+
+def test_label_windows_overlapping_and_unbounded():
+    windows = {"week": (0, 7), "month": (0, 28), "earlier": (None, 0),
+               "later": (28, None)}
+    offsets = [-10000, -1, 0, 6, 7, 27, 28, 10000]
+    assert label_windows(offsets, windows, default="-").tolist() == [
+        "earlier", "earlier", "week", "week", "month", "month", "later",
+        "later"]
+    assert window_masks(offsets, windows).sum(axis=1).tolist() == [
+        1, 1, 2, 2, 1, 1, 1, 1]
@@ -0,0 +1,30 @@
+"""
+Helpers shared by the simulation, store and ingest modules.
+"""
+import functools
+import operator
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def run_chunks(func, tasks, n_workers=1):
+    """Apply `func` to each task, in a process pool if `n_workers > 1`.
+
+    `n_workers=None` uses every core.
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if n_workers > 1:
+        with ProcessPoolExecutor(n_workers) as executor:
+            return list(executor.map(func, tasks))
+    return [func(task) for task in tasks]
+
+
+def combine_filters(conditions):
+    """Combine `pyarrow.dataset` filter expressions with `&`.
+
+    Returns None, which reads every row, if there are no conditions.
+    """
+    if not conditions:
+        return None
+    return functools.reduce(operator.and_, conditions)
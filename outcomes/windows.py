@@ -0,0 +1,86 @@
+"""
+Assign dated events to windows around each organisation's intervention.
+
+Events (org, date), such as page views or alert sign-ups, are matched to
+interventions (org, date) by looking their orgs up in the intervention
+table, so the two tables are never merged. Each event's offset in days
+from its org's intervention is then placed among the sorted edges of
+all the windows with one `np.searchsorted`, so labelling events with
+several windows (for example 7, 28 and 84 days either side) costs
+about the same as with one.
+
+Windows are given as a dict mapping a name to `(start, end)` offsets in
+days, with `start` included and `end` excluded; either may be None for
+an unbounded window. For example `{"before": (-28, 0), "after": (1, 29)}`
+is the 28 days either side of the intervention, excluding the day itself.
+"""
+import numpy as np
+import pandas as pd
+
+
+def _days(dates):
+    # Dates as float days since the epoch, NaN where missing
+    dates = pd.to_datetime(pd.Series(dates)).to_numpy().astype('datetime64[D]')
+    days = dates.astype(np.int64).astype(float)
+    days[np.isnat(dates)] = np.nan
+    return days
+
+
+def day_offsets(event_orgs, event_dates, orgs, dates):
+    """Return the days from each event's org's intervention to the event.
+
+    `orgs` and `dates` describe the interventions, with at most one date
+    per org. The offset is NaN for events without a date, or whose org
+    has no intervention date.
+    """
+    table = pd.DataFrame({
+        "org": np.asarray(orgs), "day": _days(dates)}).drop_duplicates()
+    repeated = table.org[table.org.duplicated()]
+    if len(repeated):
+        raise ValueError("More than one intervention date for: {}".format(
+            list(repeated.unique())))
+    positions = pd.Index(table.org).get_indexer(np.asarray(event_orgs))
+    intervention_days = np.where(
+        positions >= 0, table.day.to_numpy()[positions], np.nan)
+    return _days(event_dates) - intervention_days
+
+
+def _segments(windows):
+    # The sorted edges of all the windows, and which windows cover each
+    # of the segments between them (segment i starts at edge i - 1)
+    edges = np.unique([edge for bounds in windows.values()
+                       for edge in bounds if edge is not None])
+    starts = np.r_[-np.inf, edges]
+    cover = np.empty((len(starts), len(windows)), dtype=bool)
+    for j, (start, end) in enumerate(windows.values()):
+        start = -np.inf if start is None else start
+        end = np.inf if end is None else end
+        cover[:, j] = (starts >= start) & (starts < end)
+    return edges, cover
+
+
+def window_masks(offsets, windows):
+    """Return an (n_events, n_windows) boolean array of window membership.
+
+    Windows may overlap, so an event can be in several of them. Events
+    with a NaN offset are in none.
+    """
+    offsets = np.asarray(offsets, dtype=float)
+    edges, cover = _segments(windows)
+    segments = np.searchsorted(edges, offsets, side="right")
+    return cover[segments] & ~np.isnan(offsets)[:, None]
+
+
+def label_windows(offsets, windows, default="none"):
+    """Return the name of the window containing each offset.
+
+    Where windows overlap the first one listed wins; offsets in no
+    window (or NaN) are labelled `default`.
+    """
+    offsets = np.asarray(offsets, dtype=float)
+    edges, cover = _segments(windows)
+    names = np.array(list(windows) + [default], dtype=object)
+    first = np.where(cover.any(axis=1), cover.argmax(axis=1), len(windows))
+    labels = names[first][np.searchsorted(edges, offsets, side="right")]
+    labels[np.isnan(offsets)] = default
+    return labels